@@ -0,0 +1,137 @@
+"""Measures how a client flooding the generation endpoint affects everyone else, with and without admission control.
+
+    poetry run python benchmarks/admission.py --duration 20
+    poetry run python benchmarks/admission.py --noisy-clients 64 --latency 2 --workers 2
+
+A noisy client generates cards for a new subject on every request, `--noisy-clients` at a time, so each one reaches
+the upstream. Regular clients, each from its own address, read cards and reviews and generate once in a while. Both
+runs use the same seeded database and fake upstream; the first with `ADMISSION_ENABLED=false`, the second with the
+default limits. Addresses are sent as X-Forwarded-For, as from a single proxy the API is told to trust.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+
+import aiohttp
+
+import fake_openai
+from common import LANGUAGES, summarize
+from e2e import seed, start_api, wait_until_ready
+
+NOISY_IP = "10.0.0.1"
+
+
+async def noisy(session, url):
+    return await session.post(f"{url}/card/generate", headers={"X-Forwarded-For": NOISY_IP}, json={
+        "subject": f"flood {uuid.uuid4().hex}",
+        "language": random.choice(LANGUAGES),
+    })
+
+
+def regular(number, params):
+    headers = {"X-Forwarded-For": f"10.1.{number // 250}.{number % 250 + 1}"}
+
+    async def request(session, url):
+        if random.random() < params.regular_generate_share:
+            return await session.post(f"{url}/card/generate", headers=headers, json={
+                "subject": f"topic {random.randint(1, 20)}",
+                "language": random.choice(LANGUAGES),
+            })
+        if random.random() < 0.5:
+            return await session.get(f"{url}/card/", headers=headers, params={"language": random.choice(LANGUAGES)})
+        return await session.get(f"{url}/card/review", headers=headers, params={
+            "username": f"bench{random.randint(1, params.users)}",
+            "language": random.choice(LANGUAGES),
+        })
+
+    return request
+
+
+async def client(session, url, operation, group, deadline, records):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            response = await operation(session, url)
+            async with response:
+                await response.read()
+            status = response.status
+            if status == 429:
+                # a well-behaved client waits as told; the noisy one only pauses for as long
+                await asyncio.sleep(min(float(response.headers.get("Retry-After", 1)), 1))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            status = type(err).__name__
+        records.append((group, status, time.perf_counter() - start))
+
+
+async def drive(url, params):
+    records = []
+    deadline = time.perf_counter() + params.duration
+    timeout = aiohttp.ClientTimeout(total=60)
+    connector = aiohttp.TCPConnector(limit=params.noisy_clients + params.regular_clients)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        await asyncio.gather(
+            *[client(session, url, noisy, "noisy", deadline, records) for _ in range(params.noisy_clients)],
+            *[client(session, url, regular(number, params), "regular", deadline, records)
+              for number in range(params.regular_clients)],
+        )
+    return records
+
+
+def report(records, duration):
+    groups = {}
+    for group in ("noisy", "regular"):
+        rows = [(status, elapsed) for name, status, elapsed in records if name == group]
+        admitted = [elapsed for status, elapsed in rows if status != 429]
+        statuses = [str(status) for status, _ in rows]
+        groups[group] = {
+            **summarize(admitted),
+            "throughput_rps": round(len(admitted) / duration, 2),
+            "statuses": {status: statuses.count(status) for status in sorted(set(statuses))},
+        }
+    return groups
+
+
+def run(params):
+    database_uri = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+    seed(database_uri, params.cards, params.users, 50)
+    upstream = fake_openai.serve(port=params.openai_port, latency=params.latency)
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{params.port}"
+    results = {}
+    try:
+        for name, enabled in (("without_admission", "false"), ("with_admission", "true")):
+            api = start_api(database_uri, params.port, params.openai_port, params.workers, quiet=True, env={
+                "ADMISSION_ENABLED": enabled,
+                "ADMISSION_TRUSTED_PROXIES": "1",
+                "LOG_SINKS": "none",
+            })
+            try:
+                asyncio.run(wait_until_ready(url, api))
+                results[name] = report(asyncio.run(drive(url, params)), params.duration)
+            finally:
+                api.terminate()
+                api.wait(timeout=30)
+    finally:
+        upstream.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cards", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--noisy-clients", type=int, default=32, help="concurrent requests of the noisy client")
+    parser.add_argument("--regular-clients", type=int, default=16)
+    parser.add_argument("--regular-generate-share", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, default=1, help="hypercorn worker processes")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--latency", type=float, default=1.0, help="fake upstream latency in seconds")
+    parser.add_argument("--port", type=int, default=9126)
+    parser.add_argument("--openai-port", type=int, default=8768)
+    print(json.dumps(run(parser.parse_args()), indent=2))
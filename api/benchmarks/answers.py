@@ -0,0 +1,68 @@
+"""Compares recording a study session one card at a time against a single POST /card/answers.
+
+Needs a running API with some cards for the language (e.g. seeded through benchmarks/generate_load.py):
+
+    python benchmarks/answers.py --sessions 50 --session-size 10
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+import aiohttp
+
+from common import summarize
+
+
+async def per_card(session, url, username, card_ids):
+    for card_id in card_ids:
+        async with session.post(f"{url}/card/{card_id}", json={"username": username, "correct": random.random() < 0.7}) as response:
+            await response.read()
+
+
+async def batch(session, url, username, card_ids):
+    answers = [{"card_id": card_id, "correct": random.random() < 0.7} for card_id in card_ids]
+    headers = {"Idempotency-Key": uuid.uuid4().hex}
+    async with session.post(f"{url}/card/answers", json={"username": username, "answers": answers}, headers=headers) as response:
+        await response.read()
+
+
+async def measure(session, url, username, card_ids, strategy, sessions, session_size):
+    samples = []
+    for _ in range(sessions):
+        picked = random.sample(card_ids, min(session_size, len(card_ids)))
+        start = time.perf_counter()
+        await strategy(session, url, username, picked)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+async def run(url, language, sessions, session_size):
+    username = f"bench-{uuid.uuid4().hex[:8]}"
+    async with aiohttp.ClientSession() as session:
+        async with session.post(f"{url}/user/", json={"username": username}) as response:
+            await response.read()
+        card_ids = set()
+        for _ in range(5):
+            async with session.get(f"{url}/card/", params={"language": language}) as response:
+                card_ids.update(card["id"] for card in (await response.json())["cards"])
+        if not card_ids:
+            raise SystemExit(f"No {language} cards to answer, generate some first")
+        card_ids = sorted(card_ids)
+        return {
+            "session_size": session_size,
+            "per_card": await measure(session, url, username, card_ids, per_card, sessions, session_size),
+            "batch": await measure(session, url, username, card_ids, batch, sessions, session_size),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:9124")
+    parser.add_argument("--language", default="Italian")
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--session-size", type=int, default=10)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.url, args.language, args.sessions, args.session_size)), indent=2))
@@ -0,0 +1,76 @@
+"""Helpers shared by the benchmark scripts."""
+import random
+
+from sqlalchemy import insert, text
+
+from ricotta.models.card import Card, IncorrectOption, UserCardInteraction
+from ricotta.models.user import User
+
+LANGUAGES = ["Italian", "French", "Spanish"]
+CHUNK_SIZE = 10000
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def summarize(samples):
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+    }
+
+
+def seed_cards(conn, size, languages=LANGUAGES):
+    """Bulk inserts `size` cards with three incorrect options each, spread over `languages`."""
+    for start in range(0, size, CHUNK_SIZE):
+        stop = min(size, start + CHUNK_SIZE)
+        conn.execute(insert(Card), [{
+            "id": card_id,
+            "word": f"word{card_id}",
+            "language": random.choice(languages),
+            "english": f"english{card_id}",
+            "sentenceLANG": f"sentence {card_id}",
+            "sentenceEN": f"sentence en {card_id}",
+        } for card_id in range(start + 1, stop + 1)])
+        conn.execute(insert(IncorrectOption), [
+            {"option": f"option{card_id}-{n}", "card_id": card_id}
+            for card_id in range(start + 1, stop + 1) for n in range(3)
+        ])
+
+
+def seed_users(conn, count):
+    """Inserts users `bench1` to `bench{count}` with ids 1 to `count`."""
+    conn.execute(insert(User), [{"id": user_id, "username": f"bench{user_id}"} for user_id in range(1, count + 1)])
+
+
+def seed_interactions(conn, users, cards, per_user):
+    """Gives each of the first `users` users `per_user` interactions with random cards among the first `cards`.
+
+    Only the counters are set; run scheduler.backfill_schedule afterwards to fill in the spaced repetition state.
+    """
+    per_user = min(per_user, cards)
+    rows = []
+    for user_id in range(1, users + 1):
+        for card_id in random.sample(range(1, cards + 1), per_user):
+            times_seen = random.randint(1, 5)
+            rows.append({"user_id": user_id, "card_id": card_id, "times_seen": times_seen,
+                         "times_correct": random.randint(0, times_seen)})
+        if len(rows) >= CHUNK_SIZE:
+            conn.execute(insert(UserCardInteraction), rows)
+            rows = []
+    if rows:
+        conn.execute(insert(UserCardInteraction), rows)
+
+
+def reset_sequences(conn):
+    """Moves Postgres id sequences past the explicit ids used by the seed helpers, so the app can insert rows."""
+    if conn.dialect.name != "postgresql":
+        return
+    for table in (Card.__tablename__, User.__tablename__):
+        conn.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))"))
@@ -0,0 +1,52 @@
+"""Compares two results of benchmarks/e2e.py, e.g. measured on two commits.
+
+    python benchmarks/compare.py before.json after.json --threshold 10
+
+Prints the change of every percentile and of throughput per endpoint as JSON. Exits with status 1 when the p95 of an
+endpoint got slower by more than `--threshold` percent, or its throughput dropped by more than that.
+"""
+import argparse
+import json
+
+METRICS = ("p50_ms", "p95_ms", "p99_ms", "throughput_rps")
+
+
+def change(before, after):
+    if not before:
+        return None
+    return round((after - before) / before * 100, 1)
+
+
+def compare(before, after, threshold):
+    endpoints = {}
+    regressions = []
+    for name in sorted(set(before["endpoints"]) & set(after["endpoints"])):
+        endpoints[name] = {}
+        for metric in METRICS:
+            old, new = before["endpoints"][name][metric], after["endpoints"][name][metric]
+            endpoints[name][metric] = {"before": old, "after": new, "change_pct": change(old, new)}
+        p95 = endpoints[name]["p95_ms"]["change_pct"]
+        throughput = endpoints[name]["throughput_rps"]["change_pct"]
+        if (p95 is not None and p95 > threshold) or (throughput is not None and throughput < -threshold):
+            regressions.append(name)
+    return {
+        "before": before.get("commit"),
+        "after": after.get("commit"),
+        "endpoints": endpoints,
+        "regressions": regressions,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed regression in percent")
+    args = parser.parse_args()
+    with open(args.before) as file:
+        before = json.load(file)
+    with open(args.after) as file:
+        after = json.load(file)
+    result = compare(before, after, args.threshold)
+    print(json.dumps(result, indent=2))
+    raise SystemExit(1 if result["regressions"] else 0)
@@ -0,0 +1,154 @@
+"""Local stand-in for the OpenAI chat completions API.
+
+Run with `python benchmarks/fake_openai.py --port 8765 --latency 2.0` and point the API at it with
+`OPENAI_API_BASE=http://127.0.0.1:8765/v1`. Requests with `"stream": true` get the same content as server-sent
+chunks, with the latency spread over the whole stream. `--failure-rate 0.05` answers that share of requests with
+`--failure-status` (500 by default, 429 to exercise rate limiting) after the same latency. `--malformed-rate` answers
+that share with content that is not JSON, and `--slow-rate` waits `--slow-latency` instead, to exercise hedging.
+"""
+import argparse
+import json
+import random
+import string
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def random_word(length=8):
+    return "".join(random.choices(string.ascii_lowercase, k=length))
+
+
+def fake_words(count=5):
+    words = []
+    for _ in range(count):
+        word = random_word()
+        words.append({
+            "word": word,
+            "incorrect_options": [random_word() for _ in range(3)],
+            "english": random_word(),
+            "sentenceLANG": f"{word} {uuid.uuid4().hex}",
+            "sentenceEN": f"{random_word()} {uuid.uuid4().hex}",
+        })
+    return words
+
+
+def completion(content, model, prompt):
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        # about four characters per token, which is close enough for load tests
+        "usage": {
+            "prompt_tokens": len(prompt) // 4,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": (len(prompt) + len(content)) // 4,
+        },
+    }
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    chunk_size = 16
+    failure_rate = 0.0
+    failure_status = 500
+    malformed_rate = 0.0
+    slow_rate = 0.0
+    slow_latency = 10.0
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if random.random() < self.failure_rate:
+            time.sleep(self.latency)
+            self.fail()
+            return
+        content = json.dumps({"words": fake_words()})
+        if random.random() < self.malformed_rate:
+            content = "Sure! Here are the words: " + content[:len(content) // 2]
+        if body.get("stream"):
+            self.stream(content, body.get("model", "fake"))
+            return
+        time.sleep(self.slow_latency if random.random() < self.slow_rate else self.latency)
+        payload = json.dumps(completion(content, body.get("model", "fake"), json.dumps(body.get("messages", [])))).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def fail(self):
+        payload = json.dumps({"error": {
+            "message": "Injected failure",
+            "type": "rate_limit_exceeded" if self.failure_status == 429 else "server_error",
+        }}).encode()
+        self.send_response(self.failure_status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        if self.failure_status == 429:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def stream(self, content, model):
+        """Sends the content as chat.completion.chunk events, spreading the latency evenly over the chunks."""
+        pieces = [content[i:i + self.chunk_size] for i in range(0, len(content), self.chunk_size)]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for piece in pieces:
+            time.sleep(self.latency / len(pieces))
+            chunk = {
+                "id": "chatcmpl-stream",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            # the client gave up on the request, like the losing side of a hedged pair
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host="127.0.0.1", port=8765, latency=0.0, failure_rate=0.0, failure_status=500, malformed_rate=0.0,
+          slow_rate=0.0, slow_latency=10.0):
+    handler = type("Handler", (FakeOpenAIHandler,), {
+        "latency": latency,
+        "failure_rate": failure_rate,
+        "failure_status": failure_status,
+        "malformed_rate": malformed_rate,
+        "slow_rate": slow_rate,
+        "slow_latency": slow_latency,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=2.0, help="seconds to wait before answering")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of requests that fail, 0 to 1")
+    parser.add_argument("--failure-status", type=int, default=500)
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="share of answers that are not JSON")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="share of requests that take --slow-latency")
+    parser.add_argument("--slow-latency", type=float, default=10.0)
+    args = parser.parse_args()
+    print(f"Fake OpenAI listening on http://{args.host}:{args.port}/v1 (latency {args.latency}s)")
+    serve(args.host, args.port, args.latency, args.failure_rate, args.failure_status, args.malformed_rate,
+          args.slow_rate, args.slow_latency).serve_forever()
@@ -0,0 +1,64 @@
+"""Measures read endpoint latency while card generations are in flight.
+
+Start the fake upstream and the API first:
+
+    python benchmarks/fake_openai.py --latency 5
+    ADMISSION_ENABLED=false OPENAI_API_BASE=http://127.0.0.1:8765/v1 OPENAI_API_KEY=fake \\
+        poetry run hypercorn src.ricotta.main:app --bind 127.0.0.1:9124
+
+then run `python benchmarks/generate_load.py --generators 32`. The p99 of GET /card/ should stay roughly the same
+in both phases.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+
+from common import summarize
+
+
+async def read_loop(session, url, language, duration):
+    samples = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        async with session.get(f"{url}/card/", params={"language": language}) as response:
+            await response.read()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def generate(session, url, language, subject):
+    async with session.post(f"{url}/card/generate", json={"subject": subject, "language": language}) as response:
+        await response.read()
+        return response.status
+
+
+async def run(url, language, generators, readers, duration):
+    async with aiohttp.ClientSession() as session:
+        idle = await asyncio.gather(*[read_loop(session, url, language, duration) for _ in range(readers)])
+
+        generations = [asyncio.create_task(generate(session, url, language, f"topic {i}")) for i in range(generators)]
+        await asyncio.sleep(0.1)
+        busy = await asyncio.gather(*[read_loop(session, url, language, duration) for _ in range(readers)])
+        statuses = await asyncio.gather(*generations)
+
+    return {
+        "idle": summarize([sample for samples in idle for sample in samples]),
+        "generating": summarize([sample for samples in busy for sample in samples]),
+        "generate_statuses": {str(status): statuses.count(status) for status in set(statuses)},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:9124")
+    parser.add_argument("--language", default="Italian")
+    parser.add_argument("--generators", type=int, default=32)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+    result = asyncio.run(run(args.url, args.language, args.generators, args.readers, args.duration))
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,55 @@
+"""Measures request throughput with logging disabled, written synchronously, queued, and queued with sampling.
+
+    poetry run python benchmarks/logging_overhead.py --duration 15 --clients 32
+
+Each variant starts the API with different logging settings against the same seeded SQLite database and drives
+GET /card/ and GET /card/review for `--duration` seconds. The console sink writes to /dev/null, so the numbers show the
+cost on the request path rather than of a terminal.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+
+from e2e import drive, report, seed, start_api, wait_until_ready
+
+VARIANTS = {
+    "disabled": {"LOG_SINKS": "none"},
+    "blocking": {"LOG_QUEUE": "false"},
+    "queued": {},
+    "queued_sampled": {"REQUEST_LOG_SAMPLE_RATE": "0.1"},
+}
+
+
+def run(params):
+    database_uri = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+    seed(database_uri, params.cards, params.users, params.interactions)
+    mix = {"get_cards": 3, "review": 1}
+    results = {}
+    for name, env in VARIANTS.items():
+        env = {"LOG_SINKS": "console,file", "LOG_FILE": f"bench-{name}.log", **env}
+        api = start_api(database_uri, params.port, params.openai_port, 1, env=env, quiet=True)
+        url = f"http://127.0.0.1:{params.port}"
+        try:
+            asyncio.run(wait_until_ready(url, api))
+            records = asyncio.run(drive(url, params, mix))
+        finally:
+            api.terminate()
+            api.wait(timeout=30)
+        results[name] = report(records, params.duration)["total"]
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cards", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--interactions", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--port", type=int, default=9126)
+    parser.add_argument("--openai-port", type=int, default=8767, help="unused, no generations are requested")
+    args = parser.parse_args()
+    print(json.dumps(run(args), indent=2))
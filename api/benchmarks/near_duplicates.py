@@ -0,0 +1,178 @@
+"""Measures the near duplicate sentence index: signing, rebuilding from the database, and checking candidates.
+
+    poetry run python benchmarks/near_duplicates.py --cards 1000000
+    poetry run python benchmarks/near_duplicates.py --cards 100000 --queries 5000 --threshold 0.6
+
+A temporary SQLite database is seeded with `--cards` cards of one language, made of random words from a fixed
+vocabulary, with their signatures stored as `save_generated_cards` does. The index is then rebuilt from it as a worker
+does on its first generation. Each card's word is one of its sentence's words. Candidates are rewordings of stored
+sentences (another word replaced, an article added, punctuation and case changed) for the same word, the same
+rewordings for another word of the sentence, which ask about a sentence the deck already has, the same sentences with
+the card's word swapped for another, which are new cards however similar, and unrelated new sentences. The result has
+the latency per candidate, the share of rewordings caught and of swapped-word sentences wrongly rejected by their true
+similarity, and the share of new sentences wrongly rejected.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import string
+import tempfile
+import time
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from common import CHUNK_SIZE, summarize
+from ricotta.config import config
+from ricotta.models.card import Card
+from ricotta.models.user import User  # noqa: F401 registers the users table on the metadata
+from ricotta.services.database import Base
+from ricotta.services.sentence_index import minhash, sentence_index, similarity
+
+LANGUAGE = "Italian"
+ARTICLES = ["il", "la", "un", "una", "lo"]
+# a stored card, and one for another word whose sentence only differs by that word; the second must be kept
+STORED_EXAMPLE = ("caffè", "Ogni mattina prima di andare al lavoro bevo un caffè caldo in cucina.")
+OTHER_WORD_EXAMPLE = ("tè", "Ogni mattina prima di andare al lavoro bevo un tè caldo in cucina.")
+
+
+def vocabulary(size):
+    return ["".join(random.choices(string.ascii_lowercase, k=random.randint(3, 9))) for _ in range(size)]
+
+
+def sentence(words):
+    return " ".join(random.choices(words, k=random.randint(6, 12))).capitalize() + "."
+
+
+def reword(word, text, words):
+    """The sentence reworded for the same word."""
+    tokens = text.rstrip(".").split()
+    change = random.choice(["replace", "article", "punctuation"])
+    if change == "replace":
+        tokens[random.choice([i for i, token in enumerate(tokens) if token.casefold() != word.casefold()])] = random.choice(words)
+    elif change == "article":
+        tokens.insert(random.randrange(len(tokens)), random.choice(ARTICLES))
+    else:
+        return word, text.upper().rstrip(".") + "!"
+    return word, " ".join(tokens) + "."
+
+
+def cross_word(word, text, words):
+    """The sentence reworded for another of its words, which keeps the card's word."""
+    _, reworded = reword(word, text, words)
+    others = [token for token in reworded.rstrip(".!").split() if token.casefold() != word.casefold()]
+    return random.choice(others), reworded
+
+
+def other_word(word, text, words):
+    """The same sentence for a new card, with the card's word swapped for another."""
+    replacement = random.choice(words)
+    tokens = [replacement if token.casefold() == word.casefold() else token for token in text.rstrip(".").split()]
+    return replacement, " ".join(tokens) + "."
+
+
+def rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+
+
+def seed(engine, size, words, keep):
+    """Inserts `size` cards with their signatures, the first being STORED_EXAMPLE, and returns `keep` of their
+    (word, sentence) pairs and the signing time."""
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    kept, signing = [], 0.0
+    with engine.begin() as conn:
+        for start in range(0, size, CHUNK_SIZE):
+            rows = []
+            for number in range(start, min(size, start + CHUNK_SIZE)):
+                if number == 0:
+                    word, text = STORED_EXAMPLE
+                else:
+                    # the number keeps sentences unique, like the unique column requires
+                    text = f"{sentence(words)[:-1]} {number}."
+                    word = random.choice(text.split()[:-1])
+                began = time.perf_counter()
+                signature = minhash(text)
+                signing += time.perf_counter() - began
+                rows.append({"word": word, "language": LANGUAGE, "english": f"english{number}",
+                             "sentenceLANG": text, "sentenceEN": f"sentence en {number}", "sentence_minhash": signature})
+                if 0 < number <= keep:
+                    kept.append((word, text))
+            conn.execute(insert(Card.__table__), rows)
+    return kept, signing / size
+
+
+def check(candidates):
+    elapsed, rejected = [], []
+    for word, text in candidates:
+        start = time.perf_counter()
+        rejected.append(sentence_index.near_duplicate(LANGUAGE, word, text) is not None)
+        elapsed.append(time.perf_counter() - start)
+    return elapsed, rejected
+
+
+def run(params):
+    random.seed(params.seed)
+    config.near_duplicate_threshold = params.threshold
+    words = vocabulary(params.vocabulary)
+    engine = create_engine("sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db"))
+
+    start = time.perf_counter()
+    stored, signing = seed(engine, params.cards, words, params.queries)
+    seeding = time.perf_counter() - start
+
+    before = rss_mb()
+    start = time.perf_counter()
+    with sessionmaker(bind=engine)() as db:
+        sentence_index.refresh(db, LANGUAGE)
+    rebuild = time.perf_counter() - start
+    index_mb = rss_mb() - before
+
+    rewordings = [(text, reword(word, text, words)) for word, text in stored]
+    cross_words = [(text, cross_word(word, text, words)) for word, text in stored]
+    other_words = [(text, other_word(word, text, words)) for word, text in stored]
+    fresh = [(random.choice(words), sentence(words)) for _ in range(params.queries)]
+    minhash.cache_clear()
+    reworded_elapsed, reworded_rejected = check([candidate for _, candidate in rewordings])
+    cross_elapsed, cross_rejected = check([candidate for _, candidate in cross_words])
+    other_elapsed, other_rejected = check([candidate for _, candidate in other_words])
+    fresh_elapsed, fresh_rejected = check(fresh)
+    _, example_rejected = check([OTHER_WORD_EXAMPLE])
+
+    def by_similarity(pairs, rejected):
+        counts = {}
+        for (original, (_, text)), was_rejected in zip(pairs, rejected):
+            bucket = "above_threshold" if similarity(original, text) >= params.threshold else "below_threshold"
+            total, hits = counts.get(bucket, (0, 0))
+            counts[bucket] = (total + 1, hits + was_rejected)
+        return {
+            **{f"rejected_{bucket}": round(hits / total, 3) for bucket, (total, hits) in counts.items()},
+            **{f"count_{bucket}": total for bucket, (total, _) in counts.items()},
+        }
+
+    return {
+        "cards": params.cards,
+        "threshold": params.threshold,
+        "seed_seconds": round(seeding, 1),
+        "signing_us_per_card": round(signing * 1e6, 1),
+        "rebuild_seconds": round(rebuild, 1),
+        "rebuild_us_per_card": round(rebuild / params.cards * 1e6, 1),
+        "index_rss_mb": index_mb,
+        "reworded": {**summarize(reworded_elapsed), **by_similarity(rewordings, reworded_rejected)},
+        "reworded_for_another_word": {**summarize(cross_elapsed), **by_similarity(cross_words, cross_rejected)},
+        "other_word": {**summarize(other_elapsed), **by_similarity(other_words, other_rejected),
+                       "example_rejected": example_rejected[0]},
+        "fresh": {**summarize(fresh_elapsed), "false_rejections": round(sum(fresh_rejected) / len(fresh), 4)},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cards", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=2000, help="candidates checked of each kind")
+    parser.add_argument("--vocabulary", type=int, default=20000, help="distinct words sentences are made of")
+    parser.add_argument("--threshold", type=float, default=config.near_duplicate_threshold)
+    parser.add_argument("--seed", type=int, default=1)
+    print(json.dumps(run(parser.parse_args()), indent=2))
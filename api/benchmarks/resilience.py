@@ -0,0 +1,93 @@
+"""Measures generation success rate and latency against a misbehaving fake upstream, with and without the client's
+retries and hedging.
+
+    poetry run python benchmarks/resilience.py --requests 200 --failure-rate 0.1 --malformed-rate 0.05
+    poetry run python benchmarks/resilience.py --slow-rate 0.05 --slow-latency 8 --hedge-after 1
+
+Each variant calls `ChatExtractor.extract` directly, `--concurrency` at a time, against the fake server in this
+process. "plain" makes a single attempt per call, as the extractor used to; "retries" adds backoff, the circuit breaker
+and the malformed JSON retry; "hedged" also sends a second request once the first has taken `--hedge-after` seconds.
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+
+import fake_openai
+from common import summarize
+from ricotta.config import config
+from ricotta.services.chat_extractor import ChatExtractor, close_session
+from ricotta.services.openai_client import openai_client
+
+
+def variants(params):
+    return {
+        "plain": {"openai_max_retries": 0, "openai_json_retries": 0, "openai_hedge_after": 0},
+        "retries": {"openai_max_retries": params.retries, "openai_json_retries": 1, "openai_hedge_after": 0},
+        "hedged": {"openai_max_retries": params.retries, "openai_json_retries": 1,
+                   "openai_hedge_after": params.hedge_after},
+    }
+
+
+async def measure(chat, params):
+    semaphore = asyncio.Semaphore(params.concurrency)
+    elapsed, errors = [], {}
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await chat.extract(description="food", db_words=[], language="Italian")
+                elapsed.append(time.perf_counter() - start)
+            except Exception as err:
+                errors[type(err).__name__] = errors.get(type(err).__name__, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(params.requests)])
+    seconds = time.perf_counter() - start
+    await close_session()
+    return {
+        **summarize(elapsed),
+        "success_rate": round(len(elapsed) / params.requests, 3),
+        "errors": errors,
+        "seconds": round(seconds, 1),
+    }
+
+
+def run(params):
+    upstream = fake_openai.serve(port=params.openai_port, latency=params.latency, failure_rate=params.failure_rate,
+                                 failure_status=params.failure_status, malformed_rate=params.malformed_rate,
+                                 slow_rate=params.slow_rate, slow_latency=params.slow_latency)
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    chat = ChatExtractor(model_key="fake", model="fake", api_base=f"http://127.0.0.1:{params.openai_port}/v1")
+    config.openai_backoff_base = params.backoff_base
+    config.openai_requests_per_minute = 0
+    results = {}
+    try:
+        for name, settings in variants(params).items():
+            for key, value in settings.items():
+                setattr(config, key, value)
+            # every variant starts with a closed circuit
+            openai_client.breakers.clear()
+            results[name] = asyncio.run(measure(chat, params))
+    finally:
+        upstream.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.3, help="fake upstream latency in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.1)
+    parser.add_argument("--failure-status", type=int, default=500)
+    parser.add_argument("--malformed-rate", type=float, default=0.05)
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--slow-latency", type=float, default=5.0)
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--backoff-base", type=float, default=0.1)
+    parser.add_argument("--hedge-after", type=float, default=1.0)
+    parser.add_argument("--openai-port", type=int, default=8767)
+    print(json.dumps(run(parser.parse_args()), indent=2))
@@ -0,0 +1,51 @@
+"""Compares time to first card of POST /card/generate/stream against the full POST /card/generate round-trip.
+
+Start the fake upstream and the API as described in benchmarks/generate_load.py, then run
+`python benchmarks/stream_first_card.py --requests 20`. Every request uses a new subject so the cache is not hit.
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+import aiohttp
+
+from common import summarize
+
+
+async def blocking(session, url, language):
+    start = time.perf_counter()
+    async with session.post(f"{url}/card/generate", json={"subject": uuid.uuid4().hex, "language": language}) as response:
+        await response.read()
+    return time.perf_counter() - start
+
+
+async def streaming(session, url, language):
+    start = time.perf_counter()
+    first_card = None
+    async with session.post(f"{url}/card/generate/stream", json={"subject": uuid.uuid4().hex, "language": language}) as response:
+        async for line in response.content:
+            if first_card is None and line.startswith(b"event: card"):
+                first_card = time.perf_counter() - start
+    return first_card, time.perf_counter() - start
+
+
+async def run(url, language, requests):
+    async with aiohttp.ClientSession() as session:
+        full = [await blocking(session, url, language) for _ in range(requests)]
+        streamed = [await streaming(session, url, language) for _ in range(requests)]
+    return {
+        "generate": summarize(full),
+        "stream_first_card": summarize([first for first, _ in streamed if first is not None]),
+        "stream_complete": summarize([total for _, total in streamed]),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:9124")
+    parser.add_argument("--language", default="Italian")
+    parser.add_argument("--requests", type=int, default=20)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.url, args.language, args.requests)), indent=2))
@@ -10,9 +10,75 @@ class Settings(BaseSettings):
     environment: str = os.getenv('ENVIRONMENT', 'local')
     debug: bool = False
     log_file: str = os.getenv('LOG_FILE', 'ricotta.log')
+    log_level: str = os.getenv('LOG_LEVEL', 'INFO')
+    log_format: str = os.getenv('LOG_FORMAT', 'json')
+    log_sinks: str = os.getenv('LOG_SINKS', 'console,file')
+    log_syslog_address: str = os.getenv('LOG_SYSLOG_ADDRESS', '/dev/log')
+    log_queue: bool = os.getenv('LOG_QUEUE', 'true').lower() == 'true'
+    request_log_sample_rate: float = float(os.getenv('REQUEST_LOG_SAMPLE_RATE', 1.0))
+    request_log_slow_ms: int = int(os.getenv('REQUEST_LOG_SLOW_MS', 1000))
     testing: bool = False
     openai_api_key: str = os.getenv('OPENAI_API_KEY')
     openai_model: str = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo-1106')
+    openai_api_base: str = os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1')
+    openai_timeout: int = int(os.getenv('OPENAI_TIMEOUT', 40))
+    openai_pool_size: int = int(os.getenv('OPENAI_POOL_SIZE', 100))
+    openai_requests_per_minute: int = int(os.getenv('OPENAI_REQUESTS_PER_MINUTE', 500))
+    openai_burst: int = int(os.getenv('OPENAI_BURST', 20))
+    openai_buckets_max_entries: int = int(os.getenv('OPENAI_BUCKETS_MAX_ENTRIES', 10000))
+    openai_max_retries: int = int(os.getenv('OPENAI_MAX_RETRIES', 3))
+    openai_backoff_base: float = float(os.getenv('OPENAI_BACKOFF_BASE', 0.5))
+    openai_backoff_max: float = float(os.getenv('OPENAI_BACKOFF_MAX', 8))
+    openai_breaker_threshold: int = int(os.getenv('OPENAI_BREAKER_THRESHOLD', 5))
+    openai_breaker_reset: float = float(os.getenv('OPENAI_BREAKER_RESET', 30))
+    openai_hedge_after: float = float(os.getenv('OPENAI_HEDGE_AFTER', 0))
+    openai_json_retries: int = int(os.getenv('OPENAI_JSON_RETRIES', 1))
+    admission_enabled: bool = os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'
+    # per client IP, sized for a classroom of about 40 behind one address all generating a deck at once
+    admission_generations_per_minute: int = int(os.getenv('ADMISSION_GENERATIONS_PER_MINUTE', 60))
+    admission_generation_burst: int = int(os.getenv('ADMISSION_GENERATION_BURST', 40))
+    admission_key_generations_per_minute: int = int(os.getenv('ADMISSION_KEY_GENERATIONS_PER_MINUTE', 300))
+    admission_key_generation_burst: int = int(os.getenv('ADMISSION_KEY_GENERATION_BURST', 60))
+    admission_reads_per_minute: int = int(os.getenv('ADMISSION_READS_PER_MINUTE', 3000))
+    admission_read_burst: int = int(os.getenv('ADMISSION_READ_BURST', 500))
+    admission_max_generations_in_flight: int = int(os.getenv('ADMISSION_MAX_GENERATIONS_IN_FLIGHT', 32))
+    admission_max_reads_in_flight: int = int(os.getenv('ADMISSION_MAX_READS_IN_FLIGHT', 256))
+    admission_max_queued_jobs: int = int(os.getenv('ADMISSION_MAX_QUEUED_JOBS', 200))
+    admission_shed_retry_after: int = int(os.getenv('ADMISSION_SHED_RETRY_AFTER', 2))
+    admission_trusted_proxies: int = int(os.getenv('ADMISSION_TRUSTED_PROXIES', 0))
+    admission_local_max_entries: int = int(os.getenv('ADMISSION_LOCAL_MAX_ENTRIES', 100000))
+    near_duplicate_enabled: bool = os.getenv('NEAR_DUPLICATE_ENABLED', 'true').lower() == 'true'
+    near_duplicate_threshold: float = float(os.getenv('NEAR_DUPLICATE_THRESHOLD', 0.7))
+    prompt_exclusion_tokens: int = int(os.getenv('PROMPT_EXCLUSION_TOKENS', 300))
+    generation_concurrency: int = int(os.getenv('GENERATION_CONCURRENCY', 8))
+    api_workers: int = int(os.getenv('API_WORKERS', 0))
+    graceful_timeout: int = int(os.getenv('GRACEFUL_TIMEOUT', 30))
+    prepare_database_on_startup: bool = os.getenv('PREPARE_DATABASE_ON_STARTUP', 'true').lower() == 'true'
+    database_async: bool = os.getenv('DATABASE_ASYNC', 'false').lower() == 'true'
+    db_pool_size: int = int(os.getenv('DB_POOL_SIZE', 10))
+    db_max_overflow: int = int(os.getenv('DB_MAX_OVERFLOW', 20))
+    db_pool_timeout: int = int(os.getenv('DB_POOL_TIMEOUT', 30))
+    db_pool_recycle: int = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    db_pool_pre_ping: bool = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    sqlite_busy_timeout: int = int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000))
+    redis_url: str = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+    generation_cache_ttl: int = int(os.getenv('GENERATION_CACHE_TTL', 60 * 60 * 24 * 7))
+    generation_cache_max_entries: int = int(os.getenv('GENERATION_CACHE_MAX_ENTRIES', 10000))
+    generation_lock_enabled: bool = os.getenv('GENERATION_LOCK_ENABLED', 'false').lower() == 'true'
+    card_cache_ttl: int = int(os.getenv('CARD_CACHE_TTL', 60 * 60 * 24 * 30))
+    card_cache_max_entries: int = int(os.getenv('CARD_CACHE_MAX_ENTRIES', 50000))
+    user_cache_ttl: int = int(os.getenv('USER_CACHE_TTL', 60))
+    user_cache_max_entries: int = int(os.getenv('USER_CACHE_MAX_ENTRIES', 100000))
+    job_queue_backend: str = os.getenv('JOB_QUEUE_BACKEND', 'memory')
+    job_ttl: int = int(os.getenv('JOB_TTL', 60 * 60 * 24))
+    job_memory_max_entries: int = int(os.getenv('JOB_MEMORY_MAX_ENTRIES', 10000))
+    answer_receipt_ttl: int = int(os.getenv('ANSWER_RECEIPT_TTL', 60 * 60 * 24 * 7))
+    answer_receipt_prune_interval: int = int(os.getenv('ANSWER_RECEIPT_PRUNE_INTERVAL', 600))
+    answer_receipt_prune_batch: int = int(os.getenv('ANSWER_RECEIPT_PRUNE_BATCH', 1000))
+    job_workers: int = int(os.getenv('JOB_WORKERS', 2))
+    review_page_size: int = int(os.getenv('REVIEW_PAGE_SIZE', 20))
+    review_page_max_size: int = int(os.getenv('REVIEW_PAGE_MAX_SIZE', 100))
+    metrics_enabled: bool = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
     learning_language: str = "Italian"
     supported_languages: list = ["Arabic",
                                  "French",
@@ -42,6 +108,10 @@ class Settings(BaseSettings):
         else:
             return self.cors_origins
 
+    @property
+    def workers(self):
+        return self.api_workers or os.cpu_count() or 1
+
     @property
     def docs_url(self):
         if self.environment == 'production':
@@ -1,6 +1,12 @@
+import atexit
+import copy
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, SysLogHandler
 
 from ricotta.config import config
 
@@ -10,13 +16,138 @@ if not os.path.exists(LOG_DIR):
 
 LOG_FILE_PATH = os.path.join(LOG_DIR, config.log_file)
 
-LOGGING_LEVEL = logging.INFO
+LOGGING_LEVEL = getattr(logging, config.log_level.upper(), logging.INFO)
 LOGGING_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 
-logging.basicConfig(level=LOGGING_LEVEL, format=LOGGING_FORMAT)
+REQUEST_LOGGER = "ricotta.requests"
 
-file_handler = RotatingFileHandler(LOG_FILE_PATH, maxBytes=10485760, backupCount=5)
-file_handler.setLevel(LOGGING_LEVEL)
-file_handler.setFormatter(logging.Formatter(LOGGING_FORMAT))
 
-logging.getLogger("").addHandler(file_handler)
\ No newline at end of file
+class JSONLinesFormatter(logging.Formatter):
+    """Formats each record as one JSON object. Dict messages, like the request log, are merged into it."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+        }
+        if isinstance(record.msg, dict):
+            entry.update(record.msg)
+        else:
+            entry["message"] = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestSampler(logging.Filter):
+    """Keeps a share of the request log. Server errors and slow requests are always kept."""
+
+    def __init__(self, rate: float, slow_ms: float):
+        super().__init__()
+        self.rate = rate
+        self.slow_ms = slow_ms
+
+    def filter(self, record):
+        if self.rate >= 1 or record.levelno >= logging.WARNING:
+            return True
+        log = record.msg if isinstance(record.msg, dict) else {}
+        if log.get("status_code", 0) >= 500 or log.get("processing_ms", 0) >= self.slow_ms:
+            return True
+        return random.random() < self.rate
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record):
+        # unlike the default, dict messages stay dicts so that the JSON formatter can merge their fields
+        record = copy.copy(record)
+        if not isinstance(record.msg, dict):
+            record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _sink(name: str):
+    if name == "console":
+        return logging.StreamHandler(sys.stderr)
+    if name == "stdout":
+        return logging.StreamHandler(sys.stdout)
+    if name == "file":
+        return RotatingFileHandler(LOG_FILE_PATH, maxBytes=10485760, backupCount=5)
+    if name == "syslog":
+        return SysLogHandler(address=config.log_syslog_address)
+    raise ValueError(f"Unknown log sink: {name}")
+
+
+def _handlers():
+    formatter = JSONLinesFormatter() if config.log_format == "json" else logging.Formatter(LOGGING_FORMAT)
+    handlers = []
+    for name in config.log_sinks.split(","):
+        name = name.strip()
+        if not name or name == "none":
+            continue
+        handler = _sink(name)
+        handler.setLevel(LOGGING_LEVEL)
+        handler.setFormatter(formatter)
+        handlers.append(handler)
+    return handlers
+
+
+_listener = None
+
+
+def _start_listener(handlers):
+    global _listener
+    log_queue = queue.SimpleQueue()
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _QueueHandler(log_queue)
+
+
+def stop_logging():
+    """Writes out the records still queued and stops the listener."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def setup_logging():
+    """Routes every record through a queue to the configured sinks, written from a background thread.
+
+    Request handlers then only pay for enqueueing a record, whatever the sinks are. With LOG_QUEUE=false the sinks
+    are attached to the root logger directly, as before.
+    """
+    root = logging.getLogger("")
+    root.setLevel(LOGGING_LEVEL)
+    handlers = _handlers()
+    if not handlers:
+        root.addHandler(logging.NullHandler())
+    elif config.log_queue:
+        root.addHandler(_start_listener(handlers))
+        atexit.register(stop_logging)
+        # forked worker processes inherit the queue but not the listener thread, so they start their own
+        os.register_at_fork(after_in_child=_restart_in_child)
+    else:
+        for handler in handlers:
+            root.addHandler(handler)
+    logging.getLogger(REQUEST_LOGGER).addFilter(
+        RequestSampler(config.request_log_sample_rate, config.request_log_slow_ms))
+
+
+def _restart_in_child():
+    if _listener is None:
+        return
+    root = logging.getLogger("")
+    for handler in list(root.handlers):
+        if isinstance(handler, _QueueHandler):
+            root.removeHandler(handler)
+    root.addHandler(_start_listener(_listener.handlers))
+
+
+setup_logging()
@@ -0,0 +1,120 @@
+import time
+from contextvars import ContextVar
+
+from prometheus_client import Counter, Histogram
+from sqlalchemy import event
+
+REQUEST_DURATION = Histogram(
+    "ricotta_request_duration_seconds",
+    "Time to respond to a request, by route template",
+    ["method", "route", "status"],
+)
+REQUEST_DB_QUERIES = Histogram(
+    "ricotta_request_db_queries",
+    "Database queries made while handling a request",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+REQUEST_DB_DURATION = Histogram(
+    "ricotta_request_db_duration_seconds",
+    "Time spent in database queries while handling a request",
+    ["route"],
+)
+DB_QUERY_DURATION = Histogram(
+    "ricotta_db_query_duration_seconds",
+    "Time of a single database query",
+)
+OPENAI_DURATION = Histogram(
+    "ricotta_openai_request_duration_seconds",
+    "Time of a chat completion, until the last chunk for streams",
+    ["model", "outcome"],
+    buckets=(0.25, 0.5, 1, 2, 5, 10, 20, 40, 60),
+)
+OPENAI_TOKENS = Counter(
+    "ricotta_openai_tokens_total",
+    "Tokens used by chat completions, estimated for streams",
+    ["model", "kind"],
+)
+OPENAI_EVENTS = Counter(
+    "ricotta_openai_events_total",
+    "Retries, hedged requests, calls refused by the open circuit and malformed responses",
+    ["event"],
+)
+ADMISSION_REQUESTS = Counter(
+    "ricotta_admission_requests_total",
+    "Requests admitted, or refused by a rate limit or for load, by budget",
+    ["budget", "outcome"],
+)
+GENERATION_FLIGHT = Counter(
+    "ricotta_generation_flight_total",
+    "Generations started by a leader, or coalesced onto one already in flight in the worker",
+    ["role"],
+)
+CACHE_REQUESTS = Counter(
+    "ricotta_cache_requests_total",
+    "Cache lookups, one per key",
+    ["cache", "result"],
+)
+
+
+class RequestContext:
+    """State of the request being handled, shared by the middleware, the endpoint and the database hooks."""
+
+    def __init__(self):
+        self.log_context = None
+        self.db_queries = 0
+        self.db_duration = 0.0
+
+
+# Threadpool calls run in a copy of the request's context, so they see and update the same RequestContext
+_request_context = ContextVar("ricotta_request_context", default=None)
+
+
+def start_request():
+    context = RequestContext()
+    return context, _request_context.set(context)
+
+
+def end_request(token):
+    _request_context.reset(token)
+
+
+def current_request():
+    return _request_context.get()
+
+
+def set_log_context(value: str):
+    """Attaches `value` to the log line of the current request."""
+    context = _request_context.get()
+    if context is not None:
+        context.log_context = value
+
+
+def observe_request(method: str, route: str, status: int, duration: float, context: RequestContext):
+    REQUEST_DURATION.labels(method, route, status).observe(duration)
+    REQUEST_DB_QUERIES.labels(route).observe(context.db_queries)
+    REQUEST_DB_DURATION.labels(route).observe(context.db_duration)
+
+
+def observe_cache(cache: str, hits: int, misses: int):
+    if hits:
+        CACHE_REQUESTS.labels(cache, "hit").inc(hits)
+    if misses:
+        CACHE_REQUESTS.labels(cache, "miss").inc(misses)
+
+
+def instrument_engine(engine):
+    """Times every query on `engine` and adds it to the current request, if any."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._ricotta_query_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - context._ricotta_query_start
+        DB_QUERY_DURATION.observe(duration)
+        request = _request_context.get()
+        if request is not None:
+            request.db_queries += 1
+            request.db_duration += duration
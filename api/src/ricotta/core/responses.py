@@ -0,0 +1,56 @@
+from fastapi import Request
+from fastapi.responses import JSONResponse as StandardJSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+COMPACT_FORMAT = "compact.v1"
+COMPACT_MEDIA_TYPE = "application/vnd.ricotta.compact.v1+json"
+
+
+class ORJSONResponse(StandardJSONResponse):
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+
+# Routers import JSONResponse from here, so installing the `fast` extra switches every endpoint to orjson
+JSONResponse = ORJSONResponse if orjson is not None else StandardJSONResponse
+
+
+def wants_compact(request: Request) -> bool:
+    return request.query_params.get("format") == "compact" or COMPACT_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def compact_card(card: dict) -> dict:
+    """Drops what the compact format carries elsewhere: the language per deck and the answer as an option index."""
+    compact = {
+        "id": card["id"],
+        "word": card["word"],
+        "sentenceLANG": card["sentenceLANG"],
+        "sentenceEN": card["sentenceEN"],
+        "options": card["options"],
+        "answer": card["options"].index(card["correct"]),
+    }
+    for field in ("times_seen", "times_correct"):
+        if field in card:
+            compact[field] = card[field]
+    return compact
+
+
+def cards_response(request: Request, cards: list, language: str, **extra):
+    """Returns the cards in the format the client asked for.
+
+    The default is the original format. Clients opt into the compact one with `?format=compact` or by accepting
+    `application/vnd.ricotta.compact.v1+json`.
+    """
+    if not wants_compact(request):
+        return JSONResponse(content={"cards": cards, **extra}, status_code=200)
+    content = {
+        "format": COMPACT_FORMAT,
+        "language": language,
+        "cards": [compact_card(card) for card in cards],
+        **extra,
+    }
+    return JSONResponse(content=content, status_code=200, media_type=COMPACT_MEDIA_TYPE)
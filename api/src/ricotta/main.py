@@ -1,6 +1,8 @@
+import asyncio
 import time
 import random
 import string
+from functools import lru_cache
 
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
@@ -8,13 +10,21 @@ from fastapi.middleware.cors import CORSMiddleware
 from ricotta.routers.ping import ping_router
 from ricotta.routers.user import user_router
 from ricotta.routers.card import card_router
-from ricotta.services.database import create_db_and_tables
+from ricotta.routers.metrics import metrics_router
+from ricotta.services.admission import AdmissionMiddleware
+from ricotta.services.database import async_engine, close_db, engine
+from ricotta.services.chat_extractor import close_session
+from ricotta.services.redis_client import close_redis
+from ricotta.services.jobs import consume, job_queue, MemoryJobQueue
 from ricotta.config import config
-from ricotta.core.logger import logging
+from ricotta.prepare import prepare_database
+from ricotta.core.logger import REQUEST_LOGGER, logging
+from ricotta.core.metrics import end_request, instrument_engine, observe_request, start_request
+from ricotta.core.responses import JSONResponse
 
 
-logging.basicConfig(filename=config.log_file, level=logging.INFO)
 logger = logging.getLogger(__name__)
+request_logger = logging.getLogger(REQUEST_LOGGER)
 
 
 app = FastAPI(
@@ -24,11 +34,16 @@ app = FastAPI(
     docs_url=config.docs_url,
     openapi_url=None,
     redoc_url=None,
+    default_response_class=JSONResponse,
     )
 app.include_router(ping_router)
 app.include_router(user_router)
 app.include_router(card_router)
+if config.metrics_enabled:
+    app.include_router(metrics_router)
 app.mount("/api", app)
+# added before CORS so that it runs inside it, and refusals carry the CORS headers too
+app.add_middleware(AdmissionMiddleware, queue_depth=job_queue.depth)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[str(origin) for origin in config.allow_origins],
@@ -36,32 +51,75 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+instrument_engine(engine)
+if async_engine is not None:
+    instrument_engine(async_engine.sync_engine)
 
 
 @app.on_event("startup")
 def startup():
-    create_db_and_tables()
+    if config.prepare_database_on_startup:
+        prepare_database()
     logging.info("Starting up Ricotta API")
 
 
+@app.on_event("startup")
+async def start_job_workers():
+    # with the memory backend nothing else can consume the queue, so the API runs the jobs itself; with Redis it runs
+    # the jobs made with the caller's key, which are only queued in this process
+    app.state.job_workers_stop = asyncio.Event()
+    queue = job_queue if isinstance(job_queue, MemoryJobQueue) else job_queue.caller_key_jobs
+    app.state.job_workers = [
+        asyncio.create_task(consume(queue, app.state.job_workers_stop, poll_timeout=1))
+        for _ in range(config.job_workers)
+    ]
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.job_workers_stop.set()
+    await asyncio.gather(*app.state.job_workers, return_exceptions=True)
+    await job_queue.close()
+    await close_session()
+    await close_redis()
+    await close_db()
+
+
+@lru_cache(maxsize=None)
+def route_template(endpoint):
+    # labels use the route's path template so that ids in URLs do not create a series each
+    if endpoint is None:
+        return "unmatched"
+    for route in app.routes:
+        if getattr(route, "endpoint", None) is endpoint:
+            return route.path
+    return "unmatched"
+
+
 @app.middleware('http')
 async def log_requests(request: Request, call_next):
     idem = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-    start_time = time.time()
-    response = await call_next(request)
-    processing_time = (time.time() - start_time) * 1000
-    processing_time = '{0:.1f}'.format(processing_time) + "ms"
+    context, token = start_request()
+    start_time = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        end_request(token)
+    duration = time.perf_counter() - start_time
     if request.method != "OPTIONS":
+        route = route_template(request.scope.get("endpoint"))
+        observe_request(request.method, route, response.status_code, duration, context)
         log = {
                 "message": "request",
                 "path": request.url.path,
                 "method": request.method,
-                "processing_time": processing_time,
+                "processing_ms": round(duration * 1000, 1),
                 "status_code": response.status_code,
                 "query_params": request.query_params,
                 "rid": idem,
+                "db_queries": context.db_queries,
             }
-        if request.app.extra.get("context"):
-            log["context"] = request.app.extra.get("context")
-        logging.info(log)
+        if context.log_context:
+            log["context"] = context.log_context
+        request_logger.info(log)
     return response
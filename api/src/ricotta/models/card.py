@@ -1,27 +1,63 @@
 
 from sqlalchemy import (
     Column,
+    DateTime,
+    Float,
     Integer,
     String,
+    Text,
     ForeignKey,
+    Index,
+    LargeBinary,
+    text,
 )
 from sqlalchemy.orm import relationship
 from ricotta.services.database import Base
 
 class UserCardInteraction(Base):
     __tablename__ = 'ricotta__user_card_interactions'
+    __table_args__ = (
+        # the first index on these columns was not unique, so the unique one needs its own name to be created on
+        # databases that already have it; the old one is dropped by create_missing_indexes
+        Index('ix_ricotta__user_card_interactions_user_id_card_id_unique', 'user_id', 'card_id', unique=True),
+        Index('ix_ricotta__user_card_interactions_due', 'user_id', 'language', 'due_at'),
+    )
 
     id = Column(Integer, autoincrement=True, primary_key=True)
     user_id = Column(Integer, ForeignKey('ricotta__users.id'))
     card_id = Column(Integer, ForeignKey('ricotta__cards.id'))
     times_seen = Column(Integer, default=0, nullable=False)
     times_correct = Column(Integer, default=0, nullable=False)
+    # Spaced repetition state, see services/scheduler.py. language is copied from the card for the due index.
+    language = Column(String)
+    due_at = Column(DateTime)
+    interval_days = Column(Float, nullable=False, server_default=text('0'))
+    ease = Column(Float, nullable=False, server_default=text('2.5'))
+    repetitions = Column(Integer, nullable=False, server_default=text('0'))
     user = relationship("User", back_populates="card_interactions")
     card = relationship("Card", back_populates="user_interactions")
 
 
+class AnswerReceipt(Base):
+    """Response of an answer batch, stored under the client's idempotency key so retries are not counted twice."""
+    __tablename__ = 'ricotta__answer_receipts'
+    __table_args__ = (
+        Index('ix_ricotta__answer_receipts_user_id_key', 'user_id', 'idempotency_key', unique=True),
+        Index('ix_ricotta__answer_receipts_created_at', 'created_at'),
+    )
+
+    id = Column(Integer, autoincrement=True, primary_key=True)
+    user_id = Column(Integer, ForeignKey('ricotta__users.id'), nullable=False)
+    idempotency_key = Column(String, nullable=False)
+    response = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+
+
 class Card(Base):
     __tablename__ = 'ricotta__cards'
+    __table_args__ = (
+        Index('ix_ricotta__cards_language_id', 'language', 'id'),
+    )
 
     id = Column(Integer, autoincrement=True, primary_key=True)
     word = Column(String, nullable=False)
@@ -29,6 +65,8 @@ class Card(Base):
     english = Column(String, nullable=False)
     sentenceLANG = Column(String, nullable=False, unique=True)
     sentenceEN = Column(String, nullable=False)
+    # MinHash of sentenceLANG for the near duplicate index, see services/sentence_index.py
+    sentence_minhash = Column(LargeBinary)
     incorrect_options = relationship("IncorrectOption", back_populates="card")
     user_interactions = relationship("UserCardInteraction", back_populates="card")
 
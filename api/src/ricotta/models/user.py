@@ -1,5 +1,8 @@
 from sqlalchemy import (
     Column,
+    DateTime,
+    ForeignKey,
+    Index,
     Integer,
     String
 )
@@ -14,3 +17,21 @@ class User(Base):
     id = Column(Integer, autoincrement=True, primary_key=True)
     username = Column(String, nullable=False, unique=True)
     card_interactions = relationship(UserCardInteraction, back_populates="user")
+
+
+class UserLanguageStats(Base):
+    """Progress of a user in one language, updated in the same transaction as the answers, see services/stats.py."""
+    __tablename__ = 'ricotta__user_language_stats'
+    __table_args__ = (
+        Index('ix_ricotta__user_language_stats_user_id_language', 'user_id', 'language', unique=True),
+    )
+
+    id = Column(Integer, autoincrement=True, primary_key=True)
+    user_id = Column(Integer, ForeignKey('ricotta__users.id'), nullable=False)
+    language = Column(String, nullable=False)
+    cards_seen = Column(Integer, nullable=False, default=0)
+    answers = Column(Integer, nullable=False, default=0)
+    correct = Column(Integer, nullable=False, default=0)
+    # consecutive days, in UTC, with at least one answer up to last_activity_at
+    streak_days = Column(Integer, nullable=False, default=0)
+    last_activity_at = Column(DateTime)
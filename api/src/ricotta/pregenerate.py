@@ -0,0 +1,186 @@
+"""Generates decks ahead of time, so that users are served from the database without waiting on the model.
+
+    python -m ricotta.pregenerate --subjects-file subjects.txt --checkpoint pregenerate.jsonl
+    python -m ricotta.pregenerate --subject food --subject travel --language Italian --language French
+    python -m ricotta.pregenerate --pairs-file pairs.csv --concurrency 8
+
+Subjects are crossed with `--language` (every supported language by default); `--pairs-file` is a CSV of
+`language,subject` rows instead. Each pair goes through the same path as POST /card/generate: known words are excluded
+from the prompt and dropped locally, cards are bulk inserted and the generation cache is filled. Rate limits and
+upstream errors that outlast the client's own retries are retried again with a longer backoff, and a rate limit pauses
+every consumer. Completed pairs are appended to the checkpoint file and skipped when the command is run again.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import time
+
+import aiohttp
+import openai
+
+from ricotta.config import config
+from ricotta.core.logger import logging, stop_logging
+from ricotta.prepare import prepare_database
+from ricotta.services.chat_extractor import ChatExtractor, MalformedResponseError, close_session
+from ricotta.services.generation import generate_cards
+from ricotta.services.generation_cache import normalize_subject
+from ricotta.services.openai_client import CircuitOpenError, backoff_delay
+from ricotta.services.redis_client import close_redis
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.APIError,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.Timeout,
+    aiohttp.ClientError,
+    asyncio.TimeoutError,
+    CircuitOpenError,
+    MalformedResponseError,
+)
+
+
+def read_pairs(args):
+    if args.pairs_file:
+        with open(args.pairs_file, newline="") as file:
+            return [(row[0].strip(), row[1].strip()) for row in csv.reader(file) if len(row) >= 2]
+    subjects = list(args.subject or [])
+    if args.subjects_file:
+        with open(args.subjects_file) as file:
+            subjects.extend(line.strip() for line in file)
+    languages = args.language or config.supported_languages
+    return [(language, subject) for language in languages for subject in subjects if subject]
+
+
+def checkpoint_key(language: str, subject: str):
+    return f"{language}:{normalize_subject(subject)}"
+
+
+def read_checkpoint(path: str):
+    done = set()
+    if not path or not os.path.exists(path):
+        return done
+    with open(path) as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # the last line may be cut short if a previous run was killed while writing it
+                continue
+            done.add(checkpoint_key(entry["language"], entry["subject"]))
+    return done
+
+
+class RateLimitGate:
+    """Makes every consumer wait out a rate limit hit by any of them."""
+
+    def __init__(self):
+        self.resume_at = 0.0
+
+    async def wait(self):
+        delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float):
+        self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+
+async def generate_pair(chat, gate, language, subject, retries, base_delay, max_delay):
+    for attempt in range(retries + 1):
+        await gate.wait()
+        try:
+            return await generate_cards(chat, subject, language)
+        except RETRYABLE_ERRORS as err:
+            if attempt == retries:
+                raise
+            delay = backoff_delay(err, attempt, base_delay, max_delay)
+            if isinstance(err, openai.error.RateLimitError):
+                gate.pause(delay)
+            logger.warning(f"Retrying {language} \"{subject}\" in {delay:.1f}s after {type(err).__name__}: {err}")
+            await asyncio.sleep(delay)
+
+
+async def consume(queue, chat, gate, checkpoint, summary, args):
+    while True:
+        try:
+            language, subject = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        try:
+            cards = await generate_pair(chat, gate, language, subject, args.retries, args.base_delay, args.max_delay)
+        except Exception as err:
+            logger.error(f"Failed to generate {language} \"{subject}\": {err}")
+            summary["failed"] += 1
+            continue
+        summary["done"] += 1
+        summary["cards"] += len(cards)
+        if checkpoint is not None:
+            checkpoint.write(json.dumps({"language": language, "subject": subject, "cards": len(cards)}) + "\n")
+            checkpoint.flush()
+
+
+async def pregenerate(pairs, args):
+    done = read_checkpoint(args.checkpoint)
+    queue = asyncio.Queue()
+    seen = set()
+    unsupported = {language for language, _ in pairs if language not in config.supported_languages}
+    for language in sorted(unsupported):
+        logger.error(f"Skipping unsupported language: {language}")
+    for language, subject in pairs:
+        # cleaned like the subjects of POST /card/generate, so both share generation cache entries
+        subject = "".join(ch for ch in subject if ch.isalnum() or ch.isspace())
+        key = checkpoint_key(language, subject)
+        if language not in unsupported and key not in done and key not in seen:
+            seen.add(key)
+            queue.put_nowait((language, subject))
+
+    summary = {"pairs": len(pairs), "skipped": len(pairs) - queue.qsize(), "done": 0, "failed": 0, "cards": 0}
+    chat = ChatExtractor(model_key=args.api_key or config.openai_api_key, model=config.openai_model, max_tokens=None)
+    gate = RateLimitGate()
+    checkpoint = open(args.checkpoint, "a") if args.checkpoint else None
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*[consume(queue, chat, gate, checkpoint, summary, args) for _ in range(args.concurrency)])
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+        await close_session()
+        await close_redis()
+    summary["seconds"] = round(time.perf_counter() - start, 1)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subject", action="append", help="a subject, may be repeated")
+    parser.add_argument("--subjects-file", help="file with one subject per line")
+    parser.add_argument("--language", action="append", help="a language, may be repeated; defaults to all supported")
+    parser.add_argument("--pairs-file", help="CSV of language,subject rows, instead of subjects and languages")
+    parser.add_argument("--checkpoint", default="pregenerate.jsonl", help="file recording the completed pairs")
+    parser.add_argument("--concurrency", type=int, default=config.generation_concurrency)
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--base-delay", type=float, default=1.0, help="first backoff delay in seconds")
+    parser.add_argument("--max-delay", type=float, default=60.0)
+    parser.add_argument("--api-key", help="OpenAI key, OPENAI_API_KEY by default")
+    args = parser.parse_args()
+
+    pairs = read_pairs(args)
+    if not pairs:
+        raise SystemExit("Nothing to generate, give subjects or a pairs file")
+    if not (args.api_key or config.openai_api_key):
+        raise SystemExit("An OpenAI API key is required, set OPENAI_API_KEY or pass --api-key")
+    try:
+        prepare_database()
+        summary = asyncio.run(pregenerate(pairs, args))
+    finally:
+        stop_logging()
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""Creates and migrates the database: new tables and columns, data fix-ups and pruning, then new indexes.
+
+    python -m ricotta.prepare
+
+`ricotta.serve` runs this once before starting its workers. A single process started some other way (e.g. uvicorn
+--reload) runs it on startup unless PREPARE_DATABASE_ON_STARTUP=false.
+"""
+# the models register their tables with Base.metadata when imported
+import ricotta.models.card  # noqa: F401
+import ricotta.models.user  # noqa: F401
+from ricotta.core.logger import logging
+from ricotta.services.answers import merge_duplicate_interactions, prune_answer_receipts
+from ricotta.services.database import create_db_and_tables, create_missing_indexes, engine, SessionLocal
+from ricotta.services.scheduler import backfill_schedule
+from ricotta.services.sentence_index import backfill_minhash
+from ricotta.services.stats import backfill_stats
+
+logger = logging.getLogger(__name__)
+
+
+def prepare_database():
+    create_db_and_tables()
+    with SessionLocal() as db:
+        merge_duplicate_interactions(db)
+        prune_answer_receipts(db)
+        backfill_schedule(db)
+        backfill_minhash(db)
+    create_missing_indexes()
+    with SessionLocal() as db:
+        # upserts on the new unique index, so it runs once the index exists
+        backfill_stats(db)
+
+
+if __name__ == "__main__":
+    prepare_database()
+    engine.dispose()
+    logger.info("Database is ready")
@@ -1,27 +1,36 @@
 
 import json
-from typing import Annotated
+from datetime import datetime
+from typing import Annotated, List, Optional
 from random import shuffle
 
-from fastapi import HTTPException, Depends, Request
-from fastapi.responses import JSONResponse
+from fastapi import HTTPException, Depends, Header, Query, Request
+from starlette.concurrency import run_in_threadpool
+from sse_starlette.sse import EventSourceResponse
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from sqlalchemy.orm.exc import NoResultFound
 from pydantic import BaseModel
 from fastapi import APIRouter
-from sqlalchemy.sql.expression import func
 from sqlalchemy import (
     and_
 )
-from sqlalchemy.orm import joinedload
 
-from ricotta.models.user import User
-from ricotta.models.card import Card, IncorrectOption, UserCardInteraction
+from ricotta.models.card import UserCardInteraction
 from ricotta.config import config
-from ricotta.services.database import get_db
+from ricotta.services.database import get_db, run_db
 from ricotta.services.chat_extractor import ChatExtractor
+from ricotta.services.generation_cache import generation_cache
+from ricotta.services.card_sampler import card_id_pool
+from ricotta.services.card_cache import card_cache, get_card_payloads
+from ricotta.services.scheduler import utcnow
+from ricotta.services.answers import UnknownCardsError, record_answers
+from ricotta.services.users import user_resolver
+from ricotta.services.generation import generate_cards_once, known_words, save_cards
+from ricotta.services.openai_client import CircuitOpenError
+from ricotta.services.jobs import DONE, FAILED, JobQueueUnavailable, job_queue
 from ricotta.core.logger import logging
+from ricotta.core.metrics import set_log_context
+from ricotta.core.responses import COMPACT_FORMAT, JSONResponse, cards_response, compact_card, wants_compact
 
 logger = logging.getLogger(__name__)
 
@@ -38,111 +47,151 @@ class MarkCardSeenRequest(BaseModel):
     username: str
     correct: bool
 
+class CardAnswer(BaseModel):
+    card_id: int
+    correct: bool
+    answered_at: Optional[datetime] = None
 
-@card_router.post("/generate")
-def generate_cards(request: Request, payload: GenerateCardsRequest, db: Session = Depends(get_db)):
-    try:
-        subject = "".join(ch for ch in payload.subject if ch.isalnum() or ch.isspace())
-        language = payload.language or config.default_language
+class SubmitAnswersRequest(BaseModel):
+    username: str
+    answers: List[CardAnswer]
 
-        request.app.extra = {
-            **request.app.extra,
-            "context": f'language="{language}" subject="{subject}"'
-            }
 
-        if language not in config.supported_languages:
-            logging.error(f"Invalid language: {language}")
-            raise HTTPException(status_code=400, detail="Invalid language")
+def _generation_request(request: Request, payload: GenerateCardsRequest):
+    subject = "".join(ch for ch in payload.subject if ch.isalnum() or ch.isspace())
+    language = payload.language or config.default_language
 
-        openai_api_key = request.headers.get('X-OpenAI-Key') or config.openai_api_key
-        if not openai_api_key:
-            logging.error("OpenAI API key is required to generate new words")
-            raise HTTPException(status_code=400, detail="OpenAI API key is required to generate new words")
+    set_log_context(f'language="{language}" subject="{subject}"')
 
-        chat = ChatExtractor(
-            model_key=openai_api_key,
-            model=config.openai_model,
-            max_tokens=None
-        )
+    if language not in config.supported_languages:
+        logging.error(f"Invalid language: {language}")
+        raise HTTPException(status_code=400, detail="Invalid language")
 
-        words_known = db.query(Card.word).filter(Card.language == language).limit(100).all()
-        db_words_str = json.dumps([orm_card.word for orm_card in words_known])
+    openai_api_key = request.headers.get('X-OpenAI-Key') or config.openai_api_key
+    if not openai_api_key:
+        logging.error("OpenAI API key is required to generate new words")
+        raise HTTPException(status_code=400, detail="OpenAI API key is required to generate new words")
+
+    chat = ChatExtractor(
+        model_key=openai_api_key,
+        model=config.openai_model,
+        max_tokens=None
+    )
+    return subject, language, chat
+
+
+def _shuffled(card: dict):
+    # cached and coalesced cards are shared between responses, so each one shuffles its own copy of the options
+    options = list(card["options"])
+    shuffle(options)
+    return {**card, "options": options}
 
-        words = chat.extract(description=subject, db_words=db_words_str, language=language)
-        words = words.get("words", words)
-        cards = []
-        for word in words:
-            prexisting_card = db.query(Card).filter(
-                 and_(Card.sentenceLANG == word['sentenceLANG'],
-                      Card.language == language)
-                ).one_or_none()
-            db_card = prexisting_card
-
-            if not db_card:
-                db_card = Card(
-                    word=word['word'],
-                    language=language,
-                    english=word['english'],
-                    sentenceLANG=word['sentenceLANG'],
-                    sentenceEN=word['sentenceEN'],
-                    incorrect_options=[IncorrectOption(option=option) for option in word['incorrect_options']]
-                )
-                db.add(db_card)
-                db.commit()
-            else:
-                logger.warning(f"Card already exists: {db_card.id}")
-
-            options = [word['english']] + [incorrect_option.option for incorrect_option in db_card.incorrect_options]
-            shuffle(options)
-            card = {
-                "id": db_card.id,
-                "word": word['word'],
-                "language": language,
-                "correct": word['english'],
-                "english": word['english'],
-                "sentenceLANG": word['sentenceLANG'],
-                "sentenceEN": word['sentenceEN'],
-                "options": options
-            }
-            cards.append(card)
 
-        return JSONResponse(content={'cards': cards}, status_code=200)
+@card_router.post("/generate")
+async def generate_cards(request: Request, payload: GenerateCardsRequest, background: Annotated[bool, None] = False):
+    try:
+        subject, language, chat = _generation_request(request, payload)
+
+        if background:
+            # only a caller supplied key travels with the job, and never leaves this process (see CallerKeyJobs); the server
+            # key is read by the worker itself
+            api_key = chat.model_key if chat.model_key != config.openai_api_key else None
+            job = await job_queue.enqueue(language, subject, api_key=api_key)
+            return JSONResponse(content={"job_id": job["id"], "status": job["status"]}, status_code=202)
+
+        shared_cards = await generate_cards_once(chat, subject, language)
+        cards = [_shuffled(card) for card in shared_cards]
+
+        return cards_response(request, cards, language)
+    except JobQueueUnavailable as err:
+        logging.error(f"Job queue unavailable: {err}")
+        raise HTTPException(status_code=503, detail="Job queue unavailable")
+    except CircuitOpenError as err:
+        logging.error(f"Generation unavailable: {err}")
+        raise HTTPException(status_code=503, detail="Generation temporarily unavailable")
     except Exception as err:
-        db.rollback()
         logging.error(f"Unexpected error: {err}")
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
 
 
+@card_router.get("/jobs/{job_id}")
+async def get_generation_job(request: Request, job_id: str):
+    try:
+        job = await job_queue.get(job_id)
+    except JobQueueUnavailable as err:
+        logging.error(f"Job queue unavailable: {err}")
+        raise HTTPException(status_code=503, detail="Job queue unavailable")
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    if job["status"] == DONE:
+        cards = [_shuffled(card) for card in job["cards"]]
+        return cards_response(request, cards, job["language"], job_id=job["id"], status=job["status"])
+    content = {"job_id": job["id"], "status": job["status"]}
+    if job["status"] == FAILED:
+        content["detail"] = job.get("error")
+    return JSONResponse(content=content, status_code=200)
+
+
+@card_router.post("/generate/stream")
+async def generate_cards_stream(request: Request, payload: GenerateCardsRequest):
+    subject, language, chat = _generation_request(request, payload)
+    compact = wants_compact(request)
+
+    def card_event(card: dict):
+        card = _shuffled(card)
+        return {"event": "card", "data": json.dumps(compact_card(card) if compact else card)}
+
+    def done_event(count: int):
+        # the compact format carries the language once per deck rather than on every card
+        content = {"count": count, "format": COMPACT_FORMAT, "language": language} if compact else {"count": count}
+        return {"event": "done", "data": json.dumps(content)}
+
+    async def events():
+        cards = []
+        try:
+            cached_cards = await generation_cache.get(language, subject)
+            if cached_cards is not None:
+                for card in cached_cards:
+                    yield card_event(card)
+                yield done_event(len(cached_cards))
+                return
+
+            db_words = await run_in_threadpool(known_words, language, subject)
+            async for word in chat.stream(description=subject, db_words=db_words, language=language):
+                for card in await run_in_threadpool(save_cards, [word], language):
+                    cards.append(card)
+                    yield card_event(card)
+
+            if cards:
+                await card_cache.set_many(cards)
+                await generation_cache.set(language, subject, cards)
+            yield done_event(len(cards))
+        except CircuitOpenError as err:
+            logging.error(f"Generation unavailable: {err}")
+            yield {"event": "error", "data": json.dumps({"detail": "Generation temporarily unavailable"})}
+        except Exception as err:
+            logging.error(f"Unexpected error: {err}")
+            yield {"event": "error", "data": json.dumps({"detail": "An unexpected error occurred"})}
+
+    return EventSourceResponse(events())
+
+
 @card_router.get('/')
-def get_cards(language: Annotated[str, None] = None, db: Session = Depends(get_db)):
+async def get_cards(request: Request, language: Annotated[str, None] = None, db: Session = Depends(get_db)):
     try:
         language = language or config.default_language
         if language not in config.supported_languages:
             logging.error(f"Invalid language: {language}")
             raise HTTPException(status_code=400, detail="Invalid language")
 
-        cards = []
-        orm_cards = db.query(Card).filter(Card.language == language).order_by(func.random()).limit(10).all()
-
-        if not orm_cards or len(orm_cards) == 0:
-            return JSONResponse(content={"cards": []}, status_code=200)
-
-        for orm_card in orm_cards:
-            options = [orm_card.english] + [incorrect_option.option for incorrect_option in orm_card.incorrect_options]
-            shuffle(options)
-
-            card = {
-                "id": orm_card.id,
-                "word": orm_card.word,
-                "language": language,
-                "correct": orm_card.english,
-                "english": orm_card.english,
-                "sentenceLANG": orm_card.sentenceLANG,
-                "sentenceEN": orm_card.sentenceEN,
-                "options": options
-            }
-            cards.append(card)
-        return JSONResponse(content={'cards': cards}, status_code=200)
+        # Only ids come from the database on a warm cache; the payloads are assembled from the card cache
+        card_ids = await run_db(db, card_id_pool.sample, language, 10)
+        payloads = await get_card_payloads(db, card_ids)
+
+        cards = [_shuffled(payload) for payload in payloads]
+        shuffle(cards)
+        return cards_response(request, cards, language)
     except json.decoder.JSONDecodeError:
         logging.error("Couldn't parse JSON from model response")
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
@@ -151,50 +200,57 @@ def get_cards(language: Annotated[str, None] = None, db: Session = Depends(get_d
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
 
 
+def _due_interactions(db: Session, user_id: int, language: str, limit: int):
+    # Served from the (user_id, language, due_at) index, so the cost depends on the page size only
+    return db.query(UserCardInteraction.card_id, UserCardInteraction.times_seen, UserCardInteraction.times_correct)\
+        .filter(
+            and_(UserCardInteraction.user_id == user_id,
+                 UserCardInteraction.language == language,
+                 UserCardInteraction.due_at <= utcnow())
+        )\
+        .order_by(UserCardInteraction.due_at)\
+        .limit(limit)\
+        .all()
+
+
 @card_router.get('/review')
-def review_cards(username: Annotated[str, None] = None, language: Annotated[str, None] = None, db: Session = Depends(get_db)):
+async def review_cards(request: Request,
+                       username: Annotated[str, None] = None,
+                       language: Annotated[str, None] = None,
+                       limit: Annotated[Optional[int], Query(ge=1)] = None,
+                       db: Session = Depends(get_db)):
     try:
         if not username:
             logging.error("Missing username")
             raise HTTPException(status_code=400, detail="Missing username")
-        user = db.query(User).filter(User.username == username).first()
-        if not user:
-            return JSONResponse(content={"cards": []}, status_code=200)
-
+        user_id = await run_db(db, user_resolver.resolve, username)
         language = language or config.default_language
+        if user_id is None:
+            return cards_response(request, [], language)
+
         if language not in config.supported_languages:
             logging.error(f"Invalid language: {language}")
             raise HTTPException(status_code=400, detail="Invalid language")
 
-        interactions = db.query(UserCardInteraction)\
-            .options(joinedload(UserCardInteraction.card))\
-            .filter(
-                and_(UserCardInteraction.user_id == user.id)
-            ).all()
+        limit = min(limit or config.review_page_size, config.review_page_max_size)
+        interactions = await run_db(db, _due_interactions, user_id, language, limit)
 
         if not interactions:
-            return JSONResponse(content={"cards": []}, status_code=200)
+            return cards_response(request, [], language)
+        payloads = await get_card_payloads(db, [interaction.card_id for interaction in interactions])
+        payloads = {payload["id"]: payload for payload in payloads}
         cards = []
         for interaction in interactions:
-            orm_card = interaction.card
-            if orm_card.language != language:
+            payload = payloads.get(interaction.card_id)
+            if payload is None:
                 continue
-            options = [orm_card.english] + [incorrect_option.option for incorrect_option in orm_card.incorrect_options]
-            shuffle(options)
-            card = {
-                "id": orm_card.id,
-                "word": orm_card.word,
-                "language": orm_card.language,
-                "correct": orm_card.english,
-                "sentenceLANG": orm_card.sentenceLANG,
-                "sentenceEN": orm_card.sentenceEN,
-                "times_seen": interaction.times_seen,
-                "times_correct": interaction.times_correct,
-                "options": options
-            }
+            card = _shuffled(payload)
+            del card["english"]
+            card["times_seen"] = interaction.times_seen
+            card["times_correct"] = interaction.times_correct
             cards.append(card)
         shuffle(cards)
-        return JSONResponse(content={'cards': cards}, status_code=200)
+        return cards_response(request, cards, language)
     except json.decoder.JSONDecodeError:
         logging.error("Couldn't parse JSON from model response")
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
@@ -203,38 +259,56 @@ def review_cards(username: Annotated[str, None] = None, language: Annotated[str,
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
 
 
+def _record_answers(db: Session, username: str, answers: list, idempotency_key: str = None):
+    user_id = user_resolver.resolve(db, username)
+    if user_id is None:
+        logging.error(f"User not found: {username}")
+        raise HTTPException(status_code=404, detail="User not found")
+    try:
+        return record_answers(db, user_id, answers, idempotency_key=idempotency_key)
+    except Exception:
+        db.rollback()
+        raise
+
+
+def _answer_error(err: Exception):
+    if isinstance(err, HTTPException):
+        return err
+    if isinstance(err, UnknownCardsError):
+        logging.error(str(err))
+        return HTTPException(status_code=404, detail="Card not found")
+    logging.error(f"Unexpected error: {err}")
+    return HTTPException(status_code=500, detail="An unexpected error occurred")
+
+
+@card_router.post("/answers")
+async def submit_answers(payload: SubmitAnswersRequest,
+                         idempotency_key: Annotated[str, Header()] = None,
+                         db: Session = Depends(get_db)):
+    try:
+        if not payload.answers:
+            logging.error("Missing answers")
+            raise HTTPException(status_code=400, detail="Missing answers")
+
+        response = await run_db(db, _record_answers, payload.username, payload.answers, idempotency_key)
+        return JSONResponse(content={"message": "Answers recorded", **response}, status_code=200)
+    except Exception as err:
+        raise _answer_error(err)
+
+
 @card_router.post("/{card_id}")
-def mark_card_as_seen(card_id: int, payload: MarkCardSeenRequest, db: Session = Depends(get_db)):
+async def mark_card_as_seen(card_id: int, payload: MarkCardSeenRequest, db: Session = Depends(get_db)):
     try:
         if not card_id:
             logging.error("Missing card id")
             raise HTTPException(status_code=400, detail="Missing card id")
 
-        user = db.query(User).filter(User.username == payload.username).first()
-        if not user:
-            logging.error(f"User not found: {payload.username}")
-            raise HTTPException(status_code=404, detail="User not found")
-
-        card = db.query(Card).filter(Card.id == card_id).first()
-        if not card:
-            logging.error(f"Card not found: {card_id}")
-            raise HTTPException(status_code=404, detail="Card not found")
-
-        try:
-            interaction = db.query(UserCardInteraction)\
-                .filter(and_(UserCardInteraction.user_id == user.id, UserCardInteraction.card_id == card.id))\
-                .one()
-            interaction.times_seen += 1
-            if payload.correct:
-                interaction.times_correct += 1
-
-        except NoResultFound:
-            interaction = UserCardInteraction(user_id=user.id, card_id=card.id, times_seen=1, times_correct=payload.correct and 1 or 0)
-            db.add(interaction)
-
-        db.commit()
-        return JSONResponse(content={"message": "Card marked as seen", "times_seen": interaction.times_seen, "times_correct": interaction.times_correct}, status_code=200)
-    except Exception as e:
-        db.rollback()
-        logging.error(f"Unexpected error: {e}")
-        raise HTTPException(status_code=500, detail="An unexpected error occurred")
+        response = await run_db(db, _record_answers, payload.username,
+                                [CardAnswer(card_id=card_id, correct=payload.correct)])
+        interaction = response["cards"][0]
+        return JSONResponse(content={"message": "Card marked as seen",
+                                     "times_seen": interaction["times_seen"],
+                                     "times_correct": interaction["times_correct"],
+                                     "due_at": interaction["due_at"]}, status_code=200)
+    except Exception as err:
+        raise _answer_error(err)
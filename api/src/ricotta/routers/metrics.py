@@ -0,0 +1,24 @@
+import os
+
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest, multiprocess
+
+
+def _registry():
+    # with several workers each one writes its metrics to files in this directory, collected here on every scrape
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+metrics_router = APIRouter(
+    tags=["metrics"],
+)
+
+
+@metrics_router.get("/metrics")
+def metrics():
+    # passed as a header, since media_type would get a second charset appended
+    return Response(content=generate_latest(_registry()), headers={"Content-Type": CONTENT_TYPE_LATEST})
@@ -1,12 +1,17 @@
+from typing import Annotated
+
 from fastapi import HTTPException, Depends
-from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 
+from ricotta.config import config
 from ricotta.models.user import User
-from ricotta.services.database import get_db
+from ricotta.services.database import get_db, run_db
+from ricotta.services.stats import get_stats, stats_payload
+from ricotta.services.users import user_resolver
 from ricotta.core.logger import logging
+from ricotta.core.responses import JSONResponse
 
 from fastapi import APIRouter
 
@@ -22,17 +27,51 @@ class UserCreate(BaseModel):
     username: str
 
 
+def _create_user(db: Session, username: str):
+    new_user = User(username=username)
+    db.add(new_user)
+    try:
+        db.commit()
+    except SQLAlchemyError:
+        db.rollback()
+        raise
+    user_resolver.remember(new_user.username, new_user.id)
+    return new_user.username
+
+
+def _user_stats(db: Session, username: str, language: str = None):
+    user_id = user_resolver.resolve(db, username)
+    if user_id is None:
+        return None
+    return [stats_payload(stats) for stats in get_stats(db, user_id, language)]
+
+
 @user_router.post("/")
 async def create_user(user_data: UserCreate, db: Session = Depends(get_db)):
     try:
-        new_user = User(username=user_data.username)
-        db.add(new_user)
-        db.commit()
-        return JSONResponse(content={"message": "User created successfully", "username": new_user.username}, status_code=200)
+        username = await run_db(db, _create_user, user_data.username)
+        return JSONResponse(content={"message": "User created successfully", "username": username}, status_code=200)
     except SQLAlchemyError as err:
-        db.rollback()
         logging.error(f"Error creating user: {err}")
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
+    except Exception as err:
+        logging.error(f"Unexpected {err=}, {type(err)=}")
+        raise HTTPException(status_code=500, detail="An unexpected error occurred")
+
+
+@user_router.get("/{username}/stats")
+async def get_user_stats(username: str, language: Annotated[str, None] = None, db: Session = Depends(get_db)):
+    try:
+        if language and language not in config.supported_languages:
+            logging.error(f"Invalid language: {language}")
+            raise HTTPException(status_code=400, detail="Invalid language")
+        languages = await run_db(db, _user_stats, username, language)
+        if languages is None:
+            logging.error(f"User not found: {username}")
+            raise HTTPException(status_code=404, detail="User not found")
+        return JSONResponse(content={"username": username, "languages": languages}, status_code=200)
+    except HTTPException:
+        raise
     except Exception as err:
         logging.error(f"Unexpected {err=}, {type(err)=}")
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
\ No newline at end of file
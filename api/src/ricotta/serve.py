@@ -0,0 +1,65 @@
+"""Serves the API with hypercorn, by default with one worker process per core.
+
+    python -m ricotta.serve --bind 0.0.0.0:9124
+    API_WORKERS=4 python -m ricotta.serve --bind 0.0.0.0:9124 --bind [::]:9124
+
+The database is prepared once, here, before the workers start. Workers share caches and coalesced generations
+through Redis, and their Prometheus metrics are aggregated through PROMETHEUS_MULTIPROC_DIR. TERM stops accepting
+connections and gives requests in flight up to GRACEFUL_TIMEOUT seconds to finish.
+"""
+import argparse
+import glob
+import os
+import tempfile
+
+from hypercorn.config import Config
+from hypercorn.run import run
+
+from ricotta.config import config
+from ricotta.core.logger import logging
+from ricotta.prepare import prepare_database
+from ricotta.services.database import engine
+
+logger = logging.getLogger(__name__)
+
+
+def share_metrics():
+    """Points every worker at one directory of metric files, emptied of a previous run's."""
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        for path in glob.glob(os.path.join(directory, "*.db")):
+            os.remove(path)
+    else:
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="ricotta-metrics-")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bind", action="append", help="address to listen on, may be repeated")
+    parser.add_argument("--workers", type=int, default=config.workers)
+    parser.add_argument("--skip-prepare", action="store_true", help="the database was already prepared")
+    args = parser.parse_args()
+
+    if args.workers > 1 and config.job_queue_backend == 'memory':
+        logger.warning("Each worker keeps its own background jobs with JOB_QUEUE_BACKEND=memory, "
+                       "so job status requests can miss; use the redis backend with several workers")
+
+    if not args.skip_prepare:
+        prepare_database()
+        engine.dispose()
+    # workers are spawned with this environment, so they skip the preparation done above
+    os.environ["PREPARE_DATABASE_ON_STARTUP"] = "false"
+    if args.workers > 1:
+        share_metrics()
+
+    hypercorn_config = Config()
+    hypercorn_config.application_path = "ricotta.main:app"
+    hypercorn_config.bind = args.bind or ["127.0.0.1:9124"]
+    hypercorn_config.workers = args.workers
+    hypercorn_config.graceful_timeout = config.graceful_timeout
+    logger.info(f"Serving on {', '.join(hypercorn_config.bind)} with {args.workers} workers")
+    raise SystemExit(run(hypercorn_config))
+
+
+if __name__ == "__main__":
+    main()
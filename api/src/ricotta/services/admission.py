@@ -0,0 +1,224 @@
+import math
+import time
+
+from redis.exceptions import RedisError
+from starlette.requests import Request
+
+from ricotta.config import config
+from ricotta.core.metrics import ADMISSION_REQUESTS
+from ricotta.core.responses import JSONResponse
+from ricotta.services.jobs import JobQueueUnavailable
+from ricotta.services.lru import LocalLRU
+from ricotta.services.openai_client import key_id as openai_key_id
+from ricotta.services.redis_client import get_redis, mark_unavailable
+
+KEY_PREFIX = "ricotta:admission:"
+
+GENERATION = "generation"
+# every endpoint that does not generate, answers included; they only cost a database query or a cache lookup
+READ = "read"
+
+GENERATION_PATHS = ("/card/generate", "/card/generate/stream")
+EXEMPT_PATHS = ("/ping", "/metrics", "/docs", "/openapi.json")
+# the app is also mounted under /api, whose requests go through the middleware again with the prefix stripped
+MOUNT_PREFIX = "/api"
+SCOPE_KEY = "ricotta.admission"
+
+# Takes a token from every bucket in KEYS, or from none of them. ARGV is the current time followed by the rate per
+# second and the capacity of each bucket. Returns the 1-based index of the bucket that refused, 0 when admitted, and
+# the seconds until it has a token again, as a string since Redis truncates numbers returned by scripts.
+TAKE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local tokens = {}
+local denied, wait = 0, 0
+for i, key in ipairs(KEYS) do
+    local rate, capacity = tonumber(ARGV[i * 2]), tonumber(ARGV[i * 2 + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'updated')
+    local available = tonumber(state[1]) or capacity
+    local updated = tonumber(state[2]) or now
+    tokens[i] = math.min(capacity, available + math.max(0, now - updated) * rate)
+    if tokens[i] < 1 and (1 - tokens[i]) / rate > wait then
+        denied, wait = i, (1 - tokens[i]) / rate
+    end
+end
+for i, key in ipairs(KEYS) do
+    local rate, capacity = tonumber(ARGV[i * 2]), tonumber(ARGV[i * 2 + 1])
+    if denied == 0 then
+        tokens[i] = tokens[i] - 1
+    end
+    redis.call('HSET', key, 'tokens', tostring(tokens[i]), 'updated', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(capacity / rate) + 1)
+end
+return {denied, tostring(wait)}
+"""
+
+
+def classify(method: str, path: str):
+    """Returns the budget a request is charged to, or None for requests that are always admitted."""
+    if path.startswith(MOUNT_PREFIX + "/"):
+        path = path[len(MOUNT_PREFIX):]
+    if method == "OPTIONS" or path.startswith(EXEMPT_PATHS):
+        return None
+    if method == "POST" and path.rstrip("/") in GENERATION_PATHS:
+        return GENERATION
+    return READ
+
+
+def client_ip(request: Request) -> str:
+    """The client's address as seen by the outermost of the ADMISSION_TRUSTED_PROXIES proxies in front of the API.
+
+    Every proxy appends the address it was connected from to X-Forwarded-For, so only that many entries from the right
+    can be trusted; whatever is left of them was sent by the client. A request with fewer entries did not come through
+    the proxies, and is keyed on the connection's address.
+    """
+    proxies = config.admission_trusted_proxies
+    if proxies > 0:
+        hops = [hop.strip() for header in request.headers.getlist("x-forwarded-for") for hop in header.split(",")]
+        hops = [hop for hop in hops if hop]
+        if len(hops) >= proxies:
+            return hops[-proxies]
+    return request.client.host if request.client else "unknown"
+
+
+def key_id(request: Request) -> str:
+    """Identifies the OpenAI key a generation will use without keeping the key itself, "server" for our own."""
+    api_key = request.headers.get("x-openai-key")
+    if not api_key:
+        return "server"
+    return openai_key_id(api_key)
+
+
+def budgets(budget: str, request: Request):
+    """Returns the (name, bucket key, rate per second, capacity) buckets a request takes a token from."""
+    if budget == GENERATION:
+        limits = [
+            ("client", f"{GENERATION}:ip:{client_ip(request)}",
+             config.admission_generations_per_minute, config.admission_generation_burst),
+            ("key", f"{GENERATION}:key:{key_id(request)}",
+             config.admission_key_generations_per_minute, config.admission_key_generation_burst),
+        ]
+    else:
+        limits = [("client", f"{READ}:ip:{client_ip(request)}", config.admission_reads_per_minute, config.admission_read_burst)]
+    # a budget of 0 per minute is unlimited
+    return [(name, key, per_minute / 60, max(1, burst)) for name, key, per_minute, burst in limits if per_minute > 0]
+
+
+class LocalBuckets:
+    """Token buckets in the worker, for local development and while Redis is unreachable. Same semantics as
+    TAKE_SCRIPT, but each worker then admits its own share."""
+
+    def __init__(self, max_entries: int):
+        # an idle bucket is full again within capacity / rate seconds, so evicting it after that changes nothing
+        self.buckets = LocalLRU(max_entries, ttl=3600)
+
+    def take(self, buckets: list, now: float):
+        tokens = []
+        denied, wait = 0, 0.0
+        for index, (_, key, rate, capacity) in enumerate(buckets, 1):
+            available, updated = self.buckets.get(key) or (capacity, now)
+            tokens.append(min(capacity, available + max(0.0, now - updated) * rate))
+            if tokens[-1] < 1 and (1 - tokens[-1]) / rate > wait:
+                denied, wait = index, (1 - tokens[-1]) / rate
+        for (_, key, _, _), available in zip(buckets, tokens):
+            self.buckets.set(key, (available - 1 if denied == 0 else available, now))
+        return denied, wait
+
+
+class AdmissionController:
+    """Decides whether a request is handled, against token buckets per client IP and, for generation, per OpenAI key.
+
+    Buckets live in Redis so that every worker draws from the same budget, with a fallback to buckets in the worker
+    while Redis is unreachable. A worker also sheds requests when it already has too many in flight, or when the
+    background generation queue is too deep, since admitting more would only make every request slower.
+    """
+
+    def __init__(self):
+        self.local = LocalBuckets(config.admission_local_max_entries)
+        self.script = None
+        self.script_client = None
+
+    async def take(self, buckets: list):
+        """Returns the name of the bucket that refused and the seconds to wait, or (None, 0) when admitted."""
+        if not buckets:
+            return None, 0.0
+        now = time.time()
+        denied, wait = await self._redis_take(buckets, now)
+        if denied is None:
+            denied, wait = self.local.take(buckets, now)
+        return (buckets[denied - 1][0], wait) if denied else (None, 0.0)
+
+    async def _redis_take(self, buckets: list, now: float):
+        client = get_redis()
+        if client is None:
+            return None, 0.0
+        if self.script_client is not client:
+            self.script, self.script_client = client.register_script(TAKE_SCRIPT), client
+        args = [now]
+        for _, _, rate, capacity in buckets:
+            args += [rate, capacity]
+        try:
+            denied, wait = await self.script(keys=[KEY_PREFIX + key for _, key, _, _ in buckets], args=args)
+        except RedisError as err:
+            mark_unavailable(err)
+            return None, 0.0
+        return int(denied), float(wait)
+
+    async def check(self, budget: str, request: Request, in_flight: int, queue_depth=None):
+        """Returns the reason and Retry-After seconds for a refused request, or None to admit it."""
+        max_in_flight = config.admission_max_generations_in_flight if budget == GENERATION else config.admission_max_reads_in_flight
+        if max_in_flight and in_flight >= max_in_flight:
+            return "in_flight", config.admission_shed_retry_after
+        if budget == GENERATION and queue_depth is not None and config.admission_max_queued_jobs \
+                and request.query_params.get("background", "").lower() == "true":
+            try:
+                if await queue_depth() >= config.admission_max_queued_jobs:
+                    return "queue_depth", config.admission_shed_retry_after
+            except JobQueueUnavailable:
+                # the endpoint reports the queue as unavailable itself
+                pass
+        denied, wait = await self.take(budgets(budget, request))
+        if denied is not None:
+            return f"{denied}_limit", wait
+        return None
+
+
+admission_controller = AdmissionController()
+
+
+class AdmissionMiddleware:
+    """Answers 429 with a Retry-After header to requests the admission controller refuses.
+
+    A plain ASGI middleware rather than an `@app.middleware` function, so that a streamed generation counts as in
+    flight until its last event is sent, not only until its headers are.
+    """
+
+    def __init__(self, app, queue_depth=None):
+        self.app = app
+        self.queue_depth = queue_depth
+        self.in_flight = {GENERATION: 0, READ: 0}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not config.admission_enabled or scope.get(SCOPE_KEY):
+            return await self.app(scope, receive, send)
+        budget = classify(scope["method"], scope["path"])
+        if budget is None:
+            return await self.app(scope, receive, send)
+        scope[SCOPE_KEY] = budget
+
+        refused = await admission_controller.check(budget, Request(scope), self.in_flight[budget], self.queue_depth)
+        if refused is not None:
+            reason, retry_after = refused
+            ADMISSION_REQUESTS.labels(budget, reason).inc()
+            response = JSONResponse(
+                content={"detail": "Too many requests, try again later"},
+                status_code=429,
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+            )
+            return await response(scope, receive, send)
+
+        ADMISSION_REQUESTS.labels(budget, "admitted").inc()
+        self.in_flight[budget] += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight[budget] -= 1
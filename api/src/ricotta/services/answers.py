@@ -0,0 +1,196 @@
+import json
+import time
+from datetime import timedelta, timezone
+
+from sqlalchemy import and_, delete, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ricotta.config import config
+from ricotta.models.card import AnswerReceipt, Card, UserCardInteraction
+from ricotta.services.database import upsert_insert
+from ricotta.services.scheduler import DEFAULT_EASE, schedule, utcnow
+from ricotta.services.stats import update_stats
+
+
+class UnknownCardsError(ValueError):
+    def __init__(self, card_ids):
+        self.card_ids = sorted(card_ids)
+        super().__init__(f"Cards not found: {self.card_ids}")
+
+
+def _naive_utc(answered_at, now):
+    if answered_at is None:
+        return now
+    if answered_at.tzinfo is not None:
+        answered_at = answered_at.astimezone(timezone.utc).replace(tzinfo=None)
+    # client clocks can run ahead, and a due date computed from the future would hide the card for too long
+    return min(answered_at, now)
+
+
+def _load_states(db: Session, user_id: int, card_ids: set):
+    """Reads the current interaction of every answered card in one query, as detached scheduling state."""
+    rows = db.query(Card.id, Card.language,
+                    UserCardInteraction.interval_days, UserCardInteraction.ease, UserCardInteraction.repetitions)\
+        .outerjoin(UserCardInteraction, and_(UserCardInteraction.card_id == Card.id, UserCardInteraction.user_id == user_id))\
+        .filter(Card.id.in_(card_ids))\
+        .all()
+    missing = card_ids - {row.id for row in rows}
+    if missing:
+        raise UnknownCardsError(missing)
+
+    states = {}
+    for row in rows:
+        states[row.id] = UserCardInteraction(
+            user_id=user_id,
+            card_id=row.id,
+            language=row.language,
+            times_seen=0,
+            times_correct=0,
+            interval_days=row.interval_days or 0,
+            ease=row.ease if row.ease is not None else DEFAULT_EASE,
+            repetitions=row.repetitions or 0,
+        )
+    return states
+
+
+def _upsert_interactions(db: Session, rows: list):
+    """Applies all rows in one statement; counters are added to the stored ones, scheduling state replaces it."""
+    insert = upsert_insert(db.get_bind())
+    table = UserCardInteraction.__table__
+    stmt = insert(table).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.card_id],
+        set_={
+            'times_seen': table.c.times_seen + stmt.excluded.times_seen,
+            'times_correct': table.c.times_correct + stmt.excluded.times_correct,
+            'language': stmt.excluded.language,
+            'due_at': stmt.excluded.due_at,
+            'interval_days': stmt.excluded.interval_days,
+            'ease': stmt.excluded.ease,
+            'repetitions': stmt.excluded.repetitions,
+        },
+    ).returning(table.c.card_id, table.c.times_seen, table.c.times_correct, table.c.due_at)
+    return db.execute(stmt).all()
+
+
+def _stored_response(db: Session, user_id: int, idempotency_key: str):
+    receipt = db.query(AnswerReceipt)\
+        .filter(and_(AnswerReceipt.user_id == user_id, AnswerReceipt.idempotency_key == idempotency_key))\
+        .one_or_none()
+    return json.loads(receipt.response) if receipt else None
+
+
+# when this process next deletes expired receipts while recording answers, on the monotonic clock
+_next_prune = 0.0
+
+
+def _delete_expired_receipts(db: Session, limit: int = None):
+    """Deletes receipts older than ANSWER_RECEIPT_TTL, at most `limit` of them, without committing. A client retries a
+    batch within minutes of sending it, so an old receipt only takes up space. Returns the number deleted."""
+    expired = select(AnswerReceipt.id).where(AnswerReceipt.created_at < utcnow() - timedelta(seconds=config.answer_receipt_ttl))
+    if limit:
+        expired = expired.order_by(AnswerReceipt.created_at).limit(limit)
+    return db.execute(delete(AnswerReceipt).where(AnswerReceipt.id.in_(expired))).rowcount
+
+
+def prune_answer_receipts(db: Session):
+    """Deletes every expired receipt. Returns the number deleted."""
+    deleted = _delete_expired_receipts(db)
+    db.commit()
+    return deleted
+
+
+def _prune_due() -> bool:
+    """Whether ANSWER_RECEIPT_PRUNE_INTERVAL has passed since this process last pruned receipts."""
+    global _next_prune
+    now = time.monotonic()
+    if now < _next_prune:
+        return False
+    _next_prune = now + config.answer_receipt_prune_interval
+    return True
+
+
+def record_answers(db: Session, user_id: int, answers: list, idempotency_key: str = None):
+    """Records a batch of answers for a user in a single transaction.
+
+    `answers` are objects with `card_id`, `correct` and an optional `answered_at`; they are applied in the order they
+    were answered. When `idempotency_key` is given, the response is stored with it and returned unchanged for any
+    retry of the same batch.
+    """
+    if idempotency_key:
+        stored = _stored_response(db, user_id, idempotency_key)
+        if stored is not None:
+            return stored
+
+    now = utcnow()
+    states = _load_states(db, user_id, {answer.card_id for answer in answers})
+    answered = []
+    for answer in sorted(answers, key=lambda answer: _naive_utc(answer.answered_at, now)):
+        state = states[answer.card_id]
+        state.times_seen += 1
+        state.times_correct += 1 if answer.correct else 0
+        schedule(state, answer.correct, now=_naive_utc(answer.answered_at, now))
+        answered.append((state.language, _naive_utc(answer.answered_at, now), answer.correct))
+
+    rows = [{
+        'user_id': state.user_id,
+        'card_id': state.card_id,
+        'language': state.language,
+        'times_seen': state.times_seen,
+        'times_correct': state.times_correct,
+        'due_at': state.due_at,
+        'interval_days': state.interval_days,
+        'ease': state.ease,
+        'repetitions': state.repetitions,
+    } for state in states.values()]
+    updated = _upsert_interactions(db, rows)
+    # a card is new to the user when the stored count is the batch's own, i.e. nothing was stored before
+    new_cards = {}
+    for row in updated:
+        state = states[row.card_id]
+        if row.times_seen == state.times_seen:
+            new_cards[state.language] = new_cards.get(state.language, 0) + 1
+    update_stats(db, user_id, answered, new_cards)
+    response = {
+        "cards": [{
+            "id": row.card_id,
+            "times_seen": row.times_seen,
+            "times_correct": row.times_correct,
+            "due_at": row.due_at.isoformat(),
+        } for row in updated]
+    }
+
+    if idempotency_key:
+        db.add(AnswerReceipt(user_id=user_id, idempotency_key=idempotency_key, response=json.dumps(response), created_at=now))
+        # receipts are only written here, so this is where they are also cleared, a bounded batch at a time
+        if _prune_due():
+            _delete_expired_receipts(db, config.answer_receipt_prune_batch)
+    try:
+        db.commit()
+    except IntegrityError:
+        # a concurrent retry with the same key committed first, so its result is the one to report
+        db.rollback()
+        stored = _stored_response(db, user_id, idempotency_key) if idempotency_key else None
+        if stored is None:
+            raise
+        return stored
+    return response
+
+
+def merge_duplicate_interactions(db: Session):
+    """Folds duplicate (user, card) interactions into the oldest one so the unique index can be created."""
+    duplicates = db.query(UserCardInteraction.user_id, UserCardInteraction.card_id)\
+        .group_by(UserCardInteraction.user_id, UserCardInteraction.card_id)\
+        .having(func.count(UserCardInteraction.id) > 1)\
+        .all()
+    for user_id, card_id in duplicates:
+        keeper, *rest = db.query(UserCardInteraction)\
+            .filter(and_(UserCardInteraction.user_id == user_id, UserCardInteraction.card_id == card_id))\
+            .order_by(UserCardInteraction.id)\
+            .all()
+        for interaction in rest:
+            keeper.times_seen += interaction.times_seen
+            keeper.times_correct += interaction.times_correct
+            db.delete(interaction)
+    db.commit()
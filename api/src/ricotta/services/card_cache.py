@@ -0,0 +1,101 @@
+import json
+
+from redis.exceptions import RedisError
+from sqlalchemy.orm import Session, selectinload
+
+from ricotta.config import config
+from ricotta.core.metrics import observe_cache
+from ricotta.models.card import Card
+from ricotta.services.card_store import card_payload
+from ricotta.services.database import run_db
+from ricotta.services.lru import LocalLRU
+from ricotta.services.redis_client import get_redis, mark_unavailable
+
+KEY_PREFIX = "ricotta:card:"
+
+
+def load_card_payloads(db: Session, card_ids):
+    """Builds the payloads of the given cards from the database, options loaded in one extra query."""
+    cards = db.query(Card)\
+        .options(selectinload(Card.incorrect_options))\
+        .filter(Card.id.in_(list(card_ids)))\
+        .all()
+    return [card_payload(card.id, card.word, card.language, card.english, card.sentenceLANG, card.sentenceEN,
+                         [incorrect_option.option for incorrect_option in card.incorrect_options])
+            for card in cards]
+
+
+class CardPayloadCache:
+    """Serialized card payloads by card id, in an in-process LRU backed by Redis.
+
+    Cards and their options are never updated or deleted once inserted, imports included, so entries are written
+    when a card is inserted or first read and only expire; there is nothing to invalidate, in this worker or others.
+    Options are stored unshuffled; responses shuffle their own copy.
+    """
+
+    def __init__(self, ttl=None, max_entries=None):
+        self.ttl = ttl or config.card_cache_ttl
+        self.local = LocalLRU(max_entries or config.card_cache_max_entries, self.ttl)
+        self.hits = 0
+        self.misses = 0
+
+    async def get_many(self, card_ids: list):
+        """Returns a dict of the cached payloads among `card_ids`."""
+        found = {}
+        for card_id in card_ids:
+            raw = self.local.get(card_id)
+            if raw is not None:
+                found[card_id] = raw
+
+        remote_ids = [card_id for card_id in card_ids if card_id not in found]
+        client = get_redis() if remote_ids else None
+        if client is not None:
+            try:
+                values = await client.mget([KEY_PREFIX + str(card_id) for card_id in remote_ids])
+            except RedisError as err:
+                mark_unavailable(err)
+                values = []
+            for card_id, raw in zip(remote_ids, values):
+                if raw is not None:
+                    self.local.set(card_id, raw)
+                    found[card_id] = raw
+
+        self.hits += len(found)
+        self.misses += len(card_ids) - len(found)
+        observe_cache("card", len(found), len(card_ids) - len(found))
+        return {card_id: json.loads(raw) for card_id, raw in found.items()}
+
+    async def set_many(self, payloads: list):
+        if not payloads:
+            return
+        serialized = {payload["id"]: json.dumps(payload).encode() for payload in payloads}
+        for card_id, raw in serialized.items():
+            self.local.set(card_id, raw)
+
+        client = get_redis()
+        if client is None:
+            return
+        try:
+            async with client.pipeline(transaction=False) as pipe:
+                for card_id, raw in serialized.items():
+                    pipe.set(KEY_PREFIX + str(card_id), raw, ex=self.ttl)
+                await pipe.execute()
+        except RedisError as err:
+            mark_unavailable(err)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "local_entries": len(self.local)}
+
+
+card_cache = CardPayloadCache()
+
+
+async def get_card_payloads(db: Session, card_ids: list):
+    """Returns payloads for `card_ids` in the given order, filling the cache from the database for the missing ones."""
+    payloads = await card_cache.get_many(card_ids)
+    missing = [card_id for card_id in card_ids if card_id not in payloads]
+    if missing:
+        loaded = await run_db(db, load_card_payloads, missing)
+        await card_cache.set_many(loaded)
+        payloads.update((payload["id"], payload) for payload in loaded)
+    return [payloads[card_id] for card_id in card_ids if card_id in payloads]
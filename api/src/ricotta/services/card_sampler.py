@@ -0,0 +1,52 @@
+import random
+import threading
+from array import array
+
+from sqlalchemy.orm import Session
+
+from ricotta.models.card import Card
+
+
+class CardIdPool:
+    """Keeps the card ids of each language in memory so random picks do not need `ORDER BY random()`.
+
+    Cards are only ever added, so each call tops the pool up with ids above the highest one seen, which is a range
+    scan on the (language, id) index that is usually empty. Ids removed from the table are simply not returned.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.max_ids = {}
+        self.lock = threading.Lock()
+
+    def refresh(self, db: Session, language: str):
+        # The query runs outside the lock: with the async engine it suspends on the event loop thread, where a
+        # second caller waiting on a thread lock would block the loop for good.
+        rows = db.query(Card.id)\
+            .filter(Card.language == language, Card.id > self.max_ids.get(language, 0))\
+            .order_by(Card.id)\
+            .all()
+        if not rows:
+            return
+        with self.lock:
+            # another caller may have added some of these rows in the meantime
+            last_id = self.max_ids.get(language, 0)
+            new_ids = [row.id for row in rows if row.id > last_id]
+            if new_ids:
+                self.ids.setdefault(language, array('q')).extend(new_ids)
+                self.max_ids[language] = new_ids[-1]
+
+    def sample(self, db: Session, language: str, k: int):
+        self.refresh(db, language)
+        ids = self.ids.get(language)
+        if not ids:
+            return []
+        return random.sample(ids, min(k, len(ids)))
+
+    def reset(self):
+        with self.lock:
+            self.ids = {}
+            self.max_ids = {}
+
+
+card_id_pool = CardIdPool()
@@ -0,0 +1,98 @@
+from sqlalchemy.orm import Session, selectinload
+
+from ricotta.models.card import Card, IncorrectOption
+from ricotta.core.logger import logging
+from ricotta.services.database import upsert_insert
+from ricotta.services.sentence_index import minhash
+
+logger = logging.getLogger(__name__)
+
+CARD_FIELDS = ('word', 'english', 'sentenceLANG', 'sentenceEN')
+
+
+def card_payload(card_id: int, word: str, language: str, english: str, sentence_lang: str, sentence_en: str, incorrect_options: list):
+    return {
+        "id": card_id,
+        "word": word,
+        "language": language,
+        "correct": english,
+        "english": english,
+        "sentenceLANG": sentence_lang,
+        "sentenceEN": sentence_en,
+        "options": [english] + list(incorrect_options),
+    }
+
+
+def _parse_words(words: list):
+    """Keeps the well-formed words returned by the model, once per sentence."""
+    candidates = {}
+    for word in words:
+        try:
+            fields = {field: str(word[field]) for field in CARD_FIELDS}
+            options = [str(option) for option in word['incorrect_options']]
+        except (KeyError, TypeError) as err:
+            logger.warning(f"Skipping malformed word {word!r}: {err}")
+            continue
+        candidates.setdefault(fields['sentenceLANG'], (fields, options))
+    return candidates
+
+
+def _existing_cards(db: Session, sentences):
+    cards = db.query(Card)\
+        .options(selectinload(Card.incorrect_options))\
+        .filter(Card.sentenceLANG.in_(list(sentences)))\
+        .all()
+    return {card.sentenceLANG: card for card in cards}
+
+
+def save_generated_cards(db: Session, words: list, language: str):
+    """Persists the words returned by the model and returns them as card payloads, in the order they were given.
+
+    Existing sentences are looked up with a single IN query and new cards and their options are bulk inserted in one
+    transaction. Inserts skip sentences that another request stored in the meantime, and those are returned as the
+    existing cards instead of failing the batch.
+    """
+    candidates = _parse_words(words)
+    if not candidates:
+        return []
+
+    existing = _existing_cards(db, candidates.keys())
+    if existing:
+        logger.warning(f"Cards already exist: {sorted(card.id for card in existing.values())}")
+
+    new_sentences = [sentence for sentence in candidates if sentence not in existing]
+    inserted = {}
+    if new_sentences:
+        insert = upsert_insert(db.get_bind())
+        table = Card.__table__
+        stmt = insert(table)\
+            .values([{**candidates[sentence][0], 'language': language, 'sentence_minhash': minhash(sentence)}
+                     for sentence in new_sentences])\
+            .on_conflict_do_nothing(index_elements=[table.c.sentenceLANG])\
+            .returning(table.c.id, table.c.sentenceLANG)
+        inserted = {row.sentenceLANG: row.id for row in db.execute(stmt)}
+
+        option_rows = [
+            {'card_id': card_id, 'option': option}
+            for sentence, card_id in inserted.items()
+            for option in candidates[sentence][1]
+        ]
+        if option_rows:
+            db.execute(insert(IncorrectOption.__table__).values(option_rows))
+    db.commit()
+
+    raced = [sentence for sentence in new_sentences if sentence not in inserted]
+    if raced:
+        existing.update(_existing_cards(db, raced))
+
+    cards = []
+    for sentence, (fields, options) in candidates.items():
+        if sentence in inserted:
+            cards.append(card_payload(inserted[sentence], fields['word'], language, fields['english'],
+                                      sentence, fields['sentenceEN'], options))
+        elif sentence in existing:
+            card = existing[sentence]
+            cards.append(card_payload(card.id, card.word, card.language, card.english,
+                                      card.sentenceLANG, card.sentenceEN,
+                                      [incorrect_option.option for incorrect_option in card.incorrect_options]))
+    return cards
@@ -1,10 +1,59 @@
+import asyncio
 import json
+import time
 
+import aiohttp
 import openai
 
+from ricotta.config import config
+from ricotta.core.logger import logging
+from ricotta.core.metrics import OPENAI_DURATION, OPENAI_EVENTS, OPENAI_TOKENS
+from ricotta.services.json_stream import ArrayItemParser, loads_lenient
+from ricotta.services.openai_client import openai_client
+from ricotta.services.prompt import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Bounds the number of in-flight upstream generations per worker, independently of the threadpool size.
+generation_semaphore = asyncio.Semaphore(config.generation_concurrency)
+
+_session = None
+# marks the end of the words read by `ChatExtractor._read_stream`
+_STREAM_END = object()
+
+
+def get_session():
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=config.openai_pool_size),
+            timeout=aiohttp.ClientTimeout(total=config.openai_timeout),
+        )
+    return _session
+
+
+class MalformedResponseError(Exception):
+    """The model kept answering with something that is not a list of words."""
+
+
+def _words(data):
+    # the word list may be the whole answer or, with the JSON response format, sit under any key of an object
+    if isinstance(data, dict):
+        data = data.get("words", next((value for value in data.values() if isinstance(value, list)), None))
+    if isinstance(data, list) and all(isinstance(word, dict) for word in data):
+        return data
+    return None
+
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
 
 class ChatExtractor:
-    def __init__(self, model_key=None, model=None, max_tokens=500):
+    def __init__(self, model_key=None, model=None, max_tokens=500, api_base=None):
         if model_key:
             self.model_key = model_key
         else:
@@ -15,56 +64,129 @@ class ChatExtractor:
             raise ValueError("No OpenAI API model provided")
         self.max_tokens = max_tokens
         self.model = model
+        self.api_base = api_base or config.openai_api_base
         self.system_role = """You are a helpful language teaching assistant designed to output JSON."""
 
-    def extract(self, description, db_words, language):
-        try:
-            string_template = f"""Give 5 words written in {language} that are around the topic: {description}, \
-            accompanied with its correct English translation and three incorrect translations
-            that are realistic and relevant to the correct answer.
-            Also give me the English translation of the word, and present the word within the context
-            of an {language} sentence, and also provide its English translation. Do not provide words that are
-            the same in both languages. Only provide words that are relevant to the topic.
-
-            Do NOT include these words that are already in the database, BUT they CAN be used as incorrect options:
-            {db_words}
-
-            Instructions:
-            1. Format the output as JSON with the data represented as an array of dictionaries with the following keys:
-            "word": str // {language} word
-            "incorrect_options": List[str] // Incorrect English translations
-            "english": str // English translation of the {language} word
-            "sentenceLANG": str // Example sentence in {language} using the word
-            "sentenceEN": str // English translation of the example sentence
-            2. Ensure to return JSON parsable output.
-            """
-     
-            content = json.dumps(string_template)
-        except Exception:
-            print(f"Couldn't convert to JSON")
-            raise
+    def _messages(self, description, db_words, language):
+        """`db_words` is the list of known words to exclude, already cut to the prompt's token budget."""
+        excluded = ", ".join(db_words) if db_words else "(none)"
+        content = f"""Give 5 words written in {language} that are around the topic: {description}, \
+accompanied with its correct English translation and three incorrect translations
+that are realistic and relevant to the correct answer.
+Also give me the English translation of the word, and present the word within the context
+of an {language} sentence, and also provide its English translation. Do not provide words that are
+the same in both languages. Only provide words that are relevant to the topic.
+
+Do NOT include these words that are already in the database, BUT they CAN be used as incorrect options:
+{excluded}
 
-        openai.api_key = self.model_key
-        response = openai.ChatCompletion.create(
+Instructions:
+1. Format the output as JSON with the data represented as an array of dictionaries with the following keys:
+"word": str // {language} word
+"incorrect_options": List[str] // Incorrect English translations
+"english": str // English translation of the {language} word
+"sentenceLANG": str // Example sentence in {language} using the word
+"sentenceEN": str // English translation of the example sentence
+2. Ensure to return JSON parsable output.
+"""
+        # counting tokens tokenizes the whole prompt, so only when the line is written
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Prompt for {language} uses {count_tokens(content, self.model)} tokens")
+        return [
+            {"role": "system", "content": self.system_role},
+            {"role": "user", "content": content},
+        ]
+
+    async def _create(self, messages, stream=False):
+        # openai reads the shared session from a context var, so it is set per task
+        openai.aiosession.set(get_session())
+        return await openai.ChatCompletion.acreate(
             model=self.model,
-            messages=[
-                {"role": "system", "content": self.system_role},
-                {"role": "user", "content": content},
-            ],
+            messages=messages,
             temperature=0.0,
             max_tokens=self.max_tokens,
             presence_penalty=0.0,
             frequency_penalty=0.0,
-            timeout=40,
+            api_key=self.model_key,
+            api_base=self.api_base,
+            request_timeout=config.openai_timeout,
             response_format={"type": "json_object"},
+            stream=stream,
         )
+
+    def _observe(self, start, outcome, prompt_tokens=0, completion_tokens=0):
+        OPENAI_DURATION.labels(self.model, outcome).observe(time.perf_counter() - start)
+        OPENAI_TOKENS.labels(self.model, "prompt").inc(prompt_tokens)
+        OPENAI_TOKENS.labels(self.model, "completion").inc(completion_tokens)
+
+    async def _complete(self, messages):
+        """Makes a single completion request and returns the message content."""
+        start = time.perf_counter()
         try:
-            response = response["choices"]
-            response = response[0]["message"]["content"]
-            return json.loads(response)
-        except json.decoder.JSONDecodeError:
-            print("Couldn't parse JSON from model response")
-        except Exception as err:
-            print(f"Unexpected {err=}, {type(err)=}")
+            response = await self._create(messages)
+        except Exception:
+            self._observe(start, "error")
             raise
+        usage = response.get("usage") or {}
+        self._observe(start, "ok", usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
+        return response["choices"][0]["message"]["content"] or ""
+
+    async def extract(self, description, db_words, language):
+        """Returns the generated words. Upstream errors are retried by the client, malformed answers here."""
+        messages = self._messages(description, db_words, language)
+        async with generation_semaphore:
+            for attempt in range(config.openai_json_retries + 1):
+                content = await openai_client.call(self.model_key, self.api_base, lambda: self._complete(messages))
+                try:
+                    words = _words(loads_lenient(content))
+                except json.decoder.JSONDecodeError:
+                    words = None
+                if words is not None:
+                    return words
+                OPENAI_EVENTS.labels("malformed_json").inc()
+                logger.warning(f"Malformed model response on attempt {attempt + 1}: {content[:200]!r}")
+        raise MalformedResponseError("The model response had no parsable list of words")
+
+    async def stream(self, description, db_words, language):
+        """Yields each word as soon as the model has finished writing it.
 
+        The upstream is read by a task of its own, so the generation slot is given back as soon as the model is done,
+        however slowly the caller takes the words.
+        """
+        messages = self._messages(description, db_words, language)
+        words = asyncio.Queue()
+        reader = asyncio.create_task(self._read_stream(messages, words))
+        try:
+            while (word := await words.get()) is not _STREAM_END:
+                yield word
+            # raises the upstream error, if any, after the words that came before it
+            await reader
+        finally:
+            # the caller stopped early, e.g. the client disconnected
+            reader.cancel()
+
+    async def _read_stream(self, messages, words: asyncio.Queue):
+        parser = ArrayItemParser()
+        content = []
+        try:
+            async with generation_semaphore:
+                start = time.perf_counter()
+                outcome = "error"
+                try:
+                    # only opening the stream is retried, a stream that breaks off midway is not
+                    response = await openai_client.call(self.model_key, self.api_base,
+                                                        lambda: self._create(messages, stream=True), hedge=False)
+                    async for chunk in response:
+                        delta = chunk["choices"][0].get("delta", {}).get("content")
+                        if not delta:
+                            continue
+                        content.append(delta)
+                        for word in parser.feed(delta):
+                            words.put_nowait(word)
+                    outcome = "ok"
+                finally:
+                    # streamed chunks carry no usage, so the tokens are counted locally
+                    self._observe(start, outcome, count_tokens(messages[-1]["content"], self.model),
+                                  count_tokens("".join(content), self.model) if content else 0)
+        finally:
+            words.put_nowait(_STREAM_END)
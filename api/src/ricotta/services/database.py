@@ -1,20 +1,149 @@
 from sqlalchemy import (
     create_engine,
+    event,
+    inspect,
+    text,
 )
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.concurrency import run_in_threadpool
 
 from ricotta.config import config
 
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
 
-engine = create_engine(config.database_uri, echo=config.debug)
+
+def engine_options(uri: str, is_async: bool = False):
+    url = make_url(uri)
+    options = {"echo": config.debug, "pool_pre_ping": config.db_pool_pre_ping, "pool_recycle": config.db_pool_recycle}
+    # in-memory SQLite databases live in a single connection, so there is no pool to size
+    if url.get_backend_name() != 'sqlite' or url.database not in (None, '', ':memory:'):
+        options.update(pool_size=config.db_pool_size, max_overflow=config.db_max_overflow,
+                       pool_timeout=config.db_pool_timeout)
+        if is_async:
+            # aiosqlite file databases default to NullPool before SQLAlchemy 2.0.38, which rejects the sizing options
+            options.update(poolclass=AsyncAdaptedQueuePool)
+    return options
+
+
+def async_database_uri(uri: str):
+    url = make_url(uri)
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()]).render_as_string(hide_password=False)
+
+
+def tune_sqlite(engine):
+    """Lets readers and a writer work concurrently: WAL journal, and a busy timeout instead of failing on locks."""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA busy_timeout={config.sqlite_busy_timeout}")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+
+engine = create_engine(config.database_uri, **engine_options(config.database_uri))
+tune_sqlite(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Requests use the async engine when DATABASE_ASYNC=true. Startup migrations and background jobs keep the sync one.
+async_engine = None
+AsyncSessionLocal = None
+if config.database_async:
+    async_engine = create_async_engine(async_database_uri(config.database_uri), **engine_options(config.database_uri, is_async=True))
+    tune_sqlite(async_engine.sync_engine)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+def upsert_insert(bind):
+    """Returns the dialect `insert` of the bound database, which supports ON CONFLICT clauses."""
+    return {
+        'postgresql': postgresql.insert,
+        'sqlite': sqlite.insert,
+    }[bind.dialect.name]
+
 
 async def get_db():
-    with SessionLocal() as session:
-        yield session
+    """Yields an AsyncSession with the async engine enabled, a Session otherwise. Use it through `run_db`."""
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as session:
+            yield session
+    else:
+        with SessionLocal() as session:
+            yield session
+
+
+async def run_db(db, fn, *args, **kwargs):
+    """Calls `fn(session, *args, **kwargs)` without blocking the event loop.
+
+    On an AsyncSession the sync function runs on the async driver through `run_sync`. On a Session it runs in the
+    threadpool. Database code is written once, as plain sync functions, for both engines.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
+
+
+async def close_db():
+    if async_engine is not None:
+        await async_engine.dispose()
+
+
+def add_missing_columns():
+    """Adds columns that were added to a model after its table was created.
+
+    New columns must be nullable or have a `text()` server default.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                default = f" DEFAULT {column.server_default.arg.text}" if column.server_default is not None else ""
+                not_null = " NOT NULL" if not column.nullable and default else ""
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default}{not_null}'))
 
 
 def create_db_and_tables():
     Base.metadata.create_all(engine)
+    add_missing_columns()
+
+
+# Indexes that were replaced by one under a new name, by table. They are dropped once their replacement exists.
+REPLACED_INDEXES = {
+    'ricotta__user_card_interactions': {'ix_ricotta__user_card_interactions_user_id_card_id'},
+}
+
+
+def create_missing_indexes():
+    """Creates indexes added to a model after its table was created, since create_all skips existing tables, then
+    drops the REPLACED_INDEXES.
+
+    Runs after data fix-ups so that new unique indexes do not fail on existing rows.
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table_name, names in REPLACED_INDEXES.items():
+            if not inspector.has_table(table_name):
+                continue
+            existing = {index['name'] for index in inspector.get_indexes(table_name)}
+            for name in sorted(names & existing):
+                conn.execute(text(f'DROP INDEX {name}'))
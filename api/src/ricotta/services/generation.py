@@ -0,0 +1,79 @@
+from starlette.concurrency import run_in_threadpool
+
+from ricotta.config import config
+from ricotta.core.logger import logging
+from ricotta.services.card_cache import card_cache
+from ricotta.services.card_store import save_generated_cards
+from ricotta.services.chat_extractor import ChatExtractor
+from ricotta.services.database import SessionLocal
+from ricotta.services.generation_cache import generation_cache
+from ricotta.services.openai_client import key_id
+from ricotta.services.prompt import fit_to_budget
+from ricotta.services.sentence_index import sentence_index
+from ricotta.services.single_flight import generation_flight
+from ricotta.services.word_index import word_index
+
+logger = logging.getLogger(__name__)
+
+
+def known_words(language: str, subject: str):
+    """Returns the known words closest to the subject that fit in the prompt's exclusion budget."""
+    with SessionLocal() as db:
+        word_index.refresh(db, language)
+        if config.near_duplicate_enabled:
+            # refreshed here too, so that save_cards checks against every stored sentence
+            sentence_index.refresh(db, language)
+    return fit_to_budget(word_index.ranked(language, subject), config.prompt_exclusion_tokens)
+
+
+def save_cards(words: list, language: str):
+    """Stores the generated words that are not known yet. The prompt only lists some of the known words, so the
+    model may still repeat others; those are dropped here against the full word index, and rewordings of stored
+    sentences against the sentence index."""
+    fresh = word_index.unknown(language, words)
+    if config.near_duplicate_enabled:
+        fresh = sentence_index.unknown(language, fresh)
+    if len(fresh) < len(words):
+        logger.info(f"Dropped {len(words) - len(fresh)} known {language} words from a generation")
+    with SessionLocal() as db:
+        try:
+            cards = save_generated_cards(db, fresh, language)
+        except Exception:
+            db.rollback()
+            raise
+    word_index.add(language, cards)
+    sentence_index.add(language, cards)
+    return cards
+
+
+async def generate_cards(chat: ChatExtractor, subject: str, language: str):
+    """Returns cached cards for the subject, or generates, stores and caches new ones.
+
+    Used from requests and job workers alike, so it opens its own sessions rather than borrowing a request's.
+    """
+    cached_cards = await generation_cache.get(language, subject)
+    if cached_cards is not None:
+        return cached_cards
+
+    # DB work stays sync, so it is pushed to the threadpool to keep the event loop free during generation
+    db_words = await run_in_threadpool(known_words, language, subject)
+
+    words = await chat.extract(description=subject, db_words=db_words, language=language)
+    cards = await run_in_threadpool(save_cards, words, language)
+    await card_cache.set_many(cards)
+    # a generation that only repeated known words is not worth keeping for a week
+    if cards:
+        await generation_cache.set(language, subject, cards)
+    return cards
+
+
+async def generate_cards_once(chat: ChatExtractor, subject: str, language: str):
+    """Like generate_cards, but concurrent calls for the same (language, subject) and OpenAI key share one generation.
+
+    The key is part of it so that a caller never gets the result of a call made with someone else's key, nor its
+    authentication error.
+    """
+    return await generation_flight.do(
+        f"{generation_cache.make_key(language, subject)}:{key_id(chat.model_key)}",
+        lambda: generate_cards(chat, subject, language),
+    )
@@ -0,0 +1,94 @@
+import json
+import time
+
+from redis.exceptions import RedisError
+
+from ricotta.config import config
+from ricotta.core.logger import logging
+from ricotta.core.metrics import observe_cache
+from ricotta.services.lru import LocalLRU
+from ricotta.services.redis_client import get_redis, mark_unavailable
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "ricotta:generation:"
+INDEX_KEY = KEY_PREFIX + "index"
+
+
+def normalize_subject(subject: str) -> str:
+    return " ".join(subject.lower().split())
+
+
+class GenerationCache:
+    """Caches generated cards per (language, subject).
+
+    Entries live in Redis with a TTL. A sorted set of insertion times bounds the number of entries, evicting the
+    oldest first. While Redis is unreachable an in-process LRU with the same limits is used instead.
+    """
+
+    def __init__(self, ttl=None, max_entries=None):
+        self.ttl = ttl or config.generation_cache_ttl
+        self.max_entries = max_entries or config.generation_cache_max_entries
+        self.local = LocalLRU(self.max_entries, self.ttl)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(language: str, subject: str) -> str:
+        return f"{KEY_PREFIX}{language}:{normalize_subject(subject)}"
+
+    async def get(self, language: str, subject: str):
+        key = self.make_key(language, subject)
+        value = await self._redis_get(key)
+        if value is None:
+            value = self.local.get(key)
+        if value is None:
+            self.misses += 1
+            observe_cache("generation", 0, 1)
+            return None
+        self.hits += 1
+        observe_cache("generation", 1, 0)
+        return value
+
+    async def set(self, language: str, subject: str, value):
+        key = self.make_key(language, subject)
+        if not await self._redis_set(key, value):
+            self.local.set(key, value)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "local_entries": len(self.local)}
+
+    async def _redis_get(self, key):
+        client = get_redis()
+        if client is None:
+            return None
+        try:
+            raw = await client.get(key)
+        except RedisError as err:
+            mark_unavailable(err)
+            return None
+        return json.loads(raw) if raw is not None else None
+
+    async def _redis_set(self, key, value):
+        client = get_redis()
+        if client is None:
+            return False
+        try:
+            async with client.pipeline(transaction=False) as pipe:
+                pipe.set(key, json.dumps(value), ex=self.ttl)
+                pipe.zadd(INDEX_KEY, {key: time.time()})
+                # entries that already expired through their TTL are dropped from the index as well
+                pipe.zremrangebyscore(INDEX_KEY, "-inf", time.time() - self.ttl)
+                pipe.zcard(INDEX_KEY)
+                *_, size = await pipe.execute()
+            if size > self.max_entries:
+                evicted = await client.zpopmin(INDEX_KEY, size - self.max_entries)
+                if evicted:
+                    await client.delete(*[evicted_key for evicted_key, _ in evicted])
+            return True
+        except RedisError as err:
+            mark_unavailable(err)
+            return False
+
+
+generation_cache = GenerationCache()
@@ -0,0 +1,256 @@
+import asyncio
+import json
+import time
+import uuid
+
+import redis.asyncio as redis
+
+from ricotta.config import config
+from ricotta.core.logger import logging
+from ricotta.services.chat_extractor import ChatExtractor
+from ricotta.services.generation import generate_cards_once
+from ricotta.services.lru import LocalLRU
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "ricotta:jobs:"
+QUEUE_KEY = KEY_PREFIX + "queue"
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueueUnavailable(Exception):
+    pass
+
+
+def _new_job(language: str, subject: str):
+    now = time.time()
+    return {
+        "id": uuid.uuid4().hex,
+        "status": QUEUED,
+        "language": language,
+        "subject": subject,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+class MemoryJobQueue:
+    """Keeps jobs in the API process; consumed by workers started with the app. For local development."""
+
+    def __init__(self, max_entries=None):
+        # records expire after JOB_TTL like those in Redis, and the oldest go first beyond max_entries
+        self.jobs = LocalLRU(max_entries or config.job_memory_max_entries, ttl=config.job_ttl)
+        self.queue = None
+
+    def _queue(self):
+        # created lazily so that it binds to the running loop rather than the one at import time
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+        return self.queue
+
+    async def enqueue(self, language: str, subject: str, api_key: str = None):
+        job = _new_job(language, subject)
+        self.jobs.set(job["id"], job)
+        await self._queue().put({"id": job["id"], "api_key": api_key})
+        return job
+
+    async def get(self, job_id: str):
+        return self.jobs.get(job_id)
+
+    async def update(self, job_id: str, **fields):
+        job = self.jobs.get(job_id) or {"id": job_id}
+        job.update(fields, updated_at=time.time())
+        self.jobs.set(job_id, job)
+        return job
+
+    async def dequeue(self, timeout: float):
+        try:
+            return await asyncio.wait_for(self._queue().get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def requeue(self, item: dict):
+        self._queue().put_nowait(item)
+
+    async def depth(self):
+        return self._queue().qsize()
+
+    async def close(self):
+        pass
+
+
+class CallerKeyJobs:
+    """The jobs of a RedisJobQueue made with the caller's OpenAI key. Their records are in Redis like any other, so every
+    API process can report on them, but their queue entries stay in the process that took the request, so the key is
+    never written to Redis, nor to its append-only file. They are consumed by that process, and lost if it stops first.
+    """
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.queue = None
+
+    def _queue(self):
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+        return self.queue
+
+    async def put(self, item: dict):
+        await self._queue().put(item)
+
+    async def get(self, job_id: str):
+        return await self.jobs.get(job_id)
+
+    async def update(self, job_id: str, **fields):
+        return await self.jobs.update(job_id, **fields)
+
+    async def dequeue(self, timeout: float):
+        try:
+            return await asyncio.wait_for(self._queue().get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def requeue(self, item: dict):
+        self._queue().put_nowait(item)
+
+
+class RedisJobQueue:
+    """Keeps jobs in Redis so that API processes enqueue and separate worker processes consume them.
+
+    Job records expire after `config.job_ttl`. Jobs made with the caller's OpenAI key are queued in `caller_key_jobs`
+    instead, so that the key never reaches Redis.
+    """
+
+    def __init__(self, url: str = None):
+        # a dedicated client without a socket timeout, since BRPOP blocks for longer than the shared client allows
+        self.client = redis.from_url(url or config.redis_url, socket_connect_timeout=0.5)
+        self.caller_key_jobs = CallerKeyJobs(self)
+
+    async def enqueue(self, language: str, subject: str, api_key: str = None):
+        job = _new_job(language, subject)
+        try:
+            async with self.client.pipeline(transaction=True) as pipe:
+                pipe.set(KEY_PREFIX + job["id"], json.dumps(job), ex=config.job_ttl)
+                if not api_key:
+                    pipe.lpush(QUEUE_KEY, json.dumps({"id": job["id"]}))
+                await pipe.execute()
+        except redis.RedisError as err:
+            raise JobQueueUnavailable(str(err)) from err
+        if api_key:
+            await self.caller_key_jobs.put({"id": job["id"], "api_key": api_key})
+        return job
+
+    async def get(self, job_id: str):
+        try:
+            raw = await self.client.get(KEY_PREFIX + job_id)
+        except redis.RedisError as err:
+            raise JobQueueUnavailable(str(err)) from err
+        return json.loads(raw) if raw is not None else None
+
+    async def update(self, job_id: str, **fields):
+        job = await self.get(job_id) or {"id": job_id}
+        job.update(fields, updated_at=time.time())
+        try:
+            await self.client.set(KEY_PREFIX + job_id, json.dumps(job), ex=config.job_ttl)
+        except redis.RedisError as err:
+            raise JobQueueUnavailable(str(err)) from err
+        return job
+
+    async def dequeue(self, timeout: float):
+        item = await self.client.brpop([QUEUE_KEY], timeout=max(1, int(timeout)))
+        return json.loads(item[1]) if item else None
+
+    async def requeue(self, item: dict):
+        """Puts back an item taken by `dequeue`, at the end that is consumed next."""
+        try:
+            await self.client.rpush(QUEUE_KEY, json.dumps(item))
+        except redis.RedisError as err:
+            raise JobQueueUnavailable(str(err)) from err
+
+    async def depth(self):
+        try:
+            return await self.client.llen(QUEUE_KEY) + self.caller_key_jobs._queue().qsize()
+        except redis.RedisError as err:
+            raise JobQueueUnavailable(str(err)) from err
+
+    async def close(self):
+        await self.client.aclose()
+
+
+async def run_job(queue, item: dict):
+    job = await queue.get(item["id"])
+    if job is None:
+        logger.warning(f"Dropping expired job {item['id']}")
+        return
+    await queue.update(job["id"], status=RUNNING)
+    try:
+        chat = ChatExtractor(
+            model_key=item.get("api_key") or config.openai_api_key,
+            model=config.openai_model,
+            max_tokens=None
+        )
+        cards = await generate_cards_once(chat, job["subject"], job["language"])
+    except Exception as err:
+        logger.error(f"Job {job['id']} failed: {err}")
+        await queue.update(job["id"], status=FAILED, error="An unexpected error occurred")
+        return
+    # outside the try, so that losing the queue here puts the job back rather than failing it
+    await queue.update(job["id"], status=DONE, cards=cards)
+
+
+async def requeue(queue, item: dict, stop: asyncio.Event, poll_timeout: float):
+    """Puts the item back on the queue, retrying while the queue is unavailable, until `stop` is set."""
+    while True:
+        try:
+            await queue.requeue(item)
+            return
+        except (JobQueueUnavailable, redis.RedisError) as err:
+            if stop.is_set():
+                logger.error(f"Could not put job {item['id']} back on the queue, it stays queued until it expires: {err}")
+                return
+            logger.error(f"Job queue unavailable, retrying to put job {item['id']} back: {err}")
+            await asyncio.sleep(poll_timeout)
+        except Exception as err:
+            logger.error(f"Could not put job {item['id']} back on the queue, it stays queued until it expires: {err}")
+            return
+
+
+async def consume(queue, stop: asyncio.Event, poll_timeout: float = 5):
+    """Runs jobs from the queue one at a time until `stop` is set.
+
+    A job that loses the queue while it runs, when reading or updating its record, is put back to run again once the
+    queue is available; the generation cache makes the second run cheap if the cards were already generated.
+    """
+    while not stop.is_set():
+        try:
+            item = await queue.dequeue(poll_timeout)
+        except (JobQueueUnavailable, redis.RedisError) as err:
+            logger.error(f"Job queue unavailable: {err}")
+            await asyncio.sleep(poll_timeout)
+            continue
+        if item is None:
+            continue
+        try:
+            await run_job(queue, item)
+        except (JobQueueUnavailable, redis.RedisError) as err:
+            logger.error(f"Job queue unavailable while running job {item['id']}, putting it back: {err}")
+            await asyncio.sleep(poll_timeout)
+            await requeue(queue, item, stop, poll_timeout)
+        except Exception as err:
+            logger.error(f"Job {item['id']} failed: {err}")
+            try:
+                await queue.update(item["id"], status=FAILED, error="An unexpected error occurred")
+            except Exception as update_err:
+                logger.error(f"Could not mark job {item['id']} as failed: {update_err}")
+
+
+def create_job_queue():
+    if config.job_queue_backend == 'redis':
+        return RedisJobQueue()
+    return MemoryJobQueue()
+
+
+job_queue = create_job_queue()
@@ -0,0 +1,81 @@
+import json
+import re
+
+from ricotta.core.logger import logging
+
+logger = logging.getLogger(__name__)
+
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+def loads_lenient(text: str):
+    """Parses model output that is almost JSON: wrapped in a code fence or prose, or with trailing commas.
+
+    Raises json.JSONDecodeError when the text can't be repaired.
+    """
+    try:
+        return json.loads(text)
+    except json.decoder.JSONDecodeError as err:
+        error = err
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    end = max(text.rfind("}"), text.rfind("]"))
+    if not starts or end < min(starts):
+        raise error
+    text = _TRAILING_COMMA.sub(r"\1", text[min(starts):end + 1])
+    return json.loads(text)
+
+
+class ArrayItemParser:
+    """Incrementally extracts the objects of a JSON array from text that arrives in arbitrary pieces.
+
+    Works for a bare array (`[{...}, {...}]`) as well as an array nested in an object (`{"words": [{...}]}`): every
+    object whose parent is an array is decoded and returned as soon as its closing brace has been fed.
+    """
+
+    def __init__(self):
+        self.buffer = []
+        self.containers = []
+        self.in_string = False
+        self.escaped = False
+        self.item_start = None
+
+    def feed(self, text: str):
+        items = []
+        for char in text:
+            if self.item_start is not None:
+                self.buffer.append(char)
+
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                continue
+
+            if char == '"':
+                self.in_string = True
+            elif char in '{[':
+                if char == '{' and self.item_start is None and self.containers and self.containers[-1] == '[':
+                    self.item_start = len(self.containers)
+                    self.buffer = [char]
+                self.containers.append(char)
+            elif char in '}]':
+                if self.containers:
+                    self.containers.pop()
+                if char == '}' and self.item_start is not None and len(self.containers) == self.item_start:
+                    item = self._decode(''.join(self.buffer))
+                    if item is not None:
+                        items.append(item)
+                    self.item_start = None
+                    self.buffer = []
+        return items
+
+    @staticmethod
+    def _decode(raw):
+        try:
+            return json.loads(raw)
+        except json.decoder.JSONDecodeError:
+            logger.error(f"Couldn't parse streamed item: {raw!r}")
+            return None
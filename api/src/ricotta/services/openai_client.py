@@ -0,0 +1,204 @@
+import asyncio
+import hashlib
+import random
+import time
+
+import aiohttp
+import openai
+
+from ricotta.config import config
+from ricotta.core.logger import logging
+from ricotta.core.metrics import OPENAI_EVENTS
+from ricotta.services.lru import LocalLRU
+
+logger = logging.getLogger(__name__)
+
+# Errors that say the upstream is degraded. They are retried and count towards opening the circuit.
+UPSTREAM_ERRORS = (
+    openai.error.APIError,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.Timeout,
+    aiohttp.ClientError,
+    asyncio.TimeoutError,
+)
+# Errors that say the caller should slow down. They are retried but leave the circuit alone.
+THROTTLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.TryAgain,
+)
+
+
+def key_id(api_key: str) -> str:
+    """Identifies an OpenAI key without keeping the key itself."""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the upstream while it is considered degraded."""
+
+
+class TokenBucket:
+    """Allows `rate` calls per second on average, in bursts of up to `capacity`. Waiters sleep until a token is free."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive upstream failures and fails fast for `reset_timeout` seconds.
+
+    After that a single trial call is let through (half-open): its success closes the circuit again, its failure
+    keeps it open for another `reset_timeout`.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if self.trial else "open"
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if not self.trial and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.trial = True
+            return True
+        return False
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def failure(self):
+        self.failures += 1
+        if self.trial or self.failures >= self.threshold:
+            if self.opened_at is None or self.trial:
+                logger.warning(f"Opening the OpenAI circuit for {self.reset_timeout}s after {self.failures} failures")
+            self.opened_at = time.monotonic()
+            self.trial = False
+
+    def neutral(self):
+        """For outcomes that say nothing about the upstream's health, like a rate limit or a bad request."""
+        self.trial = False
+
+
+def backoff_delay(err: Exception, attempt: int, base: float, cap: float) -> float:
+    """Retry-After when the upstream sent one, capped exponential backoff with jitter otherwise."""
+    retry_after = (getattr(err, "headers", None) or {}).get("retry-after")
+    if retry_after:
+        try:
+            return min(cap, float(retry_after))
+        except ValueError:
+            pass
+    return min(cap, base * 2 ** attempt) * random.uniform(0.5, 1)
+
+
+class ResilientClient:
+    """Wraps single OpenAI calls with rate limiting, retries, a circuit breaker and optional hedging.
+
+    Rate limits are kept per API key, since that is what the upstream limits; circuits are kept per API base, since
+    that is what degrades. `fn` passed to `call` makes one request and is called again for retries and hedges.
+    """
+
+    def __init__(self):
+        # keyed by key_id, and bounded since every caller's key gets its own; an idle bucket is full again within
+        # capacity / rate seconds, so evicting it after that changes nothing
+        self.buckets = LocalLRU(config.openai_buckets_max_entries, ttl=3600)
+        self.breakers = {}
+
+    def bucket(self, key: str):
+        bucket_key = key_id(key or "")
+        bucket = self.buckets.get(bucket_key)
+        if bucket is None:
+            bucket = TokenBucket(config.openai_requests_per_minute / 60, max(1, config.openai_burst))
+        # set again on every use, so that a bucket in use does not expire and come back full
+        self.buckets.set(bucket_key, bucket)
+        return bucket
+
+    def breaker(self, api_base: str):
+        if api_base not in self.breakers:
+            self.breakers[api_base] = CircuitBreaker(config.openai_breaker_threshold, config.openai_breaker_reset)
+        return self.breakers[api_base]
+
+    async def call(self, key: str, api_base: str, fn, hedge: bool = True):
+        breaker = self.breaker(api_base)
+        hedge_after = config.openai_hedge_after if hedge else 0
+        for attempt in range(config.openai_max_retries + 1):
+            if not breaker.allow():
+                OPENAI_EVENTS.labels("circuit_open").inc()
+                raise CircuitOpenError(f"OpenAI circuit is open for {api_base}")
+            try:
+                result = await (self._hedged(key, fn, hedge_after) if hedge_after else self._attempt(key, fn))
+            except UPSTREAM_ERRORS as err:
+                breaker.failure()
+                error = err
+            except THROTTLE_ERRORS as err:
+                breaker.neutral()
+                error = err
+            except BaseException:
+                breaker.neutral()
+                raise
+            else:
+                breaker.success()
+                return result
+
+            if attempt == config.openai_max_retries:
+                raise error
+            delay = backoff_delay(error, attempt, config.openai_backoff_base, config.openai_backoff_max)
+            OPENAI_EVENTS.labels("retry").inc()
+            logger.warning(f"Retrying OpenAI call in {delay:.1f}s after {type(error).__name__}: {error}")
+            await asyncio.sleep(delay)
+
+    async def _attempt(self, key: str, fn):
+        if config.openai_requests_per_minute:
+            await self.bucket(key).acquire()
+        return await fn()
+
+    async def _hedged(self, key: str, fn, hedge_after: float):
+        """Sends a second request when the first is slower than `hedge_after` and returns whichever succeeds first."""
+        tasks = {asyncio.ensure_future(self._attempt(key, fn))}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done:
+                OPENAI_EVENTS.labels("hedge").inc()
+                tasks.add(asyncio.ensure_future(self._attempt(key, fn)))
+            error = None
+            pending = tasks
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+openai_client = ResilientClient()
@@ -0,0 +1,46 @@
+from functools import lru_cache
+
+from ricotta.config import config
+from ricotta.core.logger import logging
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as err:
+        # tiktoken downloads its vocabularies on first use, which is not possible everywhere
+        logger.warning(f"Couldn't load a tokenizer for {model}, estimating token counts instead: {err}")
+        return None
+
+
+def count_tokens(text: str, model: str = None) -> int:
+    """Counts tokens with tiktoken when the `tokens` extra is installed, and estimates four characters per token
+    otherwise."""
+    encoding = _encoding(model or config.openai_model) if tiktoken is not None else None
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text))
+
+
+def fit_to_budget(words, budget: int, model: str = None):
+    """Takes words in the given order until the comma-separated list would exceed `budget` tokens."""
+    selected = []
+    used = 0
+    for word in words:
+        # one more token for the separator
+        cost = count_tokens(word, model) + 1
+        if used + cost > budget:
+            break
+        selected.append(word)
+        used += cost
+    return selected
@@ -0,0 +1,39 @@
+import time
+
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+
+from ricotta.config import config
+from ricotta.core.logger import logging
+
+logger = logging.getLogger(__name__)
+
+# After a failed call Redis is skipped for this long so a missing server does not add a timeout to every request.
+RETRY_AFTER_SECONDS = 30
+
+_client = None
+_unavailable_until = 0.0
+
+
+def get_redis():
+    """Returns the shared Redis client, or None when Redis is disabled or recently failed."""
+    global _client
+    if not config.redis_url or time.monotonic() < _unavailable_until:
+        return None
+    if _client is None:
+        _client = redis.from_url(config.redis_url, socket_connect_timeout=0.5, socket_timeout=0.5)
+    return _client
+
+
+def mark_unavailable(err: RedisError):
+    global _unavailable_until
+    if time.monotonic() >= _unavailable_until:
+        logger.warning(f"Redis unavailable, using in-process fallback for {RETRY_AFTER_SECONDS}s: {err}")
+    _unavailable_until = time.monotonic() + RETRY_AFTER_SECONDS
+
+
+async def close_redis():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+    _client = None
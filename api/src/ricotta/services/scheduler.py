@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from ricotta.models.card import Card, UserCardInteraction
+
+MIN_EASE = 1.3
+DEFAULT_EASE = 2.5
+# A missed card comes back within the same session rather than the next day
+RELEARN_DELAY = timedelta(minutes=10)
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def schedule(interaction: UserCardInteraction, correct: bool, now: datetime = None):
+    """Updates the interval, ease and due date of an interaction after an answer using SM-2.
+
+    Answers are binary, so a correct answer is graded as quality 4 and an incorrect one as quality 1.
+    """
+    now = now or utcnow()
+    quality = 4 if correct else 1
+    ease = interaction.ease if interaction.ease is not None else DEFAULT_EASE
+    interval = interaction.interval_days or 0
+    repetitions = interaction.repetitions or 0
+
+    if correct:
+        repetitions += 1
+        if repetitions == 1:
+            interval = 1
+        elif repetitions == 2:
+            interval = 6
+        else:
+            interval = round(interval * ease, 2)
+        interaction.due_at = now + timedelta(days=interval)
+    else:
+        repetitions = 0
+        interval = 0
+        interaction.due_at = now + RELEARN_DELAY
+
+    interaction.ease = max(MIN_EASE, ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    interaction.interval_days = interval
+    interaction.repetitions = repetitions
+    return interaction
+
+
+def backfill_schedule(db: Session):
+    """Makes interactions created before scheduling existed due now and copies their card language."""
+    db.execute(
+        update(UserCardInteraction)
+        .where(UserCardInteraction.language.is_(None))
+        .values(language=select(Card.language).where(Card.id == UserCardInteraction.card_id).scalar_subquery())
+    )
+    db.execute(
+        update(UserCardInteraction)
+        .where(UserCardInteraction.due_at.is_(None))
+        .values(due_at=utcnow())
+    )
+    db.commit()
@@ -0,0 +1,268 @@
+import hashlib
+import re
+import struct
+import threading
+import unicodedata
+import zlib
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
+from itertools import chain
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from ricotta.config import config
+from ricotta.core.logger import logging
+from ricotta.models.card import Card
+
+logger = logging.getLogger(__name__)
+
+# Signatures are stored on the cards, so changing the shingles or the hashing means clearing Card.sentence_minhash.
+# With 8 bands of 4 rows, sentences with a Jaccard similarity of 0.7 share a band 89% of the time, 0.8 99% of the time,
+# and unrelated sentences (0.05) almost never.
+SHINGLE_SIZE = 4
+NUM_PERM = 32
+BANDS = 8
+ROWS = NUM_PERM // BANDS
+
+# recent additions are kept in dicts and merged into the sorted arrays once there are this many
+MERGE_AT = 20000
+# a bucket shared by more cards than this is a sign of a degenerate sentence, not worth comparing against in full
+MAX_CANDIDATES = 64
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_SIGNATURE = struct.Struct(f"<{NUM_PERM}I")
+_BAND_SIZE = ROWS * 4
+
+
+def normalize_sentence(sentence: str) -> str:
+    return " ".join(_PUNCTUATION.sub(" ", str(sentence).casefold()).split())
+
+
+def shingles(sentence: str):
+    text = normalize_sentence(sentence)
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def fold(text: str) -> str:
+    """The normalized text without accents either, so that "Caffè!" and "caffe" are the same word."""
+    decomposed = unicodedata.normalize("NFKD", normalize_sentence(text))
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def uses_word(folded_word: str, folded_sentence: str) -> bool:
+    """Whether the folded sentence contains the folded word (or expression) as whole words."""
+    return bool(folded_word) and f" {folded_word} " in f" {folded_sentence} "
+
+
+def duplicates(word: str, folded_sentence: str, other_word: str) -> bool:
+    """Whether a card for `word` with the sentence duplicates a card for `other_word` with a similar one: it is for the
+    same word, or its sentence still uses the other card's word, so the learner would read the same sentence twice.
+    A similar sentence without it, like "caffè" swapped for "tè", is a new card."""
+    return word == other_word or uses_word(other_word, folded_sentence)
+
+
+def similarity(sentence: str, other: str) -> float:
+    """Jaccard similarity of the shingles of two sentences."""
+    a, b = shingles(sentence), shingles(other)
+    return len(a & b) / len(a | b)
+
+
+@lru_cache(maxsize=4096)
+def minhash(sentence: str) -> bytes:
+    """MinHash signature of the sentence's character shingles, as NUM_PERM packed 32-bit minima.
+
+    One 128 byte shake_128 digest per shingle provides all 32 hash functions, so the work stays in C. Cached, since a
+    generated sentence is signed when it is checked and again when it is stored.
+    """
+    digests = [_SIGNATURE.unpack(hashlib.shake_128(shingle.encode()).digest(_SIGNATURE.size))
+               for shingle in shingles(sentence)]
+    return _SIGNATURE.pack(*map(min, zip(*digests)))
+
+
+def band_keys(signature: bytes):
+    return [zlib.crc32(signature[band * _BAND_SIZE:(band + 1) * _BAND_SIZE]) for band in range(BANDS)]
+
+
+class _Band:
+    """LSH buckets of one band, as a sorted array of `key << 32 | position` plus a dict of recent additions.
+
+    The array takes 8 bytes per card where a dict entry would take about a hundred, which matters at a million cards.
+    Keys are 32-bit, so unrelated buckets may meet; candidates are checked against the sentence anyway.
+    """
+
+    def __init__(self):
+        self.entries = array('Q')
+        self.tail = array('Q')
+        self.recent = {}
+
+    def append(self, key: int, position: int):
+        """Queues an entry until the next `merge` or `settle`."""
+        self.tail.append(key << 32 | position)
+
+    def settle(self):
+        """Moves the queued entries to the dict, for a handful of new cards that are not worth a merge."""
+        for entry in self.tail:
+            self.recent.setdefault(entry >> 32, []).append(entry & 0xFFFFFFFF)
+        self.tail = array('Q')
+
+    def merge(self):
+        """Sorts the queued and recent entries into the array, in one pass rather than one insert at a time."""
+        recent = (key << 32 | position for key, positions in self.recent.items() for position in positions)
+        self.entries = array('Q', sorted(chain(self.entries, self.tail, recent)))
+        self.tail = array('Q')
+        self.recent = {}
+
+    def candidates(self, key: int):
+        found = list(self.recent.get(key, ()))
+        index = bisect_left(self.entries, key << 32)
+        while index < len(self.entries) and self.entries[index] >> 32 == key and len(found) < MAX_CANDIDATES:
+            found.append(self.entries[index] & 0xFFFFFFFF)
+            index += 1
+        return found
+
+
+class _LanguageSentences:
+    def __init__(self):
+        self.ids = array('q')
+        # folded, see `fold`
+        self.words = []
+        self.sentences = []
+        self.bands = [_Band() for _ in range(BANDS)]
+        self.pending = 0
+        self.max_id = 0
+        # ids indexed by `add` above max_id, which the next refresh skips
+        self.added = set()
+
+
+class SentenceIndex:
+    """Finds cards whose sentence a generated one rewords, like a changed article or a word swapped for a synonym.
+
+    Sentences are compared by MinHash over normalized character shingles, with LSH banding to only look at cards that
+    share a band. Those whose shingles reach a Jaccard similarity of NEAR_DUPLICATE_THRESHOLD, computed from the
+    sentences kept in memory rather than estimated, are near duplicates when the generated sentence still uses the
+    stored card's word, or is for that same word once case, punctuation and accents are dropped (see `duplicates`).
+    The word index has already dropped words that are known exactly, so most of what is caught here is the model
+    asking about another word of a sentence it already wrote. Like the word index, each refresh only loads cards with
+    ids above the highest one seen, and reads the signatures stored on them rather than computing them again.
+    """
+
+    def __init__(self):
+        self.languages = {}
+        self.lock = threading.Lock()
+
+    def refresh(self, db: Session, language: str):
+        with self.lock:
+            entry = self.languages.setdefault(language, _LanguageSentences())
+            query = db.query(Card.id, Card.word, Card.sentenceLANG, Card.sentence_minhash)\
+                .filter(Card.language == language, Card.id > entry.max_id)\
+                .order_by(Card.id)\
+                .yield_per(10000)
+
+            def rows():
+                for row in query:
+                    entry.max_id = row.id
+                    if row.id not in entry.added:
+                        yield row.id, row.word, row.sentenceLANG, row.sentence_minhash or minhash(row.sentenceLANG)
+
+            self._load(entry, rows())
+            entry.added = {card_id for card_id in entry.added if card_id > entry.max_id}
+
+    def add(self, language: str, cards: list):
+        """Indexes freshly saved cards without waiting for the next refresh, once the language has been loaded."""
+        with self.lock:
+            entry = self.languages.get(language)
+            if entry is None:
+                return
+            rows = [(card["id"], card["word"], card["sentenceLANG"], minhash(card["sentenceLANG"])) for card in cards
+                    if card["id"] > entry.max_id and card["id"] not in entry.added]
+            entry.added.update(card_id for card_id, _, _, _ in rows)
+            self._load(entry, rows)
+
+    @staticmethod
+    def _load(entry: _LanguageSentences, rows):
+        """Indexes (card id, word, sentence, signature) rows."""
+        count = 0
+        for card_id, word, sentence, signature in rows:
+            position = len(entry.ids)
+            entry.ids.append(card_id)
+            entry.words.append(fold(word))
+            entry.sentences.append(sentence)
+            for band, key in zip(entry.bands, band_keys(signature)):
+                band.append(key, position)
+            count += 1
+        entry.pending += count
+        for band in entry.bands:
+            if entry.pending >= MERGE_AT:
+                band.merge()
+            else:
+                band.settle()
+        if entry.pending >= MERGE_AT:
+            entry.pending = 0
+
+    def near_duplicate(self, language: str, word: str, sentence: str):
+        """Returns the id of a card that a card for `word` with `sentence` would duplicate, or None."""
+        entry = self.languages.get(language)
+        if entry is None:
+            return None
+        word, folded = fold(word), fold(sentence)
+        signature = minhash(sentence)
+        with self.lock:
+            seen = set()
+            for band, key in zip(entry.bands, band_keys(signature)):
+                for position in band.candidates(key):
+                    if position in seen:
+                        continue
+                    seen.add(position)
+                    if not duplicates(word, folded, entry.words[position]):
+                        continue
+                    if similarity(sentence, entry.sentences[position]) >= config.near_duplicate_threshold:
+                        return entry.ids[position]
+        return None
+
+    def unknown(self, language: str, words: list):
+        """Drops the generated words that duplicate a known card, or an earlier word in `words`. Malformed ones are kept
+        for the card store to report."""
+        fresh, sentences = [], []
+        for word in words:
+            if isinstance(word, dict) and isinstance(word.get("word"), str) and isinstance(word.get("sentenceLANG"), str):
+                sentence = word["sentenceLANG"]
+                card_id = self.near_duplicate(language, word["word"], sentence)
+                if card_id is not None:
+                    logger.info(f"Dropped a near duplicate of card {card_id}: {sentence!r}")
+                    continue
+                folded_word, folded = fold(word["word"]), fold(sentence)
+                if any(duplicates(folded_word, folded, other_word) and similarity(sentence, other) >= config.near_duplicate_threshold
+                       for other_word, other in sentences):
+                    continue
+                sentences.append((folded_word, sentence))
+            fresh.append(word)
+        return fresh
+
+    def reset(self):
+        with self.lock:
+            self.languages = {}
+
+
+def backfill_minhash(db: Session, chunk_size: int = 5000):
+    """Stores the sentence signature of cards created before signatures were, or imported, so that refreshes only
+    read them."""
+    total = 0
+    while True:
+        rows = db.query(Card.id, Card.sentenceLANG)\
+            .filter(Card.sentence_minhash.is_(None))\
+            .limit(chunk_size)\
+            .all()
+        if not rows:
+            break
+        db.execute(update(Card), [{"id": row.id, "sentence_minhash": minhash(row.sentenceLANG)} for row in rows])
+        db.commit()
+        total += len(rows)
+    if total:
+        logger.info(f"Stored the sentence signature of {total} cards")
+
+
+sentence_index = SentenceIndex()
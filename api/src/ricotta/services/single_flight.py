@@ -0,0 +1,80 @@
+import asyncio
+
+from redis.exceptions import LockError, RedisError
+
+from ricotta.config import config
+from ricotta.core.logger import logging
+from ricotta.core.metrics import GENERATION_FLIGHT
+from ricotta.services.redis_client import get_redis, mark_unavailable
+
+logger = logging.getLogger(__name__)
+
+LOCK_PREFIX = "ricotta:single-flight:"
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time; concurrent callers with the same key share its result.
+
+    Within a worker the first caller (the leader) starts the call as a task and later callers await that same task.
+    With `distributed` enabled the leader also holds a Redis lock on the key, so leaders in other workers wait for it
+    and can pick up whatever the first one stored (e.g. in a cache) before doing the work themselves.
+    """
+
+    def __init__(self, distributed=False, lock_timeout=60, counter=None):
+        self.distributed = distributed
+        self.lock_timeout = lock_timeout
+        # a Counter with a "role" label, counting leaders and coalesced callers
+        self.counter = counter
+        self.calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn):
+        task = self.calls.get(key)
+        if task is None:
+            self.leaders += 1
+            self._count("leader")
+            task = asyncio.create_task(self._run_leader(key, fn))
+            self.calls[key] = task
+            task.add_done_callback(lambda _: self.calls.pop(key, None))
+        else:
+            self.coalesced += 1
+            self._count("coalesced")
+        # shielded so one waiter disconnecting does not cancel the call for everyone else
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {"leaders": self.leaders, "coalesced": self.coalesced, "in_flight": len(self.calls)}
+
+    def _count(self, role: str):
+        if self.counter is not None:
+            self.counter.labels(role).inc()
+
+    async def _run_leader(self, key, fn):
+        client = get_redis() if self.distributed else None
+        if client is None:
+            return await fn()
+
+        lock = client.lock(LOCK_PREFIX + key, timeout=self.lock_timeout, blocking_timeout=self.lock_timeout)
+        try:
+            acquired = await lock.acquire()
+        except RedisError as err:
+            mark_unavailable(err)
+            acquired = False
+        if not acquired:
+            logger.warning(f"Running without the distributed lock for {key}")
+        try:
+            return await fn()
+        finally:
+            if acquired:
+                try:
+                    await lock.release()
+                except (LockError, RedisError) as err:
+                    logger.warning(f"Could not release lock for {key}: {err}")
+
+
+generation_flight = SingleFlight(
+    distributed=config.generation_lock_enabled,
+    lock_timeout=config.openai_timeout + 20,
+    counter=GENERATION_FLIGHT,
+)
@@ -0,0 +1,136 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, literal, select
+from sqlalchemy.orm import Session
+
+from ricotta.models.card import UserCardInteraction
+from ricotta.models.user import UserLanguageStats
+from ricotta.services.database import upsert_insert
+from ricotta.services.scheduler import utcnow
+
+
+def _advance_streak(streak_days: int, last_activity_at: datetime, answered_at: datetime):
+    """Returns the day streak and last activity after an answer at `answered_at`."""
+    if last_activity_at is None:
+        return 1, answered_at
+    days = (answered_at.date() - last_activity_at.date()).days
+    if days < 0:
+        # answered offline before the last recorded activity, the streak already counts that day or has moved on
+        return streak_days, last_activity_at
+    if days == 0:
+        return max(streak_days, 1), max(answered_at, last_activity_at)
+    if days == 1:
+        return streak_days + 1, answered_at
+    return 1, answered_at
+
+
+def update_stats(db: Session, user_id: int, answers: list, new_cards: dict):
+    """Adds a batch of answers to the user's aggregates, without committing.
+
+    `answers` are (language, answered_at, correct) tuples in the order they were answered and `new_cards` counts the
+    cards answered for the first time, by language. Counters are added to the stored ones in the upsert itself, so
+    concurrent batches do not lose updates; the streak is computed from the stored one.
+    """
+    if not answers:
+        return
+    languages = {language for language, _, _ in answers}
+    stored = {
+        row.language: row
+        for row in db.query(UserLanguageStats.language, UserLanguageStats.streak_days, UserLanguageStats.last_activity_at)
+        .filter(and_(UserLanguageStats.user_id == user_id, UserLanguageStats.language.in_(languages)))
+    }
+
+    rows = {}
+    for language, answered_at, correct in answers:
+        row = rows.get(language)
+        if row is None:
+            previous = stored.get(language)
+            row = rows[language] = {
+                'user_id': user_id,
+                'language': language,
+                'cards_seen': new_cards.get(language, 0),
+                'answers': 0,
+                'correct': 0,
+                'streak_days': previous.streak_days if previous else 0,
+                'last_activity_at': previous.last_activity_at if previous else None,
+            }
+        row['answers'] += 1
+        row['correct'] += 1 if correct else 0
+        row['streak_days'], row['last_activity_at'] = _advance_streak(row['streak_days'], row['last_activity_at'], answered_at)
+
+    insert = upsert_insert(db.get_bind())
+    table = UserLanguageStats.__table__
+    stmt = insert(table).values(list(rows.values()))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.language],
+        set_={
+            'cards_seen': table.c.cards_seen + stmt.excluded.cards_seen,
+            'answers': table.c.answers + stmt.excluded.answers,
+            'correct': table.c.correct + stmt.excluded.correct,
+            'streak_days': stmt.excluded.streak_days,
+            'last_activity_at': stmt.excluded.last_activity_at,
+        },
+    )
+    db.execute(stmt)
+
+
+def refresh_stats(db: Session, user_ids=None):
+    """Recounts the aggregates of the given users, or of everyone, from their interactions, without committing.
+
+    For interactions written without going through `record_answers`, like imports. Streaks and last activity are not
+    recorded on interactions, so they are left as they are.
+    """
+    table = UserLanguageStats.__table__
+    query = select(
+        UserCardInteraction.user_id,
+        UserCardInteraction.language,
+        func.count(UserCardInteraction.id),
+        func.coalesce(func.sum(UserCardInteraction.times_seen), 0),
+        func.coalesce(func.sum(UserCardInteraction.times_correct), 0),
+        literal(0),
+    ).where(UserCardInteraction.language.isnot(None))
+    if user_ids is not None:
+        query = query.where(UserCardInteraction.user_id.in_(list(user_ids)))
+    query = query.group_by(UserCardInteraction.user_id, UserCardInteraction.language)
+
+    insert = upsert_insert(db.get_bind())
+    stmt = insert(table).from_select(['user_id', 'language', 'cards_seen', 'answers', 'correct', 'streak_days'], query)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.language],
+        set_={
+            'cards_seen': stmt.excluded.cards_seen,
+            'answers': stmt.excluded.answers,
+            'correct': stmt.excluded.correct,
+        },
+    )
+    db.execute(stmt)
+
+
+def backfill_stats(db: Session):
+    """Builds the aggregates once for interactions recorded before they existed."""
+    if db.query(UserLanguageStats.id).first() is None and db.query(UserCardInteraction.id).first() is not None:
+        refresh_stats(db)
+    db.commit()
+
+
+def get_stats(db: Session, user_id: int, language: str = None):
+    query = db.query(UserLanguageStats).filter(UserLanguageStats.user_id == user_id)
+    if language:
+        query = query.filter(UserLanguageStats.language == language)
+    return query.order_by(UserLanguageStats.language).all()
+
+
+def stats_payload(stats: UserLanguageStats, now: datetime = None):
+    today = (now or utcnow()).date()
+    last_activity_at = stats.last_activity_at
+    # a streak is only current while its last day is today or yesterday
+    streak_days = stats.streak_days if last_activity_at and last_activity_at.date() >= today - timedelta(days=1) else 0
+    return {
+        "language": stats.language,
+        "cards_seen": stats.cards_seen,
+        "answers": stats.answers,
+        "correct": stats.correct,
+        "accuracy": round(stats.correct / stats.answers, 4) if stats.answers else None,
+        "streak_days": streak_days,
+        "last_activity_at": last_activity_at.isoformat() if last_activity_at else None,
+    }
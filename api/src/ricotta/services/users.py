@@ -0,0 +1,35 @@
+from sqlalchemy.orm import Session
+
+from ricotta.config import config
+from ricotta.core.metrics import observe_cache
+from ricotta.models.user import User
+from ricotta.services.lru import LocalLRU
+
+
+class UserResolver:
+    """Maps usernames to user ids through a short-lived in-process cache, so that answers skip the user lookup.
+
+    Users are never renamed or deleted, so the TTL only bounds how long a worker holds on to idle users. Unknown
+    usernames are not cached, since the user may be created a moment later on another worker.
+    """
+
+    def __init__(self, ttl=None, max_entries=None):
+        self.local = LocalLRU(max_entries or config.user_cache_max_entries, ttl or config.user_cache_ttl)
+
+    def resolve(self, db: Session, username: str):
+        """Returns the id of the user, or None if there is no such user."""
+        user_id = self.local.get(username)
+        if user_id is not None:
+            observe_cache("user", 1, 0)
+            return user_id
+        observe_cache("user", 0, 1)
+        user_id = db.query(User.id).filter(User.username == username).scalar()
+        if user_id is not None:
+            self.local.set(username, user_id)
+        return user_id
+
+    def remember(self, username: str, user_id: int):
+        self.local.set(username, user_id)
+
+
+user_resolver = UserResolver()
@@ -0,0 +1,115 @@
+import math
+import threading
+from collections import Counter
+
+from sqlalchemy.orm import Session
+
+from ricotta.models.card import Card
+
+
+def normalize_word(word: str) -> str:
+    return " ".join(str(word).casefold().split())
+
+
+def trigrams(text: str):
+    grams = set()
+    for token in text.casefold().split():
+        padded = f" {token} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class _LanguageWords:
+    def __init__(self):
+        self.words = []
+        self.sizes = []
+        self.positions = {}
+        self.postings = {}
+        self.max_id = 0
+
+
+class WordIndex:
+    """Keeps the known words of each language in memory, for the exclusion list of prompts and for dropping duplicates.
+
+    Words are indexed by the character trigrams of the word and its English translation, so the ones closest to a
+    subject can be ranked without touching the database. Like the card id pool, each refresh only loads cards with
+    ids above the highest one seen.
+    """
+
+    def __init__(self):
+        self.languages = {}
+        self.lock = threading.Lock()
+
+    def refresh(self, db: Session, language: str):
+        with self.lock:
+            entry = self.languages.setdefault(language, _LanguageWords())
+            rows = db.query(Card.id, Card.word, Card.english)\
+                .filter(Card.language == language, Card.id > entry.max_id)\
+                .order_by(Card.id)\
+                .all()
+            for row in rows:
+                self._add(entry, row.word, row.english)
+            if rows:
+                entry.max_id = rows[-1].id
+
+    def add(self, language: str, cards: list):
+        """Indexes freshly saved cards without waiting for the next refresh."""
+        with self.lock:
+            entry = self.languages.setdefault(language, _LanguageWords())
+            for card in cards:
+                self._add(entry, card["word"], card["english"])
+
+    @staticmethod
+    def _add(entry: _LanguageWords, word: str, english: str):
+        key = normalize_word(word)
+        if not key or key in entry.positions:
+            return
+        position = len(entry.words)
+        grams = trigrams(f"{word} {english or ''}")
+        entry.words.append(word)
+        entry.sizes.append(len(grams) or 1)
+        entry.positions[key] = position
+        for gram in grams:
+            entry.postings.setdefault(gram, []).append(position)
+
+    def is_known(self, language: str, word: str) -> bool:
+        entry = self.languages.get(language)
+        return entry is not None and normalize_word(word) in entry.positions
+
+    def unknown(self, language: str, words: list):
+        """Drops the generated words that are already known, or repeated within `words`. Malformed ones are kept for
+        the card store to report."""
+        fresh, seen = [], set()
+        for word in words:
+            if isinstance(word, dict) and isinstance(word.get("word"), str):
+                key = normalize_word(word["word"])
+                if key in seen or self.is_known(language, key):
+                    continue
+                seen.add(key)
+            fresh.append(word)
+        return fresh
+
+    def ranked(self, language: str, subject: str):
+        """Yields the known words most similar to the subject first, then the remaining ones newest first."""
+        entry = self.languages.get(language)
+        if entry is None:
+            return
+        with self.lock:
+            scores = Counter()
+            for gram in trigrams(subject):
+                scores.update(entry.postings.get(gram, ()))
+            ranked = sorted(scores, key=lambda position: scores[position] / math.sqrt(entry.sizes[position]),
+                            reverse=True)
+            count = len(entry.words)
+        for position in ranked:
+            yield entry.words[position]
+        for position in range(count - 1, -1, -1):
+            if position not in scores:
+                yield entry.words[position]
+
+    def reset(self):
+        with self.lock:
+            self.languages = {}
+
+
+word_index = WordIndex()
@@ -0,0 +1,315 @@
+"""Exports and imports the decks and study progress, a chunk at a time, to migrate or back up large databases.
+
+    ricotta export backup.jsonl.gz
+    ricotta import backup.jsonl.gz
+    ricotta export backup/ --format parquet --chunk-size 50000
+
+`ricotta` is installed with the package; `python -m ricotta.transfer` works the same.
+
+An export holds users, cards with their incorrect options, and user card interactions. Rows are read through a
+streaming cursor (`yield_per`, server side on Postgres) and written as they arrive, so memory stays flat whatever the
+size of the database. JSONL goes to one file, gzipped when the name ends in `.gz`, with one object per row and a `type`
+key. Parquet (`poetry install --extras parquet`) goes to a directory with one file per type.
+
+Rows refer to each other by natural keys, usernames and card sentences, rather than ids, so an export can be imported
+into a database that already has data. Cards and users that exist are kept, interactions are overwritten. Every chunk
+is committed on its own; an interrupted import can simply be run again.
+"""
+import argparse
+import gzip
+import json
+import os
+import time
+from datetime import datetime
+from itertools import groupby
+
+from sqlalchemy import select
+
+from ricotta.core.logger import logging, stop_logging
+from ricotta.models.card import Card, IncorrectOption, UserCardInteraction
+from ricotta.models.user import User
+from ricotta.prepare import prepare_database
+from ricotta.services.database import engine, SessionLocal, upsert_insert
+from ricotta.services.stats import refresh_stats
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # optional, `poetry install --extras parquet`
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+# in import order: interactions refer to users and cards
+KINDS = ("user", "card", "interaction")
+CARD_COLUMNS = ("word", "language", "english", "sentenceLANG", "sentenceEN")
+INTERACTION_COLUMNS = ("times_seen", "times_correct", "language", "due_at", "interval_days", "ease", "repetitions")
+
+
+def _streamed(conn, stmt, chunk_size: int):
+    return conn.execution_options(yield_per=chunk_size).execute(stmt)
+
+
+def export_users(conn, chunk_size: int):
+    result = _streamed(conn, select(User.username).order_by(User.id), chunk_size)
+    for rows in result.partitions():
+        yield [{"username": row.username} for row in rows]
+
+
+def export_cards(conn, chunk_size: int):
+    stmt = select(Card.id, *(getattr(Card, column) for column in CARD_COLUMNS), IncorrectOption.option)\
+        .outerjoin(IncorrectOption, IncorrectOption.card_id == Card.id)\
+        .order_by(Card.id, IncorrectOption.id)
+    chunk = []
+    # one row per option, consecutive for a card thanks to the ordering
+    for _, rows in groupby(_streamed(conn, stmt, chunk_size), key=lambda row: row.id):
+        rows = list(rows)
+        chunk.append({
+            **{column: getattr(rows[0], column) for column in CARD_COLUMNS},
+            "incorrect_options": [row.option for row in rows if row.option is not None],
+        })
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def export_interactions(conn, chunk_size: int):
+    stmt = select(User.username, Card.sentenceLANG, *(getattr(UserCardInteraction, column) for column in INTERACTION_COLUMNS))\
+        .join(User, User.id == UserCardInteraction.user_id)\
+        .join(Card, Card.id == UserCardInteraction.card_id)\
+        .order_by(UserCardInteraction.id)
+    for rows in _streamed(conn, stmt, chunk_size).partitions():
+        yield [dict(row._mapping) for row in rows]
+
+
+EXPORTS = {"user": export_users, "card": export_cards, "interaction": export_interactions}
+
+
+def import_users(db, rows: list):
+    insert = upsert_insert(db.get_bind())
+    table = User.__table__
+    stmt = insert(table).on_conflict_do_nothing(index_elements=[table.c.username]).returning(table.c.id)
+    inserted = db.execute(stmt, [{"username": row["username"]} for row in rows]).all()
+    return {"users": len(inserted), "existing_users": len(rows) - len(inserted)}
+
+
+def import_cards(db, rows: list):
+    """Inserts the cards whose sentence is not stored yet, and the incorrect options of those only."""
+    cards = {row["sentenceLANG"]: row for row in rows}
+    insert = upsert_insert(db.get_bind())
+    table = Card.__table__
+    stmt = insert(table)\
+        .on_conflict_do_nothing(index_elements=[table.c.sentenceLANG])\
+        .returning(table.c.id, table.c.sentenceLANG)
+    inserted = db.execute(stmt, [{column: card[column] for column in CARD_COLUMNS} for card in cards.values()]).all()
+
+    option_rows = [
+        {"card_id": card_id, "option": option}
+        for card_id, sentence in inserted
+        for option in cards[sentence]["incorrect_options"]
+    ]
+    if option_rows:
+        db.execute(insert(IncorrectOption.__table__), option_rows)
+    return {"cards": len(inserted), "existing_cards": len(cards) - len(inserted)}
+
+
+def import_interactions(db, rows: list):
+    """Upserts interactions on (user, card). Those whose user or card is missing are skipped."""
+    user_ids = dict(db.execute(select(User.username, User.id)
+                               .where(User.username.in_({row["username"] for row in rows}))).all())
+    cards = {card.sentenceLANG: card for card in db.execute(select(Card.sentenceLANG, Card.id, Card.language)
+                                                            .where(Card.sentenceLANG.in_({row["sentenceLANG"] for row in rows})))}
+    values = {}
+    for row in rows:
+        user_id, card = user_ids.get(row["username"]), cards.get(row["sentenceLANG"])
+        if user_id is None or card is None:
+            continue
+        due_at = row.get("due_at")
+        if isinstance(due_at, str):
+            due_at = datetime.fromisoformat(due_at)
+        # keyed on the conflict target, since one statement can't update the same row twice
+        values[(user_id, card.id)] = {
+            "user_id": user_id,
+            "card_id": card.id,
+            **{column: row.get(column) for column in INTERACTION_COLUMNS},
+            # exports of databases that were never prepared lack the copied card language
+            "language": row.get("language") or card.language,
+            "due_at": due_at,
+        }
+    if values:
+        insert = upsert_insert(db.get_bind())
+        table = UserCardInteraction.__table__
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.card_id],
+            set_={column: stmt.excluded[column] for column in INTERACTION_COLUMNS},
+        )
+        db.execute(stmt, list(values.values()))
+    return {"interactions": len(values), "skipped_interactions": len(rows) - len(values)}
+
+
+IMPORTS = {"user": import_users, "card": import_cards, "interaction": import_interactions}
+
+
+class JSONLinesWriter:
+    def __init__(self, path: str):
+        self.file = gzip.open(path, "wt") if path.endswith(".gz") else open(path, "w")
+
+    def write(self, kind: str, rows: list):
+        self.file.writelines(json.dumps({"type": kind, **row}, default=datetime.isoformat) + "\n" for row in rows)
+
+    def close(self):
+        self.file.close()
+
+
+class JSONLinesReader:
+    def __init__(self, path: str):
+        self.path = path
+
+    def chunks(self, chunk_size: int):
+        """Yields (kind, rows) with up to `chunk_size` consecutive rows of the same kind."""
+        kind, chunk = None, []
+        with gzip.open(self.path, "rt") if self.path.endswith(".gz") else open(self.path) as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                row_kind = row.pop("type")
+                if chunk and (row_kind != kind or len(chunk) >= chunk_size):
+                    yield kind, chunk
+                    chunk = []
+                kind = row_kind
+                chunk.append(row)
+        if chunk:
+            yield kind, chunk
+
+
+def _parquet_schemas():
+    return {
+        "user": pyarrow.schema([("username", pyarrow.string())]),
+        "card": pyarrow.schema([
+            *((column, pyarrow.string()) for column in CARD_COLUMNS),
+            ("incorrect_options", pyarrow.list_(pyarrow.string())),
+        ]),
+        "interaction": pyarrow.schema([
+            ("username", pyarrow.string()),
+            ("sentenceLANG", pyarrow.string()),
+            ("times_seen", pyarrow.int64()),
+            ("times_correct", pyarrow.int64()),
+            ("language", pyarrow.string()),
+            ("due_at", pyarrow.timestamp("us")),
+            ("interval_days", pyarrow.float64()),
+            ("ease", pyarrow.float64()),
+            ("repetitions", pyarrow.int64()),
+        ]),
+    }
+
+
+def _require_pyarrow():
+    if pyarrow is None:
+        raise SystemExit("Parquet needs pyarrow, install it with `poetry install --extras parquet`")
+
+
+class ParquetWriter:
+    """Writes each kind to `<directory>/<kind>.parquet`, one row group per chunk."""
+
+    def __init__(self, directory: str):
+        _require_pyarrow()
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.schemas = _parquet_schemas()
+        self.writers = {}
+
+    def write(self, kind: str, rows: list):
+        if kind not in self.writers:
+            self.writers[kind] = pyarrow.parquet.ParquetWriter(
+                os.path.join(self.directory, f"{kind}.parquet"), self.schemas[kind])
+        self.writers[kind].write_table(pyarrow.Table.from_pylist(rows, schema=self.schemas[kind]))
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+
+class ParquetReader:
+    def __init__(self, directory: str):
+        _require_pyarrow()
+        self.directory = directory
+
+    def chunks(self, chunk_size: int):
+        for kind in KINDS:
+            path = os.path.join(self.directory, f"{kind}.parquet")
+            if not os.path.exists(path):
+                continue
+            for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=chunk_size):
+                yield kind, batch.to_pylist()
+
+
+FORMATS = {"jsonl": (JSONLinesWriter, JSONLinesReader), "parquet": (ParquetWriter, ParquetReader)}
+
+
+def export_database(path: str, format: str = "jsonl", chunk_size: int = 10000):
+    summary = {kind: 0 for kind in KINDS}
+    writer = FORMATS[format][0](path)
+    try:
+        with engine.connect() as conn:
+            for kind in KINDS:
+                for rows in EXPORTS[kind](conn, chunk_size):
+                    writer.write(kind, rows)
+                    summary[kind] += len(rows)
+                logger.info(f"Exported {summary[kind]} {kind} rows")
+    finally:
+        writer.close()
+    return summary
+
+
+def import_database(path: str, format: str = "jsonl", chunk_size: int = 10000):
+    summary = {}
+    reader = FORMATS[format][1](path)
+    with SessionLocal() as db:
+        for kind, rows in reader.chunks(chunk_size):
+            if kind not in IMPORTS:
+                logger.warning(f"Skipping {len(rows)} rows of unknown type {kind}")
+                continue
+            try:
+                counts = IMPORTS[kind](db, rows)
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            for key, count in counts.items():
+                summary[key] = summary.get(key, 0) + count
+            logger.debug(f"Imported {len(rows)} {kind} rows")
+        if summary.get("interactions"):
+            # interactions were written directly, so progress aggregates are recounted from them in one pass
+            refresh_stats(db)
+            db.commit()
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", help="JSONL file, or directory for Parquet")
+    parser.add_argument("--format", choices=list(FORMATS), default="jsonl")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="rows read, written and committed at a time")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        if args.command == "export":
+            summary = export_database(args.path, args.format, args.chunk_size)
+        else:
+            prepare_database()
+            summary = import_database(args.path, args.format, args.chunk_size)
+    finally:
+        engine.dispose()
+        stop_logging()
+    summary["seconds"] = round(time.perf_counter() - start, 1)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Runs the generation jobs queued with POST /card/generate?background=true.
+
+    python -m ricotta.worker --processes 4 --concurrency 8
+
+Needs JOB_QUEUE_BACKEND=redis. Each process runs `--concurrency` consumers on one event loop, and TERM/INT lets the
+jobs in progress finish before exiting. Jobs made with the caller's OpenAI key are not queued in Redis and are run by the
+API process that took them instead.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import signal
+
+from ricotta.config import config
+from ricotta.core.logger import logging, stop_logging
+from ricotta.services.chat_extractor import close_session
+from ricotta.services.jobs import consume, job_queue
+from ricotta.services.redis_client import close_redis
+
+logger = logging.getLogger(__name__)
+
+
+async def serve(concurrency: int):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    logger.info(f"Worker consuming generation jobs with {concurrency} consumers")
+    try:
+        await asyncio.gather(*[consume(job_queue, stop) for _ in range(concurrency)])
+    finally:
+        await job_queue.close()
+        await close_session()
+        await close_redis()
+
+
+def run(concurrency: int):
+    try:
+        asyncio.run(serve(concurrency))
+    finally:
+        # child processes exit without running atexit hooks, so queued records are written out here
+        stop_logging()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=config.generation_concurrency)
+    args = parser.parse_args()
+
+    if config.job_queue_backend != 'redis':
+        raise SystemExit("Worker processes need JOB_QUEUE_BACKEND=redis; the memory backend runs jobs inside the API")
+
+    if args.processes == 1:
+        run(args.concurrency)
+        return
+
+    processes = [multiprocessing.Process(target=run, args=(args.concurrency,)) for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+
+    def terminate(signum, frame):
+        for process in processes:
+            process.terminate()
+
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, terminate)
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
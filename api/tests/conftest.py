@@ -0,0 +1,78 @@
+"""The API runs in process against a temporary SQLite database, without Redis, with the fake OpenAI server from the
+benchmarks as its upstream."""
+import os
+import tempfile
+import threading
+import uuid
+
+import pytest
+
+# read by ricotta.config on import, so set before the app is imported
+os.environ.update(
+    ENVIRONMENT="development",
+    DATABASE_URI="sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db"),
+    REDIS_URL="",
+    LOG_SINKS="none",
+    OPENAI_API_KEY="fake",
+    OPENAI_MAX_RETRIES="0",
+    OPENAI_JSON_RETRIES="0",
+    ADMISSION_ENABLED="false",
+)
+
+import fake_openai  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from ricotta.config import config  # noqa: E402
+from ricotta.main import app  # noqa: E402
+from ricotta.services.card_store import save_generated_cards  # noqa: E402
+from ricotta.services.database import SessionLocal  # noqa: E402
+from ricotta.services.openai_client import openai_client  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    # one client for the session, since sse-starlette keeps state bound to the event loop of the first one
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Starts the fake OpenAI server with the given options and points generations at it."""
+    servers = []
+
+    def start(**options):
+        server = fake_openai.serve(port=0, **options)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        monkeypatch.setattr(config, "openai_api_base", f"http://127.0.0.1:{server.server_address[1]}/v1")
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+    # so that failures injected by one test do not leave the circuit open for the next
+    openai_client.breakers.clear()
+
+
+@pytest.fixture
+def new_user(client):
+    """Creates users with unique names through the API and returns their usernames."""
+
+    def create():
+        username = f"user{uuid.uuid4().hex[:8]}"
+        assert client.post("/user/", json={"username": username}).status_code == 200
+        return username
+
+    return create
+
+
+@pytest.fixture
+def new_cards():
+    """Stores `count` random cards in `language` and returns their payloads."""
+
+    def create(count, language="Italian"):
+        with SessionLocal() as db:
+            return save_generated_cards(db, fake_openai.fake_words(count), language)
+
+    return create
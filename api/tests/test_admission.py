@@ -0,0 +1,82 @@
+import asyncio
+import uuid
+
+from starlette.requests import Request
+
+from ricotta.config import config
+from ricotta.services.admission import GENERATION, READ, AdmissionController, LocalBuckets, budgets, classify, client_ip
+
+
+def request(ip="10.0.0.1", forwarded=None, api_key=None, path="/card/generate"):
+    headers = []
+    if forwarded:
+        headers.append((b"x-forwarded-for", forwarded.encode()))
+    if api_key:
+        headers.append((b"x-openai-key", api_key.encode()))
+    return Request({"type": "http", "method": "POST", "path": path, "headers": headers, "client": (ip, 1234),
+                    "query_string": b""})
+
+
+def test_a_bucket_admits_its_burst_then_refuses_until_refilled():
+    buckets = LocalBuckets(100)
+    bucket = [("client", "ip:1", 1.0, 3)]
+
+    assert [buckets.take(bucket, now=100.0)[0] for _ in range(3)] == [0, 0, 0]
+    denied, wait = buckets.take(bucket, now=100.0)
+    assert denied == 1 and wait == 1.0
+    assert buckets.take(bucket, now=101.0)[0] == 0
+
+
+def test_a_request_takes_from_every_bucket_or_from_none():
+    buckets = LocalBuckets(100)
+    client, key = ("client", "ip:2", 1.0, 5), ("key", "key:2", 1.0, 1)
+
+    assert buckets.take([client, key], now=0.0)[0] == 0
+    # the key bucket is empty, so the client bucket keeps its tokens
+    assert buckets.take([client, key], now=0.0)[0] == 2
+    assert [buckets.take([client], now=0.0)[0] for _ in range(5)] == [0, 0, 0, 0, 1]
+
+
+def test_clients_are_told_apart_by_the_hop_the_trusted_proxy_added(monkeypatch):
+    monkeypatch.setattr(config, "admission_trusted_proxies", 1)
+    assert client_ip(request(ip="172.18.0.2", forwarded="1.1.1.1, 203.0.113.7")) == "203.0.113.7"
+    assert client_ip(request(ip="172.18.0.2")) == "172.18.0.2"
+
+    monkeypatch.setattr(config, "admission_trusted_proxies", 0)
+    assert client_ip(request(ip="172.18.0.2", forwarded="203.0.113.7")) == "172.18.0.2"
+
+
+def test_requests_are_classified_by_budget():
+    assert classify("POST", "/card/generate") == GENERATION
+    assert classify("POST", "/api/card/generate/stream") == GENERATION
+    assert classify("GET", "/card/review") == READ
+    assert classify("GET", "/ping") is None
+    assert classify("OPTIONS", "/card/generate") is None
+
+
+def test_the_default_limits_admit_a_classroom_behind_one_address():
+    controller = AdmissionController()
+    ip = f"10.9.{uuid.uuid4().int % 250}.1"
+
+    async def generations(count):
+        return [await controller.take(budgets(GENERATION, request(ip=ip))) for _ in range(count)]
+
+    results = asyncio.run(generations(config.admission_generation_burst + 1))
+    assert all(denied is None for denied, _ in results[:40])
+    assert results[-1][0] == "client"
+
+
+def test_a_refused_request_gets_429_with_retry_after(client, monkeypatch):
+    monkeypatch.setattr(config, "admission_enabled", True)
+    monkeypatch.setattr(config, "admission_reads_per_minute", 60)
+    monkeypatch.setattr(config, "admission_read_burst", 2)
+    ip = f"10.8.{uuid.uuid4().int % 250}.1"
+    monkeypatch.setattr(config, "admission_trusted_proxies", 1)
+    headers = {"X-Forwarded-For": ip}
+
+    statuses = [client.get("/card/", headers=headers, params={"language": "Italian"}).status_code for _ in range(3)]
+
+    assert statuses[:2] == [200, 200] and statuses[2] == 429
+    refused = client.get("/card/", headers=headers, params={"language": "Italian"})
+    assert refused.status_code == 429 and int(refused.headers["Retry-After"]) >= 1
+    assert client.get("/ping", headers=headers).status_code == 200
@@ -0,0 +1,115 @@
+from datetime import timedelta
+
+from ricotta.config import config
+from ricotta.models.card import AnswerReceipt
+from ricotta.services import answers
+from ricotta.services.database import SessionLocal
+from ricotta.services.scheduler import utcnow
+
+
+def post_answers(client, username, card_id, key, correct=True):
+    return client.post("/card/answers", headers={"Idempotency-Key": key},
+                       json={"username": username, "answers": [{"card_id": card_id, "correct": correct}]})
+
+
+def receipt_keys(username):
+    with SessionLocal() as db:
+        return {receipt.idempotency_key for receipt in db.query(AnswerReceipt)
+                if receipt.idempotency_key.startswith(username)}
+
+
+def expire_receipts(username):
+    with SessionLocal() as db:
+        for receipt in db.query(AnswerReceipt):
+            if receipt.idempotency_key.startswith(username):
+                receipt.created_at = utcnow() - timedelta(days=30)
+        db.commit()
+
+
+def test_expired_receipts_are_pruned_while_answers_are_recorded(client, new_user, new_cards, monkeypatch):
+    username, card = new_user(), new_cards(1)[0]
+    assert post_answers(client, username, card["id"], f"{username}-1").status_code == 200
+    expire_receipts(username)
+
+    monkeypatch.setattr(answers, "_next_prune", 0.0)
+    assert post_answers(client, username, card["id"], f"{username}-2").status_code == 200
+
+    assert receipt_keys(username) == {f"{username}-2"}
+
+
+def test_receipts_are_pruned_a_bounded_batch_at_a_time(client, new_user, new_cards, monkeypatch):
+    username, card = new_user(), new_cards(1)[0]
+    for number in range(3):
+        assert post_answers(client, username, card["id"], f"{username}-{number}").status_code == 200
+    expire_receipts(username)
+    # older receipts of other tests are expired too, so only this test's are counted
+    with SessionLocal() as db:
+        answers.prune_answer_receipts(db)
+    for number in range(3, 6):
+        assert post_answers(client, username, card["id"], f"{username}-{number}").status_code == 200
+    expire_receipts(username)
+
+    monkeypatch.setattr(config, "answer_receipt_prune_batch", 2)
+    monkeypatch.setattr(answers, "_next_prune", 0.0)
+    assert post_answers(client, username, card["id"], f"{username}-new").status_code == 200
+
+    assert len(receipt_keys(username)) == 2
+    assert f"{username}-new" in receipt_keys(username)
+
+
+def test_receipts_are_not_pruned_again_before_the_interval(client, new_user, new_cards, monkeypatch):
+    username, card = new_user(), new_cards(1)[0]
+    monkeypatch.setattr(answers, "_next_prune", 0.0)
+    assert post_answers(client, username, card["id"], f"{username}-1").status_code == 200
+    expire_receipts(username)
+
+    assert post_answers(client, username, card["id"], f"{username}-2").status_code == 200
+
+    assert receipt_keys(username) == {f"{username}-1", f"{username}-2"}
+
+
+def test_answers_add_up_across_batches_and_single_marks(client, new_user, new_cards):
+    username = new_user()
+    first, second = new_cards(2)
+    batch = [{"card_id": first["id"], "correct": True}, {"card_id": first["id"], "correct": False},
+             {"card_id": second["id"], "correct": True}]
+    response = client.post("/card/answers", json={"username": username, "answers": batch})
+    assert response.status_code == 200
+    counts = {card["id"]: (card["times_seen"], card["times_correct"]) for card in response.json()["cards"]}
+    assert counts == {first["id"]: (2, 1), second["id"]: (1, 1)}
+
+    marked = client.post(f"/card/{first['id']}", json={"username": username, "correct": True})
+
+    assert marked.status_code == 200
+    assert (marked.json()["times_seen"], marked.json()["times_correct"]) == (3, 2)
+
+
+def test_a_replayed_batch_returns_the_stored_response_without_counting_again(client, new_user, new_cards):
+    username, card = new_user(), new_cards(1)[0]
+    first = post_answers(client, username, card["id"], f"{username}-replay")
+
+    replay = post_answers(client, username, card["id"], f"{username}-replay", correct=False)
+
+    assert replay.status_code == 200 and replay.json() == first.json()
+    assert first.json()["cards"][0]["times_seen"] == 1
+    other = post_answers(client, username, card["id"], f"{username}-other")
+    assert (other.json()["cards"][0]["times_seen"], other.json()["cards"][0]["times_correct"]) == (2, 2)
+
+
+def test_idempotency_keys_are_scoped_to_the_user(client, new_user, new_cards):
+    card = new_cards(1)[0]
+    alice, bob = new_user(), new_user()
+    post_answers(client, alice, card["id"], "shared-key")
+
+    response = post_answers(client, bob, card["id"], "shared-key", correct=False)
+
+    assert (response.json()["cards"][0]["times_seen"], response.json()["cards"][0]["times_correct"]) == (1, 0)
+
+
+def test_a_batch_with_an_unknown_card_records_nothing(client, new_user, new_cards):
+    username, card = new_user(), new_cards(1)[0]
+    batch = [{"card_id": card["id"], "correct": True}, {"card_id": 10 ** 9, "correct": True}]
+
+    assert client.post("/card/answers", json={"username": username, "answers": batch}).status_code == 404
+
+    assert post_answers(client, username, card["id"], f"{username}-1").json()["cards"][0]["times_seen"] == 1
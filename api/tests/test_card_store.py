@@ -0,0 +1,62 @@
+import asyncio
+
+import fake_openai
+
+from ricotta.models.card import Card
+from ricotta.services import card_cache as card_cache_module
+from ricotta.services.card_cache import CardPayloadCache, get_card_payloads
+from ricotta.services.card_store import save_generated_cards
+from ricotta.services.database import SessionLocal
+
+
+def test_stored_sentences_are_returned_as_the_existing_cards(client, new_cards):
+    stored = new_cards(1)[0]
+    word = {"word": "altro", "english": "other", "sentenceLANG": stored["sentenceLANG"], "sentenceEN": "Other.",
+            "incorrect_options": ["a", "b", "c"]}
+    fresh = fake_openai.fake_words(1)
+
+    with SessionLocal() as db:
+        cards = save_generated_cards(db, [word] + fresh, "Italian")
+        count = db.query(Card).filter(Card.sentenceLANG == stored["sentenceLANG"]).count()
+
+    assert cards[0] == stored
+    assert cards[1]["sentenceLANG"] == fresh[0]["sentenceLANG"] and cards[1]["id"] != stored["id"]
+    assert count == 1
+
+
+def test_malformed_and_repeated_words_are_skipped(client):
+    word, = fake_openai.fake_words(1)
+
+    with SessionLocal() as db:
+        cards = save_generated_cards(db, [word, {"word": "senza frase"}, dict(word, word="doppio")], "Italian")
+
+    assert [card["word"] for card in cards] == [word["word"]]
+    assert cards[0]["options"] == [word["english"]] + word["incorrect_options"]
+
+
+def test_card_payloads_are_loaded_once_then_served_from_the_cache(client, new_cards, monkeypatch):
+    cache = CardPayloadCache(max_entries=100)
+    monkeypatch.setattr(card_cache_module, "card_cache", cache)
+    cards = new_cards(3)
+    card_ids = [card["id"] for card in reversed(cards)]
+
+    with SessionLocal() as db:
+        first = asyncio.run(get_card_payloads(db, card_ids + [10 ** 9]))
+    assert first == list(reversed(cards))
+    assert (cache.hits, cache.misses) == (0, 4)
+
+    with SessionLocal() as db:
+        second = asyncio.run(get_card_payloads(db, card_ids))
+    assert second == first
+    assert (cache.hits, cache.misses) == (3, 4)
+
+
+def test_cached_payloads_are_returned_as_copies():
+    cache = CardPayloadCache(max_entries=100)
+    payload = {"id": 1, "options": ["one", "two"]}
+    asyncio.run(cache.set_many([payload]))
+
+    found = asyncio.run(cache.get_many([1, 2]))
+    found[1]["options"].reverse()
+
+    assert asyncio.run(cache.get_many([1])) == {1: payload}
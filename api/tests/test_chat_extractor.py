@@ -0,0 +1,42 @@
+import asyncio
+
+from ricotta.config import config
+from ricotta.services import chat_extractor
+from ricotta.services.chat_extractor import ChatExtractor
+
+
+def test_stream_gives_its_slot_back_before_the_caller_has_taken_every_word(upstream, monkeypatch):
+    upstream()
+    semaphore = asyncio.Semaphore(1)
+    monkeypatch.setattr(chat_extractor, "generation_semaphore", semaphore)
+    # a session of this test's own event loop
+    monkeypatch.setattr(chat_extractor, "_session", None)
+
+    async def read_slowly():
+        chat = ChatExtractor(model_key="fake", model="fake", api_base=config.openai_api_base)
+        words = chat.stream("food", [], "Italian")
+        first = await words.__anext__()
+        # the fake answers at once, so by now the whole answer has been read
+        await asyncio.sleep(0.5)
+        locked = semaphore.locked()
+        rest = [word async for word in words]
+        await chat_extractor.close_session()
+        return first, locked, rest
+
+    first, locked, rest = asyncio.run(read_slowly())
+    assert not locked
+    assert len([first, *rest]) == 5
+
+
+def test_prompt_tokens_are_only_counted_for_debug_logs(monkeypatch):
+    counted = []
+    monkeypatch.setattr(chat_extractor, "count_tokens", lambda text, model=None: counted.append(text) or 0)
+    chat = ChatExtractor(model_key="fake", model="fake")
+
+    monkeypatch.setattr(chat_extractor.logger, "isEnabledFor", lambda level: False)
+    chat._messages("food", ["pane"], "Italian")
+    assert counted == []
+
+    monkeypatch.setattr(chat_extractor.logger, "isEnabledFor", lambda level: True)
+    chat._messages("food", ["pane"], "Italian")
+    assert len(counted) == 1
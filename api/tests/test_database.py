@@ -0,0 +1,25 @@
+import asyncio
+import os
+import tempfile
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from ricotta.config import config
+from ricotta.services.database import async_database_uri, engine_options
+
+
+def test_async_engine_on_a_sqlite_file_is_pooled_with_the_configured_size():
+    uri = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "async.db")
+    engine = create_async_engine(async_database_uri(uri), **engine_options(uri, is_async=True))
+
+    async def query():
+        async with engine.connect() as conn:
+            value = (await conn.execute(text("SELECT 1"))).scalar()
+        await engine.dispose()
+        return value
+
+    assert isinstance(engine.pool, AsyncAdaptedQueuePool)
+    assert engine.pool.size() == config.db_pool_size
+    assert asyncio.run(query()) == 1
@@ -0,0 +1,101 @@
+import json
+import time
+import uuid
+
+
+def stream_events(client, subject, params=None):
+    """Posts to the stream endpoint and returns its (event, data) pairs."""
+    events, event = [], {}
+    body = {"subject": subject, "language": "Italian"}
+    with client.stream("POST", "/card/generate/stream", json=body, params=params) as response:
+        assert response.status_code == 200
+        for line in response.iter_lines():
+            if not line:
+                if event:
+                    events.append((event["event"], json.loads(event["data"])))
+                    event = {}
+                continue
+            field, _, value = line.partition(":")
+            event[field] = value.strip()
+    if event:
+        events.append((event["event"], json.loads(event["data"])))
+    return events
+
+
+def new_subject():
+    # generations are cached by subject, so every test asks for its own
+    return f"subject {uuid.uuid4().hex[:8]}"
+
+
+def test_stream_sends_each_card_then_done(client, upstream):
+    upstream(latency=0.2)
+    events = stream_events(client, new_subject())
+
+    assert [name for name, _ in events] == ["card"] * 5 + ["done"]
+    assert events[-1][1] == {"count": 5}
+    for _, card in events[:-1]:
+        assert card["id"]
+        assert card["language"] == "Italian"
+        assert card["correct"] in card["options"]
+        assert len(card["options"]) == 4
+
+
+def test_stream_replays_a_cached_generation(client, upstream):
+    upstream()
+    subject = new_subject()
+    first = stream_events(client, subject)
+    second = stream_events(client, subject.upper())
+
+    assert [card["id"] for name, card in second if name == "card"] == [card["id"] for name, card in first if name == "card"]
+    assert second[-1] == ("done", {"count": 5})
+
+
+def test_stream_reports_upstream_failure_as_error_event(client, upstream):
+    upstream(failure_rate=1.0)
+    events = stream_events(client, new_subject())
+
+    assert events == [("error", {"detail": "An unexpected error occurred"})]
+
+
+def test_stream_sends_the_cards_written_before_a_malformed_end(client, upstream):
+    # the fake cuts malformed answers in half, so only the words completed before the cut can be sent
+    upstream(malformed_rate=1.0)
+    events = stream_events(client, new_subject())
+
+    names = [name for name, _ in events]
+    assert names[-1] == "done"
+    assert set(names[:-1]) <= {"card"}
+    assert events[-1][1] == {"count": len(names) - 1}
+
+
+def test_stream_sends_compact_cards_when_asked(client, upstream):
+    upstream()
+    subject = new_subject()
+    for _ in range(2):
+        # the second time from the generation cache
+        events = stream_events(client, subject, params={"format": "compact"})
+
+        assert events[-1] == ("done", {"count": 5, "format": "compact.v1", "language": "Italian"})
+        for _, card in events[:-1]:
+            assert "language" not in card and "correct" not in card
+            assert 0 <= card["answer"] < len(card["options"])
+
+
+def test_background_job_cards_honor_the_compact_format(client, upstream):
+    upstream()
+    response = client.post("/card/generate", params={"background": "true"},
+                           json={"subject": new_subject(), "language": "Italian"})
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    deadline = time.monotonic() + 10
+    while (job := client.get(f"/card/jobs/{job_id}", params={"format": "compact"}).json())["status"] != "done":
+        assert job["status"] in ("queued", "running") and time.monotonic() < deadline
+        time.sleep(0.05)
+
+    assert job["job_id"] == job_id
+    assert job["format"] == "compact.v1" and job["language"] == "Italian"
+    assert len(job["cards"]) == 5
+    assert all("answer" in card for card in job["cards"])
+    full = client.get(f"/card/jobs/{job_id}").json()
+    assert all(card["correct"] in card["options"] for card in full["cards"])
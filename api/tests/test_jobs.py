@@ -0,0 +1,28 @@
+import asyncio
+
+from ricotta.services.jobs import DONE, MemoryJobQueue
+
+
+def test_memory_job_records_expire_after_the_job_ttl():
+    queue = MemoryJobQueue()
+    queue.jobs.ttl = 0.05
+
+    async def run():
+        job = await queue.enqueue("Italian", "food")
+        await queue.update(job["id"], status=DONE, cards=[{"id": 1}])
+        assert (await queue.get(job["id"]))["status"] == DONE
+        await asyncio.sleep(0.1)
+        return await queue.get(job["id"])
+
+    assert asyncio.run(run()) is None
+
+
+def test_memory_job_records_are_bounded():
+    queue = MemoryJobQueue(max_entries=2)
+
+    async def run():
+        return [await queue.enqueue("Italian", f"subject {number}") for number in range(3)]
+
+    first, *rest = asyncio.run(run())
+    assert len(queue.jobs) == 2
+    assert asyncio.run(queue.get(first["id"])) is None
@@ -0,0 +1,68 @@
+import json
+import random
+
+import pytest
+
+from ricotta.services.json_stream import ArrayItemParser, loads_lenient
+
+WORDS = [
+    {"word": "gatto", "english": "cat", "incorrect_options": ["dog", "mouse", "bird"],
+     "sentenceLANG": "Il gatto dorme.", "sentenceEN": "The cat sleeps."},
+    {"word": "\"virgolette\"", "english": "quotes \\ and a backslash", "incorrect_options": ["}", "]", "{["],
+     "sentenceLANG": "Le \"virgolette\" e le parentesi [come queste] o {queste}.", "sentenceEN": "Quotes, brackets."},
+    {"word": "caffè", "english": "coffee", "incorrect_options": [], "nested": {"list": [{"deep": True}], "text": "}"},
+     "sentenceLANG": "Un caffè, per favore.", "sentenceEN": "A coffee, please."},
+]
+
+
+def feed_all(pieces):
+    parser = ArrayItemParser()
+    items = []
+    for piece in pieces:
+        items.extend(parser.feed(piece))
+    return items
+
+
+@pytest.mark.parametrize("text", [json.dumps({"words": WORDS}), json.dumps(WORDS), json.dumps({"words": WORDS}, indent=2)])
+def test_items_are_found_at_every_split(text):
+    for split in range(len(text) + 1):
+        assert feed_all([text[:split], text[split:]]) == WORDS
+
+
+def test_items_are_found_one_character_at_a_time():
+    assert feed_all(json.dumps({"words": WORDS})) == WORDS
+
+
+def test_items_are_found_in_random_pieces():
+    text = json.dumps({"words": WORDS})
+    rng = random.Random(7)
+    for _ in range(200):
+        cuts = sorted(rng.sample(range(1, len(text)), rng.randint(1, 20)))
+        pieces = [text[start:end] for start, end in zip([0] + cuts, cuts + [len(text)])]
+        assert feed_all(pieces) == WORDS
+
+
+def test_escaped_quotes_and_brackets_in_strings_do_not_end_an_item():
+    text = '[{"a": "\\"}\\"", "b": "] }"}, {"c": "\\\\"}]'
+    assert feed_all([text]) == [{"a": '"}"', "b": "] }"}, {"c": "\\"}]
+
+
+def test_each_item_is_returned_as_soon_as_it_is_closed():
+    parser = ArrayItemParser()
+    text = json.dumps({"words": WORDS})
+    first_end = text.index(json.dumps(WORDS[0])) + len(json.dumps(WORDS[0]))
+
+    assert parser.feed(text[:first_end - 1]) == []
+    assert parser.feed(text[first_end - 1:first_end]) == [WORDS[0]]
+
+
+def test_an_item_that_is_not_json_is_skipped():
+    assert feed_all(['[{"a": 1,}, {"b": 2}]']) == [{"b": 2}]
+
+
+def test_objects_that_are_not_in_an_array_are_not_items():
+    assert feed_all(['{"meta": {"a": 1}, "words": []}']) == []
+
+
+def test_loads_lenient_repairs_fences_prose_and_trailing_commas():
+    assert loads_lenient('Sure!\n```json\n{"words": [{"a": 1},],}\n```') == {"words": [{"a": 1}]}
@@ -0,0 +1,49 @@
+import pytest
+
+from ricotta.config import config
+from ricotta.services.generation import known_words, save_cards
+from ricotta.services.sentence_index import duplicates, fold
+
+LANGUAGE = "French"
+STORED = "Chaque matin avant le travail je bois un café chaud dans la cuisine."
+
+
+def word(word, sentence):
+    return {"word": word, "english": f"{word} in english", "incorrect_options": ["a", "b", "c"],
+            "sentenceLANG": sentence, "sentenceEN": f"{sentence} in english"}
+
+
+@pytest.fixture(scope="module")
+def stored(client):
+    known_words(LANGUAGE, "breakfast")
+    return save_cards([word("café", STORED)], LANGUAGE)[0]
+
+
+def saved_words(words):
+    known_words(LANGUAGE, "breakfast")
+    return [card["word"] for card in save_cards(words, LANGUAGE)]
+
+
+def test_a_rewording_for_another_word_of_the_sentence_is_dropped(stored):
+    assert config.near_duplicate_enabled
+    assert saved_words([word("matin", "Chaque matin avant le travail je bois un café bien chaud dans la cuisine!")]) == []
+
+
+def test_the_sentence_with_the_word_swapped_is_a_new_card(stored):
+    assert saved_words([word("thé", "Chaque matin avant le travail je bois un thé chaud dans la cuisine.")]) == ["thé"]
+
+
+def test_rewordings_within_a_batch_are_dropped(stored):
+    sentence = "Le dimanche nous allons au marché avec les enfants pour acheter des fruits."
+    words = [word("marché", sentence), word("enfants", sentence.replace("les enfants", "nos enfants"))]
+
+    assert saved_words(words) == ["marché"]
+
+
+def test_words_are_compared_as_folded_strings():
+    assert fold("Café!") == fold("cafe") == "cafe"
+    assert duplicates("cafe", fold("Un café, merci"), "cafe")
+    assert duplicates("merci", fold("Un café, merci"), "cafe")
+    assert not duplicates("the", fold("Un thé, merci"), "cafe")
+    # a word that is only part of another is not used by the sentence
+    assert not duplicates("the", fold("Un cafetière, merci"), "cafe")
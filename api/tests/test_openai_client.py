@@ -0,0 +1,19 @@
+from ricotta.services.openai_client import ResilientClient
+
+
+def test_buckets_are_kept_by_a_hash_of_the_key():
+    client = ResilientClient()
+    bucket = client.bucket("sk-caller")
+
+    assert client.bucket("sk-caller") is bucket
+    assert client.bucket("sk-other") is not bucket
+    assert not any("sk-" in key for key in client.buckets.entries)
+
+
+def test_buckets_are_bounded():
+    client = ResilientClient()
+    client.buckets.max_entries = 3
+    for number in range(10):
+        client.bucket(f"sk-{number}")
+
+    assert len(client.buckets) == 3
@@ -0,0 +1,46 @@
+import json
+from datetime import timedelta
+
+from sqlalchemy import inspect, text
+
+from ricotta.models.card import AnswerReceipt
+from ricotta.models.user import User
+from ricotta.services.answers import prune_answer_receipts
+from ricotta.services.database import SessionLocal, create_missing_indexes, engine
+from ricotta.services.scheduler import utcnow
+
+OLD_INDEX = "ix_ricotta__user_card_interactions_user_id_card_id"
+
+
+def interaction_indexes():
+    return {index["name"]: index["unique"] for index in inspect(engine).get_indexes("ricotta__user_card_interactions")}
+
+
+def test_the_unique_index_replaces_the_old_one_of_the_same_columns(client):
+    # a database prepared before the index was unique
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ix_ricotta__user_card_interactions_user_id_card_id_unique"))
+        conn.execute(text(f"CREATE INDEX {OLD_INDEX} ON ricotta__user_card_interactions (user_id, card_id)"))
+
+    create_missing_indexes()
+
+    indexes = interaction_indexes()
+    assert indexes["ix_ricotta__user_card_interactions_user_id_card_id_unique"]
+    assert OLD_INDEX not in indexes
+
+
+def test_old_answer_receipts_are_pruned(client):
+    now = utcnow()
+    with SessionLocal() as db:
+        user = User(username="receipts")
+        db.add(user)
+        db.flush()
+        db.add_all([
+            AnswerReceipt(user_id=user.id, idempotency_key="old", response=json.dumps({}), created_at=now - timedelta(days=30)),
+            AnswerReceipt(user_id=user.id, idempotency_key="new", response=json.dumps({}), created_at=now),
+        ])
+        db.commit()
+
+        # receipts that other tests expired go too
+        assert prune_answer_receipts(db) >= 1
+        assert [receipt.idempotency_key for receipt in db.query(AnswerReceipt).filter_by(user_id=user.id)] == ["new"]
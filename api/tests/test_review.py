@@ -0,0 +1,14 @@
+import pytest
+
+
+@pytest.mark.parametrize("limit", [0, -1])
+def test_review_rejects_a_limit_below_one(client, limit):
+    response = client.get("/card/review", params={"username": "reviewer", "language": "Italian", "limit": limit})
+
+    assert response.status_code == 422
+
+
+def test_review_accepts_a_positive_limit(client):
+    response = client.get("/card/review", params={"username": "reviewer", "language": "Italian", "limit": 5})
+
+    assert response.status_code == 200
@@ -0,0 +1,25 @@
+import asyncio
+
+from prometheus_client import CollectorRegistry, Counter
+
+from ricotta.services.single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_the_leader_and_are_counted():
+    registry = CollectorRegistry()
+    counter = Counter("flight", "test", ["role"], registry=registry)
+    flight = SingleFlight(counter=counter)
+    calls = []
+
+    async def work(key):
+        calls.append(key)
+        await asyncio.sleep(0.05)
+        return key
+
+    async def run():
+        return await asyncio.gather(*[flight.do(key, lambda key=key: work(key)) for key in ["a", "a", "a", "b"]])
+
+    assert asyncio.run(run()) == ["a", "a", "a", "b"]
+    assert calls == ["a", "b"]
+    assert registry.get_sample_value("flight_total", {"role": "leader"}) == 2
+    assert registry.get_sample_value("flight_total", {"role": "coalesced"}) == 2
@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+from ricotta.models.user import UserLanguageStats
+from ricotta.services.stats import _advance_streak, stats_payload
+
+
+def answer(card, correct, answered_at=None):
+    return {"card_id": card["id"], "correct": correct, **({"answered_at": answered_at} if answered_at else {})}
+
+
+def test_stats_add_up_answers_per_language(client, new_user, new_cards):
+    username = new_user()
+    first, second = new_cards(2)
+    french, = new_cards(1, language="French")
+    batches = [[answer(first, True), answer(second, False), answer(french, True)],
+               [answer(first, True), answer(first, False)]]
+    for batch in batches:
+        assert client.post("/card/answers", json={"username": username, "answers": batch}).status_code == 200
+    assert client.post(f"/card/{second['id']}", json={"username": username, "correct": True}).status_code == 200
+
+    response = client.get(f"/user/{username}/stats")
+
+    assert response.status_code == 200
+    languages = {stats["language"]: stats for stats in response.json()["languages"]}
+    assert [stats["language"] for stats in response.json()["languages"]] == ["French", "Italian"]
+    italian = languages["Italian"]
+    assert (italian["cards_seen"], italian["answers"], italian["correct"], italian["accuracy"]) == (2, 5, 3, 0.6)
+    assert italian["streak_days"] == 1 and italian["last_activity_at"] is not None
+    assert (languages["French"]["cards_seen"], languages["French"]["answers"], languages["French"]["accuracy"]) == (1, 1, 1.0)
+
+
+def test_stats_are_filtered_by_language(client, new_user, new_cards):
+    username, card = new_user(), new_cards(1)[0]
+    client.post("/card/answers", json={"username": username, "answers": [answer(card, True)]})
+
+    assert client.get(f"/user/{username}/stats", params={"language": "French"}).json()["languages"] == []
+    assert len(client.get(f"/user/{username}/stats", params={"language": "Italian"}).json()["languages"]) == 1
+    assert client.get(f"/user/{username}/stats", params={"language": "Klingon"}).status_code == 400
+
+
+def test_stats_of_a_new_and_of_an_unknown_user(client, new_user):
+    assert client.get(f"/user/{new_user()}/stats").json()["languages"] == []
+    assert client.get("/user/nobody-at-all/stats").status_code == 404
+
+
+def test_a_replayed_batch_is_not_counted_again(client, new_user, new_cards):
+    username, card = new_user(), new_cards(1)[0]
+    for _ in range(2):
+        client.post("/card/answers", headers={"Idempotency-Key": f"{username}-1"},
+                    json={"username": username, "answers": [answer(card, True)]})
+
+    stats, = client.get(f"/user/{username}/stats").json()["languages"]
+
+    assert (stats["cards_seen"], stats["answers"]) == (1, 1)
+
+
+def test_streaks_count_consecutive_days():
+    day = datetime(2024, 5, 1, 9)
+    streak = (0, None)
+    for answered_at in [day, day + timedelta(hours=5), day + timedelta(days=1), day + timedelta(days=2)]:
+        streak = _advance_streak(*streak, answered_at)
+    assert streak == (3, day + timedelta(days=2))
+
+    # an offline answer from before the last activity leaves the streak alone
+    assert _advance_streak(*streak, day) == streak
+    assert _advance_streak(*streak, day + timedelta(days=5)) == (1, day + timedelta(days=5))
+
+
+def test_a_streak_lapses_after_a_missed_day():
+    stats = UserLanguageStats(language="Italian", cards_seen=1, answers=2, correct=1, streak_days=4,
+                              last_activity_at=datetime(2024, 5, 1, 9))
+
+    assert stats_payload(stats, now=datetime(2024, 5, 2, 20))["streak_days"] == 4
+    assert stats_payload(stats, now=datetime(2024, 5, 3, 8))["streak_days"] == 0
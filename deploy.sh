@@ -19,33 +19,46 @@ detect_cpu_features() {
 	fi
 }
 
-# Handle termination signals
+# Handle termination signals: the API and job workers drain first, Redis goes last since they still use it
 _term() {
 	echo "Received termination signal!"
-	kill -TERM "$redis_process" 2>/dev/null
 	kill -TERM "$ricotta_api_process" 2>/dev/null
+	kill -TERM "$ricotta_worker_process" 2>/dev/null
+	wait $ricotta_api_process $ricotta_worker_process
+	kill -TERM "$redis_process" 2>/dev/null
 }
 
 # Start Redis instance
 redis-server /etc/redis/redis.conf &
 redis_process=$!
 
-# Start the API
+# Several API workers share caches, coalesced generations and background jobs through the bundled Redis
+export JOB_QUEUE_BACKEND="${JOB_QUEUE_BACKEND:-redis}"
+export GENERATION_LOCK_ENABLED="${GENERATION_LOCK_ENABLED:-true}"
+
+# Prepare the database once, then start the API with API_WORKERS processes (one per core by default)
 cd /usr/src/app/api || exit 1
-hypercorn_cmd="hypercorn src.ricotta.main:app --bind 0.0.0.0:9124"
+python -m ricotta.prepare || {
+	echo 'Failed to prepare the database'
+	exit 1
+}
+
+bind_args="--bind 0.0.0.0:9124"
 if [ "$RICOTTA_API_ENABLE_IPV6" = true ] && [ "$RICOTTA_API_ENABLE_IPV4" != true ]; then
-	hypercorn_cmd="hypercorn src.ricotta.main:app --bind [::]:9124"
+	bind_args="--bind [::]:9124"
 elif [ "$RICOTTA_API_ENABLE_IPV4" = true ] && [ "$RICOTTA_API_ENABLE_IPV6" = true ]; then
-	hypercorn_cmd="hypercorn src.ricotta.main:app --bind 0.0.0.0:9124 --bind [::]:9124"
+	bind_args="--bind 0.0.0.0:9124 --bind [::]:9124"
 fi
 
-$hypercorn_cmd || {
-	echo 'Failed to start main app'
-	exit 1
-} &
-
+python -m ricotta.serve $bind_args --skip-prepare &
 ricotta_api_process=$!
 
+# Start the generation job workers, which only run separately when jobs are queued in Redis
+if [ "$JOB_QUEUE_BACKEND" = redis ]; then
+	python -m ricotta.worker --processes "${RICOTTA_JOB_WORKER_PROCESSES:-1}" &
+	ricotta_worker_process=$!
+fi
+
 # Set up a signal trap and wait for processes to finish
 trap _term TERM
-wait $redis_process $ricotta_api_process
+wait $redis_process $ricotta_api_process $ricotta_worker_process
@@ -1,12 +1,25 @@
-import pandas as pd
+"""Dumps the card tables of a SQLite database to CSV, streaming rows so that large databases fit in memory.
+
+    python convert-sqlite-to-csv.py ../api/src/ricotta/services/local.db
+
+For backups and migrations between databases, prefer `python -m ricotta.transfer export` in the API.
+"""
+import csv
 import sqlite3
+import sys
+
+TABLES = {
+    "ricotta__cards": "cards.csv",
+    "ricotta__incorrect_options": "incorrect_options.csv",
+}
 
-conn = sqlite3.connect(
-    database="./../api/src/ricotta/services/local.db",
-    isolation_level=None,
-    detect_types=sqlite3.PARSE_COLNAMES
-)
-db_df = pd.read_sql_query("SELECT * FROM cards", conn)
-db_df.to_csv('cards.csv', index=False)
-db_df = pd.read_sql_query("SELECT * FROM incorrect_options", conn)
-db_df.to_csv('incorrect_options.csv', index=False)
+database = sys.argv[1] if len(sys.argv) > 1 else "./../api/src/ricotta/services/local.db"
+conn = sqlite3.connect(f"file:{database}?mode=ro", uri=True)
+for table, filename in TABLES.items():
+    cursor = conn.execute(f"SELECT * FROM {table}")
+    with open(filename, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(column[0] for column in cursor.description)
+        while rows := cursor.fetchmany(10000):
+            writer.writerows(rows)
+conn.close()